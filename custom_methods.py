@@ -1,10 +1,9 @@
 import pandas as pd
 import numpy as np
-import matplotlib.pyplot as plt
 import matplotlib.dates as mdates
 import datetime
 
-import data_visualization_functions as vis
+import data_handling_support_functions as sup
 
 
 def load_source(source_path):
@@ -13,7 +12,7 @@ def load_source(source_path):
 
 
     '''
-    source = pd.read_csv(source_path, sep=';')
+    source = sup.read_csv_cached(source_path, sep=';')
     source.index.name = "id"
     source.columns = ['Date', 'Open', 'High', 'Low', 'Close']
     source['Date'] = pd.to_datetime(source['Date'])
@@ -1,4 +1,7 @@
+import collections
 import configparser
+import hashlib
+import io
 import json
 import os
 import random
@@ -92,27 +95,43 @@ def get_unique_values_from_list_of_dicts(key, list_of_dicts, is_item_string=True
     '''
 
     # Get all values from all keys scaler in a list
-    sublist = [x[key] for x in list_of_dicts] # Get a list of lists with all values from all keys
+    sublist = [x[key] for x in list_of_dicts if key in x] # Get a list of lists with all values from all keys
     flatten = lambda l: [item for sublist in l for item in sublist]  # Lambda flatten function
     flattended_list = flatten(sublist) #Flatten the lists of lists
 
-    if is_item_string==True: #Make string
-        elements = [str(element) for element in flattended_list]
-    else:
-        elements = flattended_list
-    unique_list = list(set(elements)) #Get unique values of list by converting it into a set and then to list
+    # Keep the first element of each unique value. The same object is in many dicts, therefore each object is only
+    # converted to a string once
+    unique_elements = dict()
+    element_keys = dict()
+    for element in flattended_list:
+        if id(element) not in element_keys:
+            element_keys[id(element)] = str(element) if is_item_string == True else id(element)
+        unique_elements.setdefault(element_keys[id(element)], element)
 
-    # Replace strings with their original values
-    unique_list_instance = list()
-    for element_string in unique_list:
-        for element in flattended_list:
-            if element_string == str(element):
-                unique_list_instance.append(element)
-                break
+    return list(unique_elements.values())
 
-    return unique_list_instance
+def get_score_distributions(method_name, unique_param_values, model_results, refit_scorer_name):
+    '''Get the sorted scores of each unique parameter value. The result table is grouped by the string of the
+    parameter once, so that the medians, histograms and significance tests do not filter the table for each value.
 
-def get_median_values_from_distributions(method_name, unique_param_values, model_results, refit_scorer_name):
+    :args:
+        :method_name: Parameter name, e.g. scaler
+        :unique_param_values: list of unique parameter values
+        :model_results: grid search results
+        :refit_scorer_name: refit scorer name for the end scores
+
+    :return: dict of unique parameter values and sorted numpy arrays of their scores. Values without results get an
+    empty array
+
+    '''
+    scores = model_results['mean_test_' + refit_scorer_name]
+    groups = {name: np.sort(group.values) for name, group in
+              scores.groupby(model_results['param_' + method_name].astype(str).values, sort=False)}
+
+    return {i: groups.get(str(i), np.array([])) for i in unique_param_values}
+
+def get_median_values_from_distributions(method_name, unique_param_values, model_results, refit_scorer_name,
+                                         distributions=None):
     '''Extract the median values from a list of distributions
 
     :args:
@@ -120,40 +139,95 @@ def get_median_values_from_distributions(method_name, unique_param_values, model
         :unique_param_values: list of unique parameter values
         :model_results: grid search results
         :refit_scorer_name: refit scorer name for the end scores
+        :distributions: Result of get_score_distributions. If None, it is calculated
 
     :return: dict of median values for each unique parameter value
 
     '''
+    if distributions is None:
+        distributions = get_score_distributions(method_name, unique_param_values, model_results, refit_scorer_name)
+
     median_result = dict()
     for i in unique_param_values:
-        p0 = model_results[model_results['param_' + method_name].astype(str) == str(i)]['mean_test_' + refit_scorer_name]
+        p0 = distributions[i]
         if (len(p0) > 0):
             median_hist = np.round(np.percentile(p0, 50), 3)
             median_result[i] = median_hist
 
     return median_result
 
+def get_feature_set_id(columns):
+    '''
+    Get a stable id of a feature set, i.e. a list of column indices. Equal lists get the same id in all runs.
+
+    :args:
+        columns: List of column indices
+    :return:
+        feature_set_id: String id
+    '''
+
+    return 'fs_' + hashlib.sha1(json.dumps(np.asarray(columns).tolist()).encode()).hexdigest()[:16]
+
+
+def get_feature_set_names(list_of_lists, list_names):
+    '''
+    Get a dict of feature set ids and names. If several names have the same feature set, the first name is used.
+
+    :args:
+        list_of_lists: list of lists with selected features [[list1], [list2]]
+        list_names: list of names for the list of lists [name1, name2]
+    :return:
+        feature_set_names: Dict of feature set ids and names
+    '''
+
+    feature_set_names = dict()
+    for columns, name in zip(list_of_lists, list_names):
+        feature_set_names.setdefault(get_feature_set_id(columns), name)
+
+    return feature_set_names
+
+
+def get_feature_set_name_function(list_of_lists, list_names):
+    '''
+    Get a function, which maps a list of columns to the name of its feature set. Values, which are no lists or no
+    known feature sets, are returned unchanged. The same list objects are often used in many results, therefore the
+    id of each object is only computed once.
+
+    '''
+
+    feature_set_names = get_feature_set_names(list_of_lists, list_names)
+    object_names = dict()
+
+    def get_name(value):
+        if not isinstance(value, (list, tuple, np.ndarray)):
+            return value
+        if id(value) not in object_names:
+            object_names[id(value)] = (value, feature_set_names.get(get_feature_set_id(value)))
+        name = object_names[id(value)][1]
+        return value if name is None else name
+
+    return get_name
+
+
 def list_to_name(list_of_lists, list_names, result):
     '''
     In a series, replace a list of integers with a string. This is used in grid search to give a list of columns
-    a certain name.
+    a certain name. The lists are mapped to names by their feature set ids.
 
     :list_of_lists: list of lists with selected features [[list1], [list2]]. This list have the keys
     :list_names: list of names for the list of lists [name1, name2]
     :result: Input Series, where the values shall be replaced. The values in the format of a list are replaced by
     strings. This is done inplace
 
-    :return: None
+    :return: Series with the replaced values
 
     '''
 
-    for k, value in enumerate(result):
-        indices = [i for i, x in enumerate(list_of_lists) if x == value]
-        if len(indices) > 0:
-            first_index = indices[0]
-            result.iloc[k] = list_names[first_index]
-        if k % 50 == 0:
-            print("run ", k)
+    names = result.map(get_feature_set_name_function(list_of_lists, list_names))
+    result[:] = names.values
+    print("Converted {} feature lists to names".format(len(result)))
+
+    return result
 
 def replace_lists_in_grid_search_params_with_strings(selected_features, feature_dict, params_run1_copy):
     '''
@@ -167,15 +241,10 @@ def replace_lists_in_grid_search_params_with_strings(selected_features, feature_
     :return: None
 
     '''
+    get_name = get_feature_set_name_function(selected_features, list(feature_dict.keys()))
     for i, value in enumerate(params_run1_copy):
         #print(value['feat__cols'])
-        for k, f in enumerate(value['feat__cols']):
-            indices = [i for i, x in enumerate(selected_features) if x == f]
-            if len(indices) > 0:
-                first_index = indices[0]
-                new_value = list(feature_dict.keys())[first_index]
-                params_run1_copy[i]['feat__cols'][k] = new_value
-                print("Replaced {} with {}".format(selected_features[first_index], new_value))
+        params_run1_copy[i]['feat__cols'] = [get_name(f) for f in value['feat__cols']]
 
 
 def load_config_bak(config_file_path):
@@ -211,15 +280,98 @@ def load_config(config_file_path):
 
     return config
 
+#Parsed csv files of this interpreter in the order of their last use. Key: (absolute path, read arguments), value:
+#(modification time, size, frame)
+_csv_frame_cache = collections.OrderedDict()
+#Maximum number of frames in the cache. The least recently used frame is dropped first
+CSV_CACHE_SIZE = 16
+
+def get_csv_cache_key(file_path, kwargs):
+    '''
+    Get the cache key of a csv file and its read arguments. Unhashable arguments, e.g. usecols=[...], are represented
+    by their repr.
+
+    '''
+
+    arguments = []
+    for name, value in sorted(kwargs.items()):
+        try:
+            hash(value)
+        except TypeError:
+            value = repr(value)
+        arguments.append((name, value))
+
+    return os.path.abspath(file_path), tuple(arguments)
+
+def put_csv_cache(key, file_path, df):
+    '''
+    Put a parsed frame of a file into the cache and drop the least recently used frames above CSV_CACHE_SIZE
+
+    '''
+
+    file_status = os.stat(file_path)
+    _csv_frame_cache[key] = (file_status.st_mtime_ns, file_status.st_size, df)
+    _csv_frame_cache.move_to_end(key)
+    while len(_csv_frame_cache) > CSV_CACHE_SIZE:
+        _csv_frame_cache.popitem(last=False)
+
+def read_csv_cached(file_path, **kwargs):
+    '''
+    Read a csv file with pandas and keep the parsed frame in memory. If the same file is read again within the same
+    interpreter, e.g. by the next step in the pipeline runner, or was written with write_csv_cached, the frame is taken
+    from memory instead of parsing the file again. A changed modification time or size of the file invalidates the
+    cached frame.
+
+    :args:
+        file_path: Path to the csv file
+        kwargs: Arguments for pandas.read_csv, e.g. sep=';'
+    :return:
+        df: Copy of the parsed data frame, which can be modified by the caller
+    '''
+
+    file_status = os.stat(file_path)
+    key = get_csv_cache_key(file_path, kwargs)
+    cached = _csv_frame_cache.get(key)
+    if cached is not None and cached[0] == file_status.st_mtime_ns and cached[1] == file_status.st_size:
+        print("Use parsed frame from memory: ", file_path)
+        df = cached[2]
+        _csv_frame_cache.move_to_end(key)
+    else:
+        df = pd.read_csv(file_path, **kwargs)
+        put_csv_cache(key, file_path, df)
+
+    return df.copy()
+
+def write_csv_cached(df, file_path, sep=';', index=True):
+    '''
+    Write a data frame or series with a header to a csv file and put the frame, which read_csv_cached(file_path,
+    sep=sep) returns for the file, into the cache. The frame is parsed from the written text with the same arguments
+    as the disk read, i.e. the cached frame equals a frame read from the file, e.g. float32 columns become the float64
+    values of their text. The next step of the pipeline runner then does not read the file again.
+
+    :args:
+        df: Data frame or series
+        file_path: Path to the csv file
+        sep: Separator
+        index: If True, the index is written
+    '''
+
+    text = df.to_csv(sep=sep, index=index, header=True)
+    with open(file_path, 'w', encoding='utf-8', newline='') as csv_file:
+        csv_file.write(text)
+
+    parsed = pd.read_csv(io.StringIO(text), sep=sep)
+    put_csv_cache(get_csv_cache_key(file_path, {'sep': sep}), file_path, parsed)
+
 def load_data_source(source_filename):
     '''
 
 
     '''
-    source = pd.read_csv(source_filename, sep=';').set_index('id')  # Set ID to be the data id
+    source = read_csv_cached(source_filename, sep=';').set_index('id')  # Set ID to be the data id
     print(source.head(1))
 
-    source = pd.read_csv(source_filename, delimiter=';').set_index('id')
+    source = read_csv_cached(source_filename, sep=';').set_index('id')
     source['Date'] = pd.to_datetime(source['Date'])
     source['Date'].apply(mdates.date2num)
     print("Loaded source time graph={}".format(source.columns))
@@ -266,11 +418,11 @@ def load_features(conf):
     model_labels_filename = os.path.join(training_data_directory, conf['Preparation'].get('labels_out'))
 
     # === Load Features ===#
-    features = pd.read_csv(model_features_filename, sep=';').set_index('id')  # Set ID to be the data id
+    features = read_csv_cached(model_features_filename, sep=';').set_index('id')  # Set ID to be the data id
     print(features.head(1))
 
     # === Load y values ===#
-    df_y = pd.read_csv(model_outcomes_filename, delimiter=';').set_index('id')
+    df_y = read_csv_cached(model_outcomes_filename, sep=';').set_index('id')
     y = df_y.values.flatten()
 
     #=== Load classes ===#
@@ -295,6 +447,8 @@ def create_feature_dict(df_feature_columns, df_X):
     # Create a list of column indices for the selection of features
     selected_features = [getListFromColumn(df_feature_columns, df_X, i) for i in range(0, df_feature_columns.shape[1])]
     feature_dict = dict(zip(df_feature_columns.columns, selected_features))
+    for name, columns in feature_dict.items():
+        print("Feature set {}: id {}, {} columns".format(name, get_feature_set_id(columns), len(columns)))
 
     return feature_dict
 
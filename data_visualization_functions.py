@@ -4,17 +4,7 @@ import numpy as np
 import matplotlib.pyplot as plt
 import matplotlib as m
 import pandas as pd
-from sklearn.utils.multiclass import unique_labels
-from sklearn.metrics import confusion_matrix, accuracy_score, classification_report
-from statsmodels import robust
-import scikitplot as skplt
 import itertools
-from scipy.stats import ks_2samp
-import seaborn as sns
-from sklearn.neighbors import KNeighborsClassifier
-from sklearn.manifold import TSNE
-from statsmodels.graphics.tsaplots import plot_acf, plot_pacf
-from statsmodels.stats.diagnostic import acorr_ljungbox
 
 import data_handling_support_functions as sup
 
@@ -156,6 +146,8 @@ def getNumberOfIntervals(valueDistribution):
 # Get number of missing values per feature, i.e. share of '?' per feature
 # d=df['workclass'].iloc[27]
 def paintHistogram(df, colName):
+    from statsmodels import robust
+
     # colName = 'age'
     # Create the histogram data
     mean = df[colName].mean()
@@ -274,6 +266,9 @@ def plot_confusion_matrix(y_true, y_pred, classes, normalize=False, title=None,
     This function prints and plots the confusion matrix.
     Normalization can be applied by setting `normalize=True`.
     """
+    from sklearn.metrics import confusion_matrix
+    from sklearn.utils.multiclass import unique_labels
+
     if not title:
         if normalize:
             title = 'Normalized confusion matrix'
@@ -553,7 +548,8 @@ def plot_heatmap_xy(scores, parameters, xlabel, ylabel, title, normalizeScale=Fa
 # For an identical distribution, we cannot reject the null hypothesis since the p-value is high, 41%. To reject the null
 # hypothesis, the p value shall be <5%
 
-def calculate_significance_matrix(parameter_name, unique_param_values, results, refit_scorer_name, alpha_limit=0.05):
+def calculate_significance_matrix(parameter_name, unique_param_values, results, refit_scorer_name, alpha_limit=0.05,
+                                  distributions=None, n_jobs=1):
     '''Function that calculate a matrix for the significance of the inputs with the Computes the
     Kolmogorov-Smirnov statistic on 2 samples and plots it.
 
@@ -567,21 +563,31 @@ def calculate_significance_matrix(parameter_name, unique_param_values, results,
     :refit_scorer_name: Refit scorer name
     :alpha_limit: p value: default 0.05. If values < 0.05, then the result is 1 and the distributions are not part of the
     same distribution
+    :distributions: Result of sup.get_score_distributions. If None, it is calculated
+    :n_jobs: Number of parallel jobs for the pairs of values. Default 1
 
     '''
+    import seaborn as sns
+    from scipy.stats import ks_2samp
+    from joblib import Parallel, delayed
 
     print(unique_param_values)
     print(parameter_name)
-    significance_calculations = pd.DataFrame(index=unique_param_values, columns=unique_param_values)
-
-    for i in significance_calculations:
-        for j in significance_calculations.columns:
-            p0 = results[results['param_' + parameter_name].astype(str) == str(i)]['mean_test_' + refit_scorer_name]
-            p1 = results[results['param_' + parameter_name].astype(str) == str(j)]['mean_test_' + refit_scorer_name]
-            if (len(p0) == 0 or len(p1) == 0):
-                significance_calculations[j].loc[i] = 0
-            else:
-                significance_calculations[j].loc[i] = ks_2samp(p0, p1).pvalue
+    if distributions is None:
+        distributions = sup.get_score_distributions(parameter_name, unique_param_values, results, refit_scorer_name)
+
+    # The test is symmetric, therefore only the upper triangle is calculated. Values without results get 0
+    k = len(unique_param_values)
+    pairs = [(a, b) for a in range(k) for b in range(a, k)
+             if len(distributions[unique_param_values[a]]) > 0 and len(distributions[unique_param_values[b]]) > 0]
+    p_values = Parallel(n_jobs=n_jobs)(
+        delayed(ks_2samp)(distributions[unique_param_values[a]], distributions[unique_param_values[b]])
+        for a, b in pairs)
+    significance_values = np.zeros((k, k))
+    for (a, b), test_result in zip(pairs, p_values):
+        significance_values[a, b] = significance_values[b, a] = test_result.pvalue
+    significance_calculations = pd.DataFrame(significance_values, index=unique_param_values,
+                                             columns=unique_param_values)
 
     label = list(map(str, unique_param_values))
     label = list(map(lambda x: x[0:20], label))  # param_values#[str(t)[:9] for t in merged_params_run1[name]]
@@ -598,7 +604,8 @@ def calculate_significance_matrix(parameter_name, unique_param_values, results,
 
     return statistics_df, fig
 
-def plotOverlayedHistorgrams(parameter_name, unique_param_values, results, median_results, refit_scorer_name):
+def plotOverlayedHistorgrams(parameter_name, unique_param_values, results, median_results, refit_scorer_name,
+                             distributions=None):
     '''Plot layered histograms from feature distributions
 
     :parameter_name: Parameter name e.g. scaler
@@ -606,10 +613,13 @@ def plotOverlayedHistorgrams(parameter_name, unique_param_values, results, media
     :results: Grid search results
     :median_results: median results of the distributions
     :refit_scorer_name: Refit scorer name
+    :distributions: Result of sup.get_score_distributions. If None, it is calculated
 
     :return: figure
 
     '''
+    if distributions is None:
+        distributions = sup.get_score_distributions(parameter_name, unique_param_values, results, refit_scorer_name)
     #min_range = np.percentile(results['mean_test_' + refit_scorer_name], 25)  #25% percentile
     min_range = np.min(results['mean_test_' + refit_scorer_name])
 
@@ -620,7 +630,7 @@ def plotOverlayedHistorgrams(parameter_name, unique_param_values, results, media
 
     for i in unique_param_values:
         #print(i)
-        p0 = results[results['param_' + parameter_name].astype(str) == str(i)]['mean_test_' + refit_scorer_name]
+        p0 = distributions[i]
         if (len(p0) > 0):
             bins = 100
             counts, _ = np.histogram(p0, bins=bins, range=(min_range, 1))
@@ -655,7 +665,7 @@ def plotOverlayedHistorgrams(parameter_name, unique_param_values, results, media
     return fig
 
 def visualize_parameter_grid_search(param_name, search_cv_parameters, search_cv_results, refit_scorer_name,
-                                    save_fig_prefix=None):
+                                    save_fig_prefix=None, n_jobs=1):
     '''
     Create visualizations and data for a certain grid search parameter.
 
@@ -664,6 +674,7 @@ def visualize_parameter_grid_search(param_name, search_cv_parameters, search_cv_
     :search_cv_results:
     :refit_scorer_name:
     :save_fig_prefix: Save figures in the folder specified in the path and file prefix if it is set and not none
+    :n_jobs: Number of parallel jobs for the significance matrix. Default 1
 
     :return:
 
@@ -703,7 +714,11 @@ def visualize_parameter_grid_search(param_name, search_cv_parameters, search_cv_
     plt.close()
 
     # Significance matrix for distributions
-    significance_matrix, fig2 = calculate_significance_matrix(param_name, unique_list, search_cv_results, refit_scorer_name)
+    # Group the scores by the parameter values once for the significance matrix, the medians and the histograms
+    distributions = sup.get_score_distributions(param_name, unique_list, search_cv_results, refit_scorer_name)
+    significance_matrix, fig2 = calculate_significance_matrix(param_name, unique_list, search_cv_results,
+                                                              refit_scorer_name, distributions=distributions,
+                                                              n_jobs=n_jobs)
     plt.tight_layout()
     if save_fig_prefix != None:
         plt.savefig(save_fig_prefix + '_' + param_name + '_significance_matrix', dpi=300)
@@ -714,8 +729,10 @@ def visualize_parameter_grid_search(param_name, search_cv_parameters, search_cv_
     plt.close()
 
     # Overlayed histograms
-    medians = sup.get_median_values_from_distributions(param_name, unique_list, search_cv_results, refit_scorer_name)
-    fig3 = plotOverlayedHistorgrams(param_name, unique_list, search_cv_results, medians, refit_scorer_name)
+    medians = sup.get_median_values_from_distributions(param_name, unique_list, search_cv_results, refit_scorer_name,
+                                                       distributions=distributions)
+    fig3 = plotOverlayedHistorgrams(param_name, unique_list, search_cv_results, medians, refit_scorer_name,
+                                    distributions=distributions)
     if save_fig_prefix != None:
         plt.savefig(save_fig_prefix + '_' + param_name + '_overlayed_histograms', dpi=300)
     #plt.ion()
@@ -728,7 +745,9 @@ def visualize_parameter_grid_search(param_name, search_cv_parameters, search_cv_
 
     return significance_matrix, medians
 
-def plot_precision_recall_evaluation(y_trainsub, y_trainsub_pred, y_trainsub_pred_proba, reduced_class_dict, save_fig_prefix=None):
+def plot_precision_recall_evaluation(y_trainsub, y_trainsub_pred, y_trainsub_pred_proba, reduced_class_dict, title_prefix="", save_fig_prefix=None):
+    from sklearn.metrics import confusion_matrix, accuracy_score, classification_report
+
     # Calculate Precision, Recall, Accuracy, F1, Confusion Matrix, ROC
     np.set_printoptions(precision=3)
 
@@ -746,7 +765,7 @@ def plot_precision_recall_evaluation(y_trainsub, y_trainsub_pred, y_trainsub_pre
     #matrixSize = len(y_classes) * 2
     # plt.figure(figsize=(matrixSize, matrixSize))
     fig_confusion_matrix = plot_confusion_matrix_multiclass(cnf_matrix, classes=list(reduced_class_dict.values()),
-                                             title='Confusion matrix with normalization', normalize=True)
+                                             title=title_prefix + 'Confusion matrix with normalization', normalize=True)
 
     if save_fig_prefix != None:
         fig_confusion_matrix.savefig(save_fig_prefix + '_confusion_matrix', dpi=300)
@@ -755,7 +774,11 @@ def plot_precision_recall_evaluation(y_trainsub, y_trainsub_pred, y_trainsub_pre
     plt.pause(0.1)
     plt.close()
 
-    fig_pr_curve = skplt.metrics.plot_precision_recall_curve(np.array(y_trainsub), np.array(y_trainsub_pred_proba), figsize=(10, 10))
+    # scikitplot is only needed for the curves, i.e. the report and the confusion matrix are stored without it
+    import scikitplot as skplt
+
+    fig_pr_curve = skplt.metrics.plot_precision_recall_curve(np.array(y_trainsub), np.array(y_trainsub_pred_proba),
+                                                             title=title_prefix + 'Precision-Recall Curve', figsize=(10, 10))
     if save_fig_prefix != None:
         fig_pr_curve.figure.savefig(save_fig_prefix + '_pr_curve')
 
@@ -763,7 +786,8 @@ def plot_precision_recall_evaluation(y_trainsub, y_trainsub_pred, y_trainsub_pre
     plt.pause(0.1)
     plt.close()
 
-    fig_roc_curve = skplt.metrics.plot_roc(np.array(y_trainsub), np.array(y_trainsub_pred_proba), figsize=(10, 10))
+    fig_roc_curve = skplt.metrics.plot_roc(np.array(y_trainsub), np.array(y_trainsub_pred_proba),
+                                           title=title_prefix + 'ROC Curves', figsize=(10, 10))
     if save_fig_prefix != None:
         fig_roc_curve.figure.savefig(save_fig_prefix + '_roc_curve')
 
@@ -786,6 +810,7 @@ def precision_recall_threshold(y_adjusted_classes, y_test, p, r, thresholds, t,
     plots the precision recall curve and shows the current value for each
     by identifying the classifier's threshold (t).
     """
+    from sklearn.metrics import confusion_matrix
 
     # generate new class predictions based on the adjusted_classes
     # function above and view the resulting confusion matrix.
@@ -865,6 +890,9 @@ def plot_roc_curve(fpr, tpr, label=None, title_prefix="", save_fig_prefix=None):
     plt.close()
 
 def plot_decision_boundary(X, y, model, title_prefix="", save_fig_prefix=None):
+    from sklearn.manifold import TSNE
+    from sklearn.neighbors import KNeighborsClassifier
+
     X_Train_embedded = TSNE(n_components=2).fit_transform(X)
     print(X_Train_embedded.shape)
     # model = LogisticRegression().fit(X,y)
@@ -901,6 +929,8 @@ def plot_autocorrelation(feature, title, mode=None, lags=None, xlim=None, ylim=N
     Plot autocorrelations or partial autocorrelations
 
     '''
+    from statsmodels.graphics.tsaplots import plot_acf, plot_pacf
+    from statsmodels.stats.diagnostic import acorr_ljungbox
 
     if mode=="pacf":
         plot_pacf(feature, lags=lags)
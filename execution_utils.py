@@ -27,33 +27,12 @@ from sklearn import feature_selection
 from sklearn.impute import SimpleImputer
 # from sklearn.impute import IterativeImputer
 
-from imblearn.over_sampling import SMOTE
-from imblearn.over_sampling import ADASYN
-from imblearn.over_sampling import RandomOverSampler
-from imblearn.combine import SMOTEENN
-from imblearn.combine import SMOTETomek
-from imblearn.under_sampling import ClusterCentroids
-from imblearn.under_sampling import RandomUnderSampler
-from imblearn.under_sampling import EditedNearestNeighbours
-from imblearn.under_sampling import CondensedNearestNeighbour
-from imblearn.under_sampling import NearMiss
-from imblearn.under_sampling import AllKNN
-from imblearn.under_sampling import NeighbourhoodCleaningRule
-from imblearn.under_sampling import InstanceHardnessThreshold
-from imblearn.ensemble import BalancedBaggingClassifier  # Does not work
-from imblearn.ensemble import BalancedRandomForestClassifier  # Does not work
-from imblearn.ensemble import RUSBoostClassifier  # Does not work
-
-from sklearn.linear_model import LogisticRegression  # For InstanceHardnessThreshold
-from sklearn.tree import DecisionTreeClassifier  # For Random Forest Balancer
-
-from imblearn.pipeline import Pipeline
-
 from scipy.stats import reciprocal
 from scipy.stats import randint as sp_randint
 from sklearn.model_selection import RandomizedSearchCV
 
 import data_handling_support_functions as sup
+import search_utils as search
 from evaluation_utils import Metrics
 from filepaths import Paths
 
@@ -90,7 +69,7 @@ def load_feature_columns(feature_col_path: str, df_X: pd.DataFrame):
 
     '''
     # === Load list of feature columns ===#
-    df_feature_columns = pd.read_csv(feature_col_path, delimiter=';')
+    df_feature_columns = sup.read_csv_cached(feature_col_path, sep=';')
     print("Selected features: {}".format(feature_col_path))
     print(df_feature_columns)
 
@@ -123,13 +102,13 @@ def load_data(X_path, y_path):
     '''
 
     # === Load Features ===#
-    df_X = pd.read_csv(X_path, sep=';').set_index('id')  # Set ID to be the data id
+    df_X = sup.read_csv_cached(X_path, sep=';').set_index('id')  # Set ID to be the data id
     print("Loaded feature names for X={}".format(df_X.columns))
     print("X. Shape={}".format(df_X.shape))
 
     # === Load y values ===#
     if y_path is not None and y_path!="":
-        df_y = pd.read_csv(y_path, delimiter=';').set_index('id')
+        df_y = sup.read_csv_cached(y_path, sep=';').set_index('id')
         y = df_y.values.flatten()
         print("Indexes of X={}".format(df_X.index.shape))
         print("y. Shape={}".format(y.shape))
@@ -348,93 +327,153 @@ def get_top_median_method(method_name, model_results, refit_scorer_name, top_sha
     hist_label = model_results['param_' + method_name][0:number_results]  # .apply(str).apply(lambda x: x[:20])
     source = hist_label.value_counts() / number_results  #
 
-    import data_visualization_functions as vis
-
-    median_values = vis.get_median_values_from_distributions(method_name, merged_params_of_model_results[method_name],
+    median_values = sup.get_median_values_from_distributions(method_name, merged_params_of_model_results[method_name],
                                                              model_results, refit_scorer_name)
 
     return median_values, source
 
 
+def get_wide_search_parameters(X_train, selected_features, approximate_kernels=None, approximate_components=500):
+    '''
+    Get the default parameter grid of the wide search of scaler, sampler, features and kernel
+
+    :args:
+        X_train: Training data, which sets the default gamma of the rbf kernel
+        selected_features: List of feature column lists
+        approximate_kernels: List of kernels of sklearn_utils.ApproximateKernelSVC, which are added to the grid. None
+        for only SVC
+        approximate_components: Number of components of the approximated kernels
+    :return:
+        parameters: List of parameter dicts for search_utils.grid_candidates
+    '''
+    # Imbalanced-learn is only imported for the searches, as it takes long to import
+    from imblearn.over_sampling import SMOTE, ADASYN
+    from imblearn.combine import SMOTEENN, SMOTETomek
+    # from imblearn.under_sampling import ClusterCentroids, RandomUnderSampler, NearMiss, EditedNearestNeighbours, \
+    #     AllKNN, CondensedNearestNeighbour, InstanceHardnessThreshold
+    # from sklearn.linear_model import LogisticRegression  # For InstanceHardnessThreshold
+
+    # Guides used from
+    # https://www.kaggle.com/evanmiller/pipelines-gridsearch-awesome-ml-pipelines
+    # Main set of parameters for the grid search run 1: Select scaler, sampler and kernel for the problem
+    test_scaler = [StandardScaler(), RobustScaler(), QuantileTransformer(), Normalizer()]
+    test_sampling = [modelutil.Nosampler(),
+                     #ClusterCentroids(),
+                     #RandomUnderSampler(),
+                     #NearMiss(version=1),
+                     #EditedNearestNeighbours(),
+                     #AllKNN(),
+                     #CondensedNearestNeighbour(random_state=0),
+                     #InstanceHardnessThreshold(random_state=0,
+                     #                          estimator=LogisticRegression(solver='lbfgs', multi_class='auto')),
+                     SMOTE(),
+                     SMOTEENN(),
+                     SMOTETomek(),
+                     ADASYN()]
+    test_C = [1e-3, 1e-2, 1e-1, 1e0, 1e1, 1e2, 1e3]
+    test_C_linear = [1e-3, 1e-2, 1e-1, 1e0, 1e1, 1e2]
+
+    # gamma default parameters
+    param_scale = 1 / (X_train.shape[1] * np.mean(X_train.var()))
+
+    parameters = [
+        {
+            'scaler': test_scaler,
+            'sampling': test_sampling,
+            'feat__cols': selected_features,
+            'svm__C': test_C,  # default C=1
+            'svm__kernel': ['sigmoid']
+        },
+        {
+            'scaler': test_scaler,
+            'sampling': test_sampling,
+            'feat__cols': selected_features,
+            'svm__C': test_C_linear,  # default C=1
+            'svm__kernel': ['linear']
+        },
+        {
+            'scaler': test_scaler,
+            'sampling': test_sampling,
+            'feat__cols': selected_features,
+            'svm__C': test_C,  # default C=1
+            'svm__kernel': ['poly'],
+            'svm__degree': [2, 3]  # Only relevant for poly
+        },
+        {
+            'scaler': test_scaler,
+            'sampling': test_sampling,
+            'feat__cols': selected_features,
+            'svm__C': test_C,  # default C=1
+            'svm__kernel': ['rbf'],
+            'svm__gamma': [param_scale, 1e-3, 1e-2, 1e-1, 1e0, 1e1, 1e2, 1e3]
+            # Only relevant in rbf, default='auto'=1/n_features
+        }]
+
+    # Approximated kernels replace the svm step and are fitted linearly in the number of samples
+    if approximate_kernels:
+        parameters.append({
+            'scaler': test_scaler,
+            'sampling': test_sampling,
+            'feat__cols': selected_features,
+            'svm': [modelutil.ApproximateKernelSVC(n_components=approximate_components)],
+            'svm__C': test_C,
+            'svm__kernel': approximate_kernels,
+            'svm__gamma': [param_scale, 1e-3, 1e-2, 1e-1, 1e0, 1e1, 1e2, 1e3]
+        })
+
+    return parameters
+
+
 def run_basic_svm(X_train, y_train, selected_features, scorers, refit_scorer_name, subset_share=0.1, n_splits=5,
-                  parameters=None):
+                  parameters=None, journal_path=None, halving_factor=None, halving_min_samples=300,
+                  halving_max_share=1.0, precompute_kernel=False, kernel_memory_mb=1024, trial_store_path=None,
+                  prune_top_share=None, prune_z=2.0, liblinear=False, approximate_kernels=None,
+                  approximate_components=500):
     '''Run an extensive grid search over all parameters to find the best parameters for SVM Classifier.
     The search shall be done only with a subset of the data. Default subset is 0.1. Input is training and test data.
 
     subset_share=0.1
+    journal_path: Path of the search journal. If the search is restarted, finished fits are loaded from the journal.
+    None for no journal
+    halving_factor: If set, successive halving is used instead of a grid search on a subset. All candidates start on
+    halving_min_samples samples and the best 1/halving_factor are kept in each rung until the last rung uses
+    halving_max_share of the training data. subset_share is not used then.
+    precompute_kernel: If True, all C values of a kernel are fitted on one precomputed kernel matrix per fold with at
+    most kernel_memory_mb. The results are the same.
+    trial_store_path: Path of the trial store. Trials of earlier runs are loaded from it and new trials are saved to
+    it. None for no trial store
+    prune_top_share: If set, the folds are evaluated one after the other and candidates, which cannot reach the best
+    prune_top_share of the candidates with the bound of prune_z standard errors, are pruned. None for no pruning
+    liblinear: If True, the linear kernel candidates of binary targets are fitted with liblinear instead of libsvm.
+    The agreement with libsvm is printed
+    approximate_kernels: List of kernels of sklearn_utils.ApproximateKernelSVC, e.g. nystroem_rbf or rff_rbf, which
+    are searched like the kernels of SVC in the default parameters. None for only SVC
+    approximate_components: Number of components of the approximated kernels
 
     '''
+    # Imbalanced-learn is only imported for the searches, as it takes long to import
+    from imblearn.pipeline import Pipeline
 
     # Create a subset to train on
-    print("[Step 1]: Create a data subset")
-    subset_min = 300  # Minimal subset is 100 samples.
+    if halving_factor is None:
+        print("[Step 1]: Create a data subset")
+        subset_min = 300  # Minimal subset is 100 samples.
 
-    if subset_share * X_train.shape[0] < subset_min:
-        number_of_samples = subset_min
-        print("minimal number of samples used: ", number_of_samples)
-    else:
-        number_of_samples = subset_share * X_train.shape[0]
+        if subset_share * X_train.shape[0] < subset_min:
+            number_of_samples = subset_min
+            print("minimal number of samples used: ", number_of_samples)
+        else:
+            number_of_samples = subset_share * X_train.shape[0]
 
-    X_train_subset, y_train_subset = modelutil.extract_data_subset(X_train, y_train, number_of_samples)
-    print("Got subset sizes X train: {} and y train: {}".format(X_train_subset.shape, y_train_subset.shape))
+        X_train_subset, y_train_subset = modelutil.extract_data_subset(X_train, y_train, number_of_samples)
+        print("Got subset sizes X train: {} and y train: {}".format(X_train_subset.shape, y_train_subset.shape))
+    else:
+        print("[Step 1]: Successive halving. The rung subsets are created in the search")
 
     print("[Step 2]: Define test parameters")
     if parameters is None:  # If no parameters have been defined, then do full definition
-        # Guides used from
-        # https://www.kaggle.com/evanmiller/pipelines-gridsearch-awesome-ml-pipelines
-        # Main set of parameters for the grid search run 1: Select scaler, sampler and kernel for the problem
-        test_scaler = [StandardScaler(), RobustScaler(), QuantileTransformer(), Normalizer()]
-        test_sampling = [modelutil.Nosampler(),
-                         #ClusterCentroids(),
-                         #RandomUnderSampler(),
-                         #NearMiss(version=1),
-                         #EditedNearestNeighbours(),
-                         #AllKNN(),
-                         #CondensedNearestNeighbour(random_state=0),
-                         #InstanceHardnessThreshold(random_state=0,
-                         #                          estimator=LogisticRegression(solver='lbfgs', multi_class='auto')),
-                         SMOTE(),
-                         SMOTEENN(),
-                         SMOTETomek(),
-                         ADASYN()]
-        test_C = [1e-3, 1e-2, 1e-1, 1e0, 1e1, 1e2, 1e3]
-        test_C_linear = [1e-3, 1e-2, 1e-1, 1e0, 1e1, 1e2]
-
-        # gamma default parameters
-        param_scale = 1 / (X_train.shape[1] * np.mean(X_train.var()))
-
-        parameters = [
-            {
-                'scaler': test_scaler,
-                'sampling': test_sampling,
-                'feat__cols': selected_features,
-                'svm__C': test_C,  # default C=1
-                'svm__kernel': ['sigmoid']
-            },
-            {
-                'scaler': test_scaler,
-                'sampling': test_sampling,
-                'feat__cols': selected_features,
-                'svm__C': test_C_linear,  # default C=1
-                'svm__kernel': ['linear']
-            },
-            {
-                'scaler': test_scaler,
-                'sampling': test_sampling,
-                'feat__cols': selected_features,
-                'svm__C': test_C,  # default C=1
-                'svm__kernel': ['poly'],
-                'svm__degree': [2, 3]  # Only relevant for poly
-            },
-            {
-                'scaler': test_scaler,
-                'sampling': test_sampling,
-                'feat__cols': selected_features,
-                'svm__C': test_C,  # default C=1
-                'svm__kernel': ['rbf'],
-                'svm__gamma': [param_scale, 1e-3, 1e-2, 1e-1, 1e0, 1e1, 1e2, 1e3]
-                # Only relevant in rbf, default='auto'=1/n_features
-            }]
+        parameters = get_wide_search_parameters(X_train, selected_features, approximate_kernels=approximate_kernels,
+                                                approximate_components=approximate_components)
 
         # If no missing values, only one imputer strategy shall be used
         if X_train.isna().sum().sum() > 0:
@@ -464,8 +503,34 @@ def run_basic_svm(X_train, y_train, selected_features, scorers, refit_scorer_nam
 
     pipe_run1 = pipe_run1
     params_run1 = parameters  # params_debug #params_run1
-    grid_search_run1 = GridSearchCV(pipe_run1, params_run1, verbose=2, cv=skf, scoring=scorers, refit=refit_scorer_name,
-                                    return_train_score=True, n_jobs=-1).fit(X_train_subset, y_train_subset)
+    # Number of best candidates, which are evaluated on all folds, if pruning is used
+    if prune_top_share is None:
+        prune_top_k = None
+    else:
+        prune_top_k = max(1, int(np.ceil(prune_top_share * len(search.grid_candidates(params_run1)))))
+    if halving_factor is None:
+        grid_search_run1 = search.JournaledSearchCV(pipe_run1, search.grid_candidates(params_run1), verbose=2, cv=skf,
+                                                    scoring=scorers, refit=refit_scorer_name, return_train_score=True,
+                                                    n_jobs=-1, journal_path=journal_path,
+                                                    precompute_kernel=precompute_kernel,
+                                                    kernel_memory_mb=kernel_memory_mb,
+                                                    trial_store_path=trial_store_path, prune_top_k=prune_top_k,
+                                                    prune_z=prune_z, liblinear=liblinear).fit(X_train_subset,
+                                                                                                  y_train_subset)
+    else:
+        grid_search_run1 = search.SuccessiveHalvingSearchCV(pipe_run1, search.grid_candidates(params_run1),
+                                                            verbose=2, cv=skf, scoring=scorers,
+                                                            refit=refit_scorer_name, factor=halving_factor,
+                                                            min_samples=halving_min_samples,
+                                                            max_samples=int(halving_max_share * X_train.shape[0]),
+                                                            return_train_score=True, n_jobs=-1,
+                                                            journal_path=journal_path,
+                                                            precompute_kernel=precompute_kernel,
+                                                            kernel_memory_mb=kernel_memory_mb,
+                                                            trial_store_path=trial_store_path,
+                                                            prune_folds=prune_top_k is not None, prune_z=prune_z,
+                                                            prune_top_k=prune_top_k,
+                                                            liblinear=liblinear).fit(X_train, y_train)
 
     #grid_search_run1 = GridSearchCV(pipe_run1, params_run1, verbose=1, cv=skf, scoring=scorers, refit=refit_scorer_name,
     #                                return_train_score=True, iid=True, n_jobs=-1).fit(X_train_subset, y_train_subset)
@@ -496,7 +561,7 @@ def get_continuous_parameter_range_for_SVM_based_on_kernel(pipe_run_best_first_s
     pipe_run_random = pipe_run_best_first_selection  # Use the best pipe from the best run
     # Main set of parameters for the grid search run 2: Select solver parameter
     # Initial parameters
-    if best_kernel == 'rbf':
+    if best_kernel == 'rbf' or best_kernel in modelutil.APPROXIMATE_KERNELS:
         params_run2 = {
             'svm__C': [1e-5, 1e-4, 1e-3, 1e-2, 1e-1, 1e0, 1e1, 1e2, 1e3, 1e4, 1e5],
             'svm__gamma':
@@ -533,6 +598,35 @@ def get_continuous_parameter_range_for_SVM_based_on_kernel(pipe_run_best_first_s
     return parameter_svm
 
 
+def get_best_candidates_for_SVM(results, search_run, plot_best=20):
+    '''
+    Get the best candidates of a search and their fold records to carry them forward to the next stage of a search on
+    NestedFolds. Pruned candidates are not carried forward.
+
+    :args:
+        :results: Result table of the search, which is sorted by the score and has the candidate indices as index
+        :search_run: Fitted search_utils.JournaledSearchCV
+        :plot_best: Number of best results. Default value=20
+
+    :return:
+        :candidates: List of the parameter dicts of the best candidates
+        :records: Dict of (candidate key, fold) and the records of the candidates on all folds of the search
+    '''
+
+    best_results = results.head(plot_best)
+    if 'pruned' in best_results.columns:
+        best_results = best_results[~best_results['pruned'].astype(bool)]
+
+    candidates = [search_run.candidates[i] for i in best_results.index]
+    records = dict()
+    for params in candidates:
+        candidate_key = search.get_candidate_key(params)
+        for fold in range(search_run.n_splits_):
+            records[(candidate_key, fold)] = search_run.records_[(candidate_key, fold)]
+
+    return candidates, records
+
+
 def generate_parameter_limits_for_SVM(results, plot_best=20):
     '''
     From a result structure, extract the min. and max. values of C and gamma as series and add them to a dataframe
@@ -561,7 +655,10 @@ def generate_parameter_limits_for_SVM(results, plot_best=20):
 
 def run_random_cv_for_SVM(X_train, y_train, parameter_svm, pipe_run, scorers, refit_scorer_name, number_of_samples=400,
                           kfolds=5,
-                          n_iter_search=2000, plot_best=20):
+                          n_iter_search=2000, plot_best=20, journal_path=None, random_state=None,
+                          trial_store_path=None, prune_folds=False, prune_z=2.0, precompute_kernel=False,
+                          kernel_memory_mb=1024, sampling='random', nested_folds=None, carried_candidates=None,
+                          carried_records=None):
     '''
     Execute random search cv
 
@@ -576,6 +673,25 @@ def run_random_cv_for_SVM(X_train, y_train, parameter_svm, pipe_run, scorers, re
         :kfolds: Number of folds for cross validation. Default=5
         :n_iter_search: Number of random search iterations. Default=2000
         :plot_best: Number of top results selected for narrowing the parameter range. Default=20
+        :journal_path: Path of the search journal to resume the search after a restart. None for no journal
+        :random_state: Random state of the sampled parameters. It has to be fixed to resume a search
+        :trial_store_path: Path of the trial store with the trials of earlier runs. None for no trial store
+        :prune_folds: If True, candidates, which cannot reach the plot_best best candidates, are pruned after some
+        folds. Default=False
+        :prune_z: Number of standard errors of the pruning bound. Default=2.0
+        :precompute_kernel: If True, the squared distances of a fold are computed once and the rbf kernel of each
+        gamma is formed from them with at most kernel_memory_mb. The results are the same. Default=False
+        :kernel_memory_mb: Maximum size of the kernel and distance matrices of a fold in MB. Default=1024
+        :sampling: random for independent random candidates, sobol or halton for a scrambled low discrepancy sequence
+        in log(C) x log(gamma), which covers the range more evenly with the same number of candidates. The coverage of
+        the candidates is printed. Default=random
+        :nested_folds: search_utils.NestedFolds of the stages up to this one. If set, the data subset is the prefix
+        of number_of_samples samples of a stratified order and the folds are the folds of all stages up to this one
+        instead of kfolds folds. Default=None
+        :carried_candidates: List of parameter dicts of the best candidates of an earlier stage, which are topped up
+        with new candidates to n_iter_search candidates. Default=None
+        :carried_records: Records of the carried candidates on the folds of the earlier stages, which are not fitted
+        again. Default=None
 
     :return:
 
@@ -583,7 +699,16 @@ def run_random_cv_for_SVM(X_train, y_train, parameter_svm, pipe_run, scorers, re
     '''
 
     # Extract data subset to train on
-    X_train_subset, y_train_subset = modelutil.extract_data_subset(X_train, y_train, number_of_samples)
+    if nested_folds is not None:
+        if nested_folds.sample_sizes[-1] != number_of_samples:
+            raise Exception("The last stage of the nested folds has {} samples, but the subset has {}".format(
+                nested_folds.sample_sizes[-1], number_of_samples))
+        # The nested subsets keep the stratified order, so that the folds of the earlier stages have the same samples
+        sample_index = search.get_stratified_order(y_train)[:int(number_of_samples)]
+        X_train_subset = search.index_rows(X_train, sample_index)
+        y_train_subset = search.index_rows(y_train, sample_index)
+    else:
+        X_train_subset, y_train_subset = modelutil.extract_data_subset(X_train, y_train, number_of_samples)
 
     # Main set of parameters for the grid search run 2: Select solver parameter
     # Reciprocal for the logarithmic range
@@ -594,13 +719,31 @@ def run_random_cv_for_SVM(X_train, y_train, parameter_svm, pipe_run, scorers, re
     }
 
     # K-Fold settings
-    skf = StratifiedKFold(n_splits=kfolds)
+    skf = StratifiedKFold(n_splits=kfolds) if nested_folds is None else nested_folds
 
     # run randomized search
-    random_search_run = RandomizedSearchCV(pipe_run, param_distributions=params_run, n_jobs=-1,
-                                           n_iter=n_iter_search, cv=skf, scoring=scorers,
-                                           refit=refit_scorer_name, return_train_score=True,
-                                           verbose=5).fit(X_train_subset, y_train_subset)
+    # Carried candidates of an earlier stage are topped up with new candidates
+    candidates = [] if carried_candidates is None else list(carried_candidates)
+    n_new = max(0, n_iter_search - len(candidates))
+    if sampling == 'random':
+        candidates += search.random_candidates(params_run, n_new, random_state=random_state)
+    else:
+        candidates += search.low_discrepancy_candidates(params_run, n_new, random_state=random_state,
+                                                        method=sampling)
+    coverage = search.get_candidate_coverage(candidates, params_run)
+    print("Coverage of {} {} candidates in log(C) x log(gamma): discrepancy {:.2e}, occupied cells {:.1f}%, minimum "
+          "distance {:.4f}".format(len(candidates), sampling, coverage['discrepancy'],
+                                   100 * coverage['occupied_cells'], coverage['min_distance']))
+    random_search_run = search.JournaledSearchCV(pipe_run, candidates,
+                                                 n_jobs=-1, cv=skf, scoring=scorers, refit=refit_scorer_name,
+                                                 return_train_score=True, verbose=5,
+                                                 journal_path=journal_path,
+                                                 trial_store_path=trial_store_path,
+                                                 prune_top_k=plot_best if prune_folds else None,
+                                                 prune_z=prune_z, precompute_kernel=precompute_kernel,
+                                                 kernel_memory_mb=kernel_memory_mb,
+                                                 carried_records=carried_records).fit(X_train_subset,
+                                                                                      y_train_subset)
 
    # random_search_run = RandomizedSearchCV(pipe_run, param_distributions=params_run, n_jobs=-1,
    #                                        n_iter=n_iter_search, cv=skf, scoring=scorers,
@@ -622,3 +765,131 @@ def run_random_cv_for_SVM(X_train, y_train, parameter_svm, pipe_run, scorers, re
     print(parameter_svm)
 
     return parameter_svm, results, random_search_run
+
+
+def get_warm_start_from_results(results, pipe_run, refit_scorer_name):
+    '''
+    Get observations of C and gamma for the warm start of a model based search from the result table of the wide
+    search. Only results with the same scaler, sampler, feature set and kernel as the pipe are used. The rows are compared
+    in one pass and feature lists by their feature set id.
+
+    :args:
+        :results: Result table of the wide search with param_ columns
+        :pipe_run: Selected pipe of the wide search
+        :refit_scorer_name: Refit scorer name
+
+    :return:
+        :warm_start: List of (parameters, score)
+    '''
+
+    warm_start = []
+    if 'param_svm__C' not in results.columns:
+        return warm_start
+
+    def get_value_key(value):
+        # Feature lists are matched by their feature set id, all other values by their string
+        if isinstance(value, (list, tuple, np.ndarray)):
+            return sup.get_feature_set_id(value)
+        return str(value)
+
+    # The rows of a grid share their value objects, therefore the key of each object is only computed once
+    object_keys = dict()
+
+    def get_object_key(value):
+        if id(value) not in object_keys:
+            object_keys[id(value)] = (value, get_value_key(value))
+        return object_keys[id(value)][1]
+
+    pipe_keys = [('scaler', get_value_key(pipe_run['scaler'])), ('sampling', get_value_key(pipe_run['sampling'])),
+                 ('feat__cols', get_value_key(pipe_run['feat'].cols)),
+                 ('svm__kernel', get_value_key(pipe_run['svm'].kernel))]
+    pipe_keys = [(name, key) for name, key in pipe_keys if 'param_' + name in results.columns]
+    pipe_key = tuple(key for _, key in pipe_keys)
+    selection = np.array([tuple(get_object_key(value) for value in row) == pipe_key for row in
+                          results[['param_' + name for name, _ in pipe_keys]].itertuples(index=False)], dtype=bool)
+
+    default_gamma = pipe_run['svm'].gamma
+    for _, row in results[selection].iterrows():
+        gamma = row['param_svm__gamma'] if 'param_svm__gamma' in results.columns else default_gamma
+        if isinstance(gamma, str) or gamma is None or pd.isna(gamma):
+            continue
+        warm_start.append(({'svm__C': float(row['param_svm__C']), 'svm__gamma': float(gamma)},
+                           row['mean_test_' + refit_scorer_name]))
+
+    print("Got {} observations of the wide search for the warm start".format(len(warm_start)))
+
+    return warm_start
+
+
+def run_tpe_cv_for_SVM(X_train, y_train, parameter_svm, pipe_run, scorers, refit_scorer_name, number_of_samples=400,
+                       kfolds=5, n_iter_search=40, batch_size=4, warm_start=None, plot_best=20, journal_path=None,
+                       random_state=None, trial_store_path=None, precompute_kernel=False, kernel_memory_mb=1024):
+    '''
+    Execute a model based search with a tree-structured Parzen estimator over C and gamma within the limits of
+    parameter_svm. It replaces the iterated random search with fewer fits.
+
+    :args:
+        :X_train: feature dataframe X
+        :y_train: ground truth dataframe y
+        :parameter_svm: Parameter range for C and gamma
+        :pipe_run:  Pipe to run
+        :scorers: Scorers
+        :refit_scorer_name: Refit scrorer name
+        :number_of_samples: Number of samples to use from the training data. Default=400
+        :kfolds: Number of folds for cross validation. Default=5
+        :n_iter_search: Number of evaluated candidates. Default=40
+        :batch_size: Number of candidates, which are proposed and evaluated in parallel. Default=4
+        :warm_start: List of (parameters, score) of earlier searches. None for no warm start
+        :plot_best: Number of top results selected for the parameter range of the results. Default=20
+        :journal_path: Path of the search journal to resume the search after a restart. None for no journal
+        :random_state: Random state of the optimizer. It has to be fixed to resume a search
+        :trial_store_path: Path of the trial store with the trials of earlier runs. None for no trial store
+        :precompute_kernel: If True, the rbf kernels of a batch are formed from the squared distances of a fold, which
+        are computed once with at most kernel_memory_mb. Default=False
+        :kernel_memory_mb: Maximum size of the kernel and distance matrices of a fold in MB. Default=1024
+
+    :return:
+        :parameter_svm: Parameter range of the best results
+        :results: Result table
+        :tpe_search_run: Search
+    '''
+
+    import optimizer_utils as optimizer
+
+    # Extract data subset to train on
+    if nested_folds is not None:
+        if nested_folds.sample_sizes[-1] != number_of_samples:
+            raise Exception("The last stage of the nested folds has {} samples, but the subset has {}".format(
+                nested_folds.sample_sizes[-1], number_of_samples))
+        # The nested subsets keep the stratified order, so that the folds of the earlier stages have the same samples
+        sample_index = search.get_stratified_order(y_train)[:int(number_of_samples)]
+        X_train_subset = search.index_rows(X_train, sample_index)
+        y_train_subset = search.index_rows(y_train, sample_index)
+    else:
+        X_train_subset, y_train_subset = modelutil.extract_data_subset(X_train, y_train, number_of_samples)
+
+    param_bounds = {'svm__C': (parameter_svm.loc['param_svm__C']['min'], parameter_svm.loc['param_svm__C']['max']),
+                    'svm__gamma': (parameter_svm.loc['param_svm__gamma']['min'],
+                                   parameter_svm.loc['param_svm__gamma']['max'])}
+
+    # K-Fold settings
+    skf = StratifiedKFold(n_splits=kfolds)
+
+    tpe_search_run = optimizer.TPESearchCV(pipe_run, param_bounds, scorers, refit_scorer_name, skf,
+                                           n_iter=n_iter_search, batch_size=batch_size, warm_start=warm_start,
+                                           random_state=random_state, n_jobs=-1, return_train_score=True, verbose=5,
+                                           journal_path=journal_path, trial_store_path=trial_store_path,
+                                           precompute_kernel=precompute_kernel,
+                                           kernel_memory_mb=kernel_memory_mb).fit(X_train_subset, y_train_subset)
+
+    print("Best parameters: ", tpe_search_run.best_params_)
+    print("Best score: {:.3f}".format(tpe_search_run.best_score_))
+
+    # Create the result table
+    results = modelutil.generate_result_table(tpe_search_run, param_bounds, refit_scorer_name)
+    parameter_svm = generate_parameter_limits_for_SVM(results, plot_best)
+
+    print(results.round(3).head(5))
+    print(parameter_svm)
+
+    return parameter_svm, results, tpe_search_run
@@ -135,6 +135,12 @@ class Paths:
         #Results
         paths['svm_run1_result_filename'] = paths['result_directory'] + "/" + dataset_class_prefix + '_results_run1.pkl'
         paths['svm_run2_result_filename'] = paths['result_directory'] + "/" + dataset_class_prefix + '_results_run2.pkl'
+        #Persistent store of the cross validation trials of all searches
+        paths['svm_trial_store_filename'] = paths['result_directory'] + "/" + dataset_class_prefix + '_trials.sqlite'
+        #Fit time model of the kernels and samplers of step42 for the forecast of the searches
+        paths['svm_training_cost_model_filename'] = paths['result_directory'] + "/" + dataset_class_prefix + '_training_cost_model.json'
+        #Wall times of the searches of step43 and step44 for the training budget
+        paths['svm_search_times_filename'] = paths['result_directory'] + "/" + dataset_class_prefix + '_search_times.json'
 
         # Source data files folder paths
         paths['source_path'] = paths['prepared_data_directory'] + "/" + dataset_name + "_source" + ".csv"
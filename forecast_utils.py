@@ -0,0 +1,453 @@
+import json
+import os
+import time
+import warnings
+
+import numpy as np
+import pandas as pd
+from joblib import cpu_count
+
+import search_utils as search
+import sklearn_utils as modelutil
+
+
+def get_kernel_params(kernel, approximate_components=500):
+    '''
+    Get the parameters of the svm step of the search pipelines for a kernel. Poly uses degree 3, which is the slower
+    degree of the wide search.
+
+    '''
+
+    if kernel in modelutil.APPROXIMATE_KERNELS:
+        return {'svm': modelutil.ApproximateKernelSVC(n_components=approximate_components), 'svm__kernel': kernel}
+    if kernel == 'poly':
+        return {'svm__kernel': kernel, 'svm__degree': 3}
+    return {'svm__kernel': kernel}
+
+
+def measure_training_costs(estimator, X, y, kernels, samplers, sample_sizes, feature_counts,
+                           approximate_components=500):
+    '''
+    Measure the fit times of the pipeline of the searches, which the parameters of search_utils.FitCostModel need, on
+    nested stratified subsets of the training data: each kernel on all sample sizes with the most features, and the
+    rbf kernel on the largest sample size with another C, another gamma, the fewest features and each sampler. Failed
+    fits are left out.
+
+    :args:
+        estimator: Pipeline of the searches with the steps sampling, feat and svm
+        X: Training data
+        y: Training labels
+        kernels: List of kernel names, e.g. rbf or nystroem_rbf
+        samplers: List of samplers, e.g. of the wide search
+        sample_sizes: List of numbers of samples
+        feature_counts: List of numbers of features, of which the smallest and the largest are measured
+        approximate_components: Number of components of the approximated kernels
+    :return:
+        history: List of (parameters, number of training samples, fit time in seconds) for FitCostModel.fit
+        measurements: Data frame with the kernel, sampler, C, gamma, n_samples, n_features and duration of each fit
+    '''
+
+    from sklearn.base import clone
+
+    X = np.asarray(X, dtype=np.float64)
+    y = np.asarray(y).ravel()
+    order = search.get_stratified_order(y)
+    sample_sizes = sorted(set(min(int(n), X.shape[0]) for n in sample_sizes))
+    n_max = sample_sizes[-1]
+    d_min = min(min(int(d), X.shape[1]) for d in feature_counts)
+    d_max = min(max(int(d), X.shape[1]) for d in feature_counts)
+    history = []
+    measurements = []
+
+    def measure(params, n_samples, n_features):
+        params = dict(params, feat__cols=list(range(n_features)))
+        sample_index = np.sort(order[:n_samples])
+        pipe = clone(estimator).set_params(**params)
+        start_time = time.time()
+        try:
+            pipe.fit(X[sample_index], y[sample_index])
+        except Exception as e:
+            # Like in the searches, e.g. a sampler, which cannot resample balanced classes, has no fit time
+            print("Fit of {} on {} samples failed: {}".format(params, n_samples, e))
+            return
+        duration = time.time() - start_time
+        history.append((params, n_samples, duration))
+        measurements.append({'kernel': params['svm__kernel'], 'sampler': type(params.get('sampling')).__name__,
+                             'C': params.get('svm__C', 1.0), 'gamma': params.get('svm__gamma', 'scale'),
+                             'n_samples': n_samples, 'n_features': n_features, 'duration': duration})
+
+    for kernel in kernels:
+        for n_samples in sample_sizes:
+            measure(dict(get_kernel_params(kernel, approximate_components), sampling=modelutil.Nosampler()),
+                    n_samples, d_max)
+        print("Measured the fit times of the kernel {} on the samples {}".format(kernel, sample_sizes))
+    rbf_params = {'svm__kernel': 'rbf', 'sampling': modelutil.Nosampler()}
+    measure(dict(rbf_params, svm__C=100.0), n_max, d_max)
+    measure(dict(rbf_params, svm__gamma=10.0 / d_max), n_max, d_max)
+    if d_min < d_max:
+        measure(rbf_params, n_max, d_min)
+    for sampler in samplers:
+        if type(sampler).__name__ != 'Nosampler':
+            measure(dict(rbf_params, sampling=sampler), n_max, d_max)
+    print("Measured {} fits for the training cost model".format(len(history)))
+
+    return history, pd.DataFrame(measurements)
+
+
+def get_cost_model_setup(config, X_train, selected_features):
+    '''
+    Get the kernels, samplers, sample sizes and feature counts of the measurements of the training cost model from the
+    configuration and the wide search
+
+    :args:
+        config: Configuration
+        X_train: Training data
+        selected_features: List of feature column lists
+    :return:
+        setup: Dict with the arguments kernels, samplers, sample_sizes, feature_counts and approximate_components of
+        measure_training_costs
+    '''
+
+    # Only imported for the measurement, as it imports the samplers of the wide search
+    import execution_utils as exe
+
+    max_features = int(config['Training'].get('max_features'))
+    approximate_kernels = json.loads(config['Training'].get('approximate_kernels', '[]'))
+    # The smallest and largest feature lists of the wide search give the exponent of the features
+    feature_counts = [len(cols) for cols in selected_features if len(cols) <= max_features]
+    if len(feature_counts) == 0:
+        feature_counts = [min(max_features, X_train.shape[1])]
+
+    return {'kernels': ['linear', 'poly', 'rbf', 'sigmoid'] + approximate_kernels,
+            'samplers': exe.get_wide_search_parameters(X_train, selected_features)[0]['sampling'],
+            'sample_sizes': json.loads(config['Training'].get('cost_model_samples', '[250, 500, 1000, 2000]')),
+            'feature_counts': sorted({min(feature_counts), max(feature_counts)}),
+            'approximate_components': int(config['Training'].get('approximate_components', '500'))}
+
+
+def get_cost_model_pipeline():
+    '''
+    Get the pipeline of the searches without the imputer, of which the cost model uses the sampler and the svm
+
+    '''
+
+    # Imbalanced-learn is only imported for the measurement and the forecast, as it takes long to import
+    from imblearn.pipeline import Pipeline
+    from sklearn.preprocessing import StandardScaler
+    from sklearn.svm import SVC
+
+    return Pipeline([('scaler', StandardScaler()), ('sampling', modelutil.Nosampler()),
+                     ('feat', modelutil.ColumnExtractor(cols=None)), ('svm', SVC())])
+
+
+def fit_training_cost_model(config, X_train, y_train, selected_features, cost_model_path):
+    '''
+    Measure the fit times of the searches with measure_training_costs, learn a search_utils.FitCostModel from them and
+    save it and the measurements for the forecasts of step43 and step44
+
+    :args:
+        config: Configuration
+        X_train: Training data
+        y_train: Training labels
+        selected_features: List of feature column lists
+        cost_model_path: Path of the cost model
+    :return:
+        cost_model: FitCostModel
+        measurements: Data frame of measure_training_costs
+    '''
+
+    setup = get_cost_model_setup(config, X_train, selected_features)
+    print("Measure the training cost model on the samples {} and the features {}".format(setup['sample_sizes'],
+                                                                                        setup['feature_counts']))
+    estimator = get_cost_model_pipeline()
+    history, measurements = measure_training_costs(estimator, X_train, y_train, **setup)
+    cost_model = search.FitCostModel(estimator, min_trials=1).fit(history, X_train.shape[1])
+    directory = os.path.dirname(cost_model_path)
+    if directory != "" and not os.path.isdir(directory):
+        os.makedirs(directory)
+    cost_model.save(cost_model_path)
+    measurements.round(5).to_csv(os.path.splitext(cost_model_path)[0] + "_measurements.csv", sep=";")
+
+    return cost_model, measurements
+
+
+def get_training_cost_model(config, estimator, X_train, y_train, selected_features, cost_model_path):
+    '''
+    Load the training cost model of step42 for the candidates of an estimator. If there is none and a training budget
+    is set, the cost model is measured with fit_training_cost_model, so that the searches do not depend on step42.
+
+    :args:
+        config: Configuration
+        estimator: Pipeline of the candidates, which are forecasted
+        X_train: Training data
+        y_train: Training labels
+        selected_features: List of feature column lists
+        cost_model_path: Path of the cost model
+    :return:
+        cost_model: FitCostModel or None, if there is no cost model and no budget
+    '''
+
+    if not os.path.isfile(cost_model_path):
+        if get_training_budget_hours(config) is None:
+            print("No training cost model found at {}. Run step42 for a forecast of the training time".format(
+                cost_model_path))
+            return None
+        fit_training_cost_model(config, X_train, y_train, selected_features, cost_model_path)
+
+    return search.load_fit_cost_model(cost_model_path, estimator)
+
+
+def get_training_budget_hours(config):
+    '''
+    Get the budget of the wall time of the wide and the narrow search in hours or None for no budget
+
+    '''
+
+    budget_hours = float(config['Training'].get('training_budget_hours', '0'))
+
+    return budget_hours if budget_hours > 0 else None
+
+
+def save_search_time(path, name, seconds):
+    '''
+    Save the wall time of a search in the json file of the search times, so that the next searches can compare their
+    forecast with the remaining training budget
+
+    '''
+
+    search_times = load_search_times(path)
+    search_times[name] = seconds
+    with open(path, 'w') as f:
+        json.dump(search_times, f, indent=2)
+    print("Saved the wall time {:.1f}s of the {} to {}".format(seconds, name, path))
+
+
+def load_search_times(path):
+    '''
+    Load the wall times of the searches in seconds of save_search_time. Without a file, the dict is empty.
+
+    '''
+
+    if not os.path.isfile(path):
+        return dict()
+    with open(path, 'r') as f:
+        return json.load(f)
+
+
+def get_refit_seconds(cost_model, candidates, n_samples, n_features):
+    '''
+    Forecast the refit of the best candidate of a search as the mean fit time of the candidates on all samples
+
+    '''
+
+    return float(np.mean([cost_model.predict(params, n_samples, n_features) for params in candidates]))
+
+
+def add_forecasts(*forecasts):
+    '''
+    Add the fits, CPU times and wall times of searches, which are executed one after the other
+
+    '''
+
+    return {key: sum(forecast[key] for forecast in forecasts) for key in ['n_fits', 'cpu_seconds', 'wall_seconds']}
+
+
+def forecast_search(cost_model, candidates, n_samples, kfolds, n_features, n_cores=None, refit=True):
+    '''
+    Forecast the CPU time and the wall time of a cross validated search of candidates. The fits of all candidates and
+    folds are spread over the cores, so the wall time is the CPU time divided by the cores, but at least the longest
+    fit. The refit of the best candidate follows with the mean fit time on all samples. The savings of the precomputed
+    kernels, the prefix cache and pruning are not included, i.e. the forecast is an upper bound.
+
+    :args:
+        cost_model: search_utils.FitCostModel of the pipeline of the search
+        candidates: List of parameter dicts
+        n_samples: Number of samples of the search, of which each fold fits (kfolds - 1) / kfolds
+        kfolds: Number of folds
+        n_features: Number of features of candidates without feature columns
+        n_cores: Number of cores. None for all cores of the process
+        refit: If True, the refit of the best candidate is included
+    :return:
+        forecast: Dict with n_fits, cpu_seconds and wall_seconds
+    '''
+
+    n_cores = cpu_count() if n_cores is None else n_cores
+    if len(candidates) == 0:
+        return {'n_fits': 0, 'cpu_seconds': 0.0, 'wall_seconds': 0.0}
+    fold_samples = int(n_samples * (kfolds - 1) / kfolds)
+    fold_times = np.array([cost_model.predict(params, fold_samples, n_features) for params in candidates])
+    cpu_seconds = kfolds * np.sum(fold_times)
+    wall_seconds = max(cpu_seconds / n_cores, np.max(fold_times))
+    n_fits = kfolds * len(candidates)
+    if refit:
+        refit_seconds = get_refit_seconds(cost_model, candidates, n_samples, n_features)
+        cpu_seconds += refit_seconds
+        wall_seconds += refit_seconds
+        n_fits += 1
+
+    return {'n_fits': n_fits, 'cpu_seconds': float(cpu_seconds), 'wall_seconds': float(wall_seconds)}
+
+
+def forecast_halving_search(cost_model, candidates, min_samples, max_samples, factor, kfolds, n_features,
+                            n_cores=None):
+    '''
+    Forecast the CPU time and the wall time of search_utils.SuccessiveHalvingSearchCV. Each rung fits the kept share of
+    the candidates, which is forecasted as the share of the forecast of all candidates on the rung samples. The best
+    candidate is refitted on the samples of the last rung.
+
+    :args:
+        cost_model: search_utils.FitCostModel of the pipeline of the search
+        candidates: List of parameter dicts
+        min_samples: Number of samples of the first rung
+        max_samples: Number of samples of the last rung
+        factor: Halving factor
+        kfolds: Number of folds
+        n_features: Number of features of candidates without feature columns
+        n_cores: Number of cores. None for all cores of the process
+    :return:
+        forecast: Dict with n_fits, cpu_seconds and wall_seconds
+    '''
+
+    forecast = {'n_fits': 0, 'cpu_seconds': 0.0, 'wall_seconds': 0.0}
+    sizes = search.get_rung_sizes(len(candidates), min_samples, max_samples, factor)
+    n_rung_candidates = len(candidates)
+    for n_samples in sizes:
+        rung_forecast = forecast_search(cost_model, candidates, n_samples, kfolds, n_features, n_cores=n_cores,
+                                        refit=False)
+        share = n_rung_candidates / len(candidates)
+        forecast['n_fits'] += kfolds * n_rung_candidates
+        forecast['cpu_seconds'] += share * rung_forecast['cpu_seconds']
+        forecast['wall_seconds'] += share * rung_forecast['wall_seconds']
+        n_rung_candidates = max(1, int(np.ceil(n_rung_candidates / factor)))
+    refit_seconds = get_refit_seconds(cost_model, candidates, sizes[-1], n_features)
+    forecast['n_fits'] += 1
+    forecast['cpu_seconds'] += refit_seconds
+    forecast['wall_seconds'] += refit_seconds
+
+    return forecast
+
+
+def forecast_narrow_search(cost_model, params, n_features, n_train, samples, kfolds, iterations, C_bounds=(1e-5, 1e5),
+                           gamma_bounds=None, batch_size=None, n_cores=None):
+    '''
+    Forecast the CPU time and the wall time of the runs of the narrow search of step44. The runs are executed one
+    after the other. The fit time of a candidate is the mean fit time of a log grid of C within C_bounds and gamma
+    within gamma_bounds. Without batch_size, all candidates of a run are fitted in parallel like in the iterated random
+    search. With batch_size, batches of candidates are fitted one after the other like in the TPE search.
+
+    :args:
+        cost_model: search_utils.FitCostModel of the pipeline of the search
+        params: Parameters of the candidates except C and gamma, e.g. the kernel and the sampler. An empty dict for the
+        kernel and sampler of the pipeline of the cost model
+        n_features: Number of features of the candidates
+        n_train: Number of training samples
+        samples: List of the shares of the training data of the runs
+        kfolds: List of the numbers of folds of the runs
+        iterations: List of the numbers of candidates of the runs
+        C_bounds: Minimum and maximum C of the candidates
+        gamma_bounds: Minimum and maximum gamma of the candidates. None for the gamma of the pipeline
+        batch_size: Number of candidates, which are fitted in parallel. None for all candidates of a run
+        n_cores: Number of cores. None for all cores of the process
+    :return:
+        forecast: Dict with n_fits, cpu_seconds and wall_seconds
+    '''
+
+    n_cores = cpu_count() if n_cores is None else n_cores
+    svm_prefix, _ = search.get_svm_prefix(cost_model.estimator)
+    grid = [dict(params, **{svm_prefix + 'C': C}) for C in np.logspace(np.log10(C_bounds[0]), np.log10(C_bounds[1]), 5)]
+    if gamma_bounds is not None:
+        grid = [dict(candidate, **{svm_prefix + 'gamma': gamma}) for candidate in grid
+                for gamma in np.logspace(np.log10(gamma_bounds[0]), np.log10(gamma_bounds[1]), 5)]
+    forecast = {'n_fits': 0, 'cpu_seconds': 0.0, 'wall_seconds': 0.0}
+    for sample_share, n_folds, n_iter in zip(samples, kfolds, iterations):
+        n_samples = int(sample_share * n_train)
+        fold_time = np.mean([cost_model.predict(candidate, int(n_samples * (n_folds - 1) / n_folds), n_features)
+                             for candidate in grid])
+        refit_time = np.mean([cost_model.predict(candidate, n_samples, n_features) for candidate in grid])
+        n_batch = n_iter if batch_size is None else max(1, min(batch_size, n_iter))
+        batches = [n_batch] * (n_iter // n_batch) + ([n_iter % n_batch] if n_iter % n_batch > 0 else [])
+        forecast['n_fits'] += n_folds * n_iter + 1
+        forecast['cpu_seconds'] += float(n_folds * n_iter * fold_time + refit_time)
+        forecast['wall_seconds'] += float(sum(max(n_folds * size * fold_time / n_cores, fold_time) for size in batches)
+                                          + refit_time)
+
+    return forecast
+
+
+def print_forecast(name, forecast, n_cores=None):
+    '''
+    Print the forecast of a search
+
+    '''
+
+    n_cores = cpu_count() if n_cores is None else n_cores
+    print("Forecast of the {}: {} fits, {:.3f} CPU-hours, wall time {:.3f} hours on {} cores".format(
+        name, forecast['n_fits'], forecast['cpu_seconds'] / 3600, forecast['wall_seconds'] / 3600, n_cores))
+
+
+def shrink_to_budget(forecast_function, budget_seconds, min_factor, tolerance=0.01):
+    '''
+    Find the largest factor of a data share in [min_factor, 1], whose forecasted wall time is within the budget, by
+    bisection. The forecast has to grow with the factor.
+
+    :args:
+        forecast_function: Function of the factor, which returns a forecast
+        budget_seconds: Budget of the wall time in seconds
+        min_factor: Smallest factor
+        tolerance: Tolerance of the factor
+    :return:
+        factor: Largest factor within the budget or min_factor, if no factor is within the budget
+    '''
+
+    if forecast_function(1.0)['wall_seconds'] <= budget_seconds:
+        return 1.0
+    lower, upper = min_factor, 1.0
+    if forecast_function(lower)['wall_seconds'] > budget_seconds:
+        return min_factor
+    while upper - lower > tolerance:
+        middle = (lower + upper) / 2
+        if forecast_function(middle)['wall_seconds'] <= budget_seconds:
+            lower = middle
+        else:
+            upper = middle
+
+    return lower
+
+
+def check_training_budget(name, forecast_function, budget_hours, budget_action='warn', min_factor=1.0):
+    '''
+    Forecast a search and compare the wall time with the budget. If it exceeds the budget, warn or, with the action
+    shrink, get the largest factor of the data share within the budget.
+
+    :args:
+        name: Name of the search for the printout
+        forecast_function: Function of the factor of the data share, which returns a forecast
+        budget_hours: Budget of the wall time in hours. None for no budget
+        budget_action: warn or shrink
+        min_factor: Smallest factor of the data share
+    :return:
+        factor: Factor of the data share, 1.0 if the data share is not changed
+    '''
+
+    forecast = forecast_function(1.0)
+    print_forecast(name, forecast)
+    if budget_hours is None or forecast['wall_seconds'] <= budget_hours * 3600:
+        return 1.0
+
+    if budget_action == 'shrink':
+        factor = shrink_to_budget(forecast_function, budget_hours * 3600, min(min_factor, 1.0))
+        if factor < 1.0:
+            forecast = forecast_function(factor)
+            print("The {} is shrunk to {:.1%} of its data share for the budget of {:.3f} hours".format(
+                name, factor, budget_hours))
+            print_forecast(name, forecast)
+        if forecast['wall_seconds'] > budget_hours * 3600:
+            warnings.warn("The forecast of the {} exceeds the budget of {:.3f} hours at the smallest data "
+                          "share".format(name, budget_hours))
+        return factor
+    elif budget_action == 'warn':
+        warnings.warn("The forecast of the {} of {:.3f} hours exceeds the budget of {:.3f} hours. Reduce the data "
+                      "share or set budget_action=shrink".format(name, forecast['wall_seconds'] / 3600, budget_hours))
+        return 1.0
+    else:
+        raise Exception("Unknown budget action {}. Use warn or shrink".format(budget_action))
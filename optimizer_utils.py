@@ -0,0 +1,273 @@
+import time
+
+import numpy as np
+from scipy.special import logsumexp
+from sklearn.base import BaseEstimator, clone
+
+import search_utils as search
+
+
+class TPEOptimizer:
+    '''
+    Tree-structured Parzen estimator for continuous parameters on a logarithmic scale, e.g. C and gamma of an SVM.
+    The observations are split into the best share gamma and the rest. Each is modelled by a Parzen density of
+    Gaussians around the observations in log10 space and a uniform prior over the bounds. New candidates are sampled
+    from the density of the good observations and the candidate with the highest ratio of good to bad density is
+    proposed.
+
+    Batches of candidates for parallel workers are proposed with a constant liar: each proposed candidate is added as
+    a bad observation, so that the next candidate of the batch is proposed in another region.
+
+    '''
+
+    def __init__(self, param_bounds, gamma=0.25, n_startup=10, n_ei_candidates=64, random_state=None):
+        '''
+        :args:
+            param_bounds: Dict of parameter names and (min, max). The parameters are sampled log-uniform
+            gamma: Share of the best observations, which are modelled as good
+            n_startup: Number of observations, before which candidates are sampled randomly
+            n_ei_candidates: Number of sampled candidates, from which the best is proposed
+            random_state: Random state
+        '''
+
+        self.param_names = sorted(param_bounds.keys())
+        self.lower = np.log10([float(param_bounds[name][0]) for name in self.param_names])
+        self.upper = np.log10([float(param_bounds[name][1]) for name in self.param_names])
+        self.gamma = gamma
+        self.n_startup = n_startup
+        self.n_ei_candidates = n_ei_candidates
+        self.rng = np.random.RandomState(random_state)
+        self.points = []
+        self.scores = []
+
+    def tell(self, params, score):
+        '''
+        Add an observation. Failed candidates with a nan score are worse than all others.
+
+        :args:
+            params: Parameter dict with all parameters of the bounds
+            score: Score of the candidate, higher is better
+        :return:
+            Nothing
+        '''
+
+        self.points.append(np.log10([float(params[name]) for name in self.param_names]))
+        self.scores.append(-np.inf if score is None or np.isnan(score) else float(score))
+
+    def ask(self, n_candidates=1):
+        '''
+        Propose a batch of candidates
+
+        :args:
+            n_candidates: Number of candidates
+        :return:
+            candidates: List of parameter dicts
+        '''
+
+        points = list(self.points)
+        scores = list(self.scores)
+        proposals = []
+        for _ in range(n_candidates):
+            if len(points) < self.n_startup:
+                point = self.rng.uniform(self.lower, self.upper)
+            else:
+                point = self.propose(np.array(points), np.array(scores))
+            proposals.append(point)
+            # Constant liar: the proposal counts as the worst observation for the rest of the batch
+            points.append(point)
+            scores.append(np.min(scores) if len(scores) > 0 else -np.inf)
+
+        return [{name: float(10 ** point[i]) for i, name in enumerate(self.param_names)} for point in proposals]
+
+    def propose(self, points, scores):
+        '''
+        Propose one candidate from the observations
+
+        '''
+
+        n_good = max(1, int(np.ceil(self.gamma * points.shape[0])))
+        order = np.argsort(-scores, kind='stable')
+        good = points[order[:n_good]]
+        bad = points[order[n_good:]]
+
+        samples = self.sample_parzen(good, self.n_ei_candidates)
+        ratio = self.log_parzen_density(samples, good) - self.log_parzen_density(samples, bad)
+
+        return samples[np.argmax(ratio)]
+
+    def get_bandwidth(self, centers):
+        '''
+        Get the bandwidth of the Gaussians for each parameter with Scott's rule. The bandwidth is at least 20% of the
+        range of the parameter. Smaller bandwidths concentrate the search on the first good region too early.
+
+        '''
+
+        width = self.upper - self.lower
+        n = centers.shape[0]
+        std = np.std(centers, axis=0) if n > 1 else width
+        bandwidth = std * n ** (-1.0 / (centers.shape[1] + 4))
+
+        return np.maximum(bandwidth, 0.2 * width + 1e-12)
+
+    def sample_parzen(self, centers, n_samples):
+        '''
+        Sample from the Parzen density of the centers. With the probability of the prior weight, a sample is drawn
+        from the uniform prior.
+
+        '''
+
+        bandwidth = self.get_bandwidth(centers)
+        component = self.rng.randint(0, centers.shape[0] + 1, size=n_samples)
+        samples = self.rng.uniform(self.lower, self.upper, size=(n_samples, centers.shape[1]))
+        from_centers = component < centers.shape[0]
+        samples[from_centers] = centers[component[from_centers]] + \
+                                self.rng.normal(size=(np.sum(from_centers), centers.shape[1])) * bandwidth
+
+        return np.clip(samples, self.lower, self.upper)
+
+    def log_parzen_density(self, samples, centers):
+        '''
+        Log density of the samples in the Parzen density of the centers with the uniform prior as additional component
+
+        '''
+
+        width = np.maximum(self.upper - self.lower, 1e-12)
+        log_prior = -np.sum(np.log(width))
+        if centers.shape[0] == 0:
+            return np.full(samples.shape[0], log_prior)
+
+        bandwidth = self.get_bandwidth(centers)
+        z = (samples[:, np.newaxis, :] - centers[np.newaxis, :, :]) / bandwidth
+        log_gauss = -0.5 * np.sum(z ** 2, axis=2) - np.sum(np.log(np.sqrt(2 * np.pi) * bandwidth))
+        log_components = np.concatenate([log_gauss, np.full((samples.shape[0], 1), log_prior)], axis=1)
+
+        return logsumexp(log_components, axis=1) - np.log(centers.shape[0] + 1)
+
+
+class TPESearchCV(BaseEstimator):
+    '''
+    Sequential model-based search over continuous parameters with a TPEOptimizer. In each step, a batch of candidates
+    is proposed and evaluated with a JournaledSearchCV, i.e. the folds of all candidates of a batch run in parallel and
+    finished fits are kept in the journal and the trial store. The optimizer can be warm started with observations of
+    earlier searches, e.g. of the wide search, and with the trials of the same search in the trial store.
+
+    The interface and the results are the same as for JournaledSearchCV. cv_results_ contains all evaluated candidates.
+
+    '''
+
+    def __init__(self, estimator, param_bounds, scoring, refit, cv, n_iter=40, batch_size=4, n_startup=10,
+                 warm_start=None, random_state=None, n_jobs=-1, verbose=0, return_train_score=True,
+                 journal_path=None, trial_store_path=None, precompute_kernel=False, kernel_memory_mb=1024):
+        self.estimator = estimator
+        self.param_bounds = param_bounds
+        self.scoring = scoring
+        self.refit = refit
+        self.cv = cv
+        self.n_iter = n_iter
+        self.batch_size = batch_size
+        self.n_startup = n_startup
+        self.warm_start = warm_start
+        self.random_state = random_state
+        self.n_jobs = n_jobs
+        self.verbose = verbose
+        self.return_train_score = return_train_score
+        self.journal_path = journal_path
+        self.trial_store_path = trial_store_path
+        self.precompute_kernel = precompute_kernel
+        self.kernel_memory_mb = kernel_memory_mb
+
+    def get_store_warm_start(self, X, y):
+        '''
+        Get the observations of the same search from the trial store
+
+        :return:
+            observations: List of (parameters, score)
+        '''
+
+        if self.trial_store_path is None:
+            return []
+
+        search_key = search.JournaledSearchCV(self.estimator, [], self.scoring, self.refit, self.cv,
+                                              return_train_score=self.return_train_score).get_search_key(
+            X, y, list(self.cv.split(X, y)))
+        store = search.TrialStore(self.trial_store_path)
+        if not (store.get_searches()['search'] == search_key).any():
+            return []
+
+        stored_results = store.get_cv_results(search_key)
+        return [(params, score) for params, score in zip(stored_results['params'],
+                                                          stored_results['mean_test_' + self.refit])
+                if all(name in params for name in self.param_bounds.keys())]
+
+    def fit(self, X, y):
+        '''
+        Propose and evaluate batches of candidates until n_iter candidates have been evaluated and refit the best
+        candidate on the whole data
+
+        :args:
+            X: Features
+            y: Labels
+        :return:
+            self
+        '''
+
+        optimizer = TPEOptimizer(self.param_bounds, n_startup=self.n_startup, random_state=self.random_state)
+        warm_start = list(self.warm_start) if self.warm_start is not None else []
+        warm_start.extend(self.get_store_warm_start(X, y))
+        for params, score in warm_start:
+            optimizer.tell(params, score)
+        self.n_warm_start_ = len(warm_start)
+        print("TPE search with {} candidates in batches of {}. Warm start with {} observations".format(
+            self.n_iter, self.batch_size, self.n_warm_start_))
+
+        candidates = []
+        records = dict()
+        best_score = -np.inf
+        while len(candidates) < self.n_iter:
+            batch_candidates = optimizer.ask(min(self.batch_size, self.n_iter - len(candidates)))
+            batch_search = search.JournaledSearchCV(self.estimator, batch_candidates, self.scoring, self.refit,
+                                                    self.cv, n_jobs=self.n_jobs, verbose=self.verbose,
+                                                    return_train_score=self.return_train_score,
+                                                    journal_path=self.journal_path, refit_best=False,
+                                                    trial_store_path=self.trial_store_path,
+                                                    precompute_kernel=self.precompute_kernel,
+                                                    kernel_memory_mb=self.kernel_memory_mb).fit(X, y)
+            for params, score in zip(batch_candidates, batch_search.cv_results_['mean_test_' + self.refit]):
+                optimizer.tell(params, score)
+            candidates.extend(batch_candidates)
+            records.update(batch_search.records_)
+            best_score = np.nanmax([best_score, batch_search.best_score_])
+            print("TPE search: {} of {} candidates evaluated. Best {}={:.3f}".format(len(candidates), self.n_iter,
+                                                                                     self.refit, best_score))
+
+        self.n_splits_ = batch_search.n_splits_
+        candidate_keys = [search.get_candidate_key(params) for params in candidates]
+        self.cv_results_ = search.create_cv_results(candidates, candidate_keys, records, self.n_splits_,
+                                                    list(self.scoring.keys()), self.return_train_score)
+
+        self.best_index_ = int(self.cv_results_['rank_test_' + self.refit].argmin())
+        self.best_params_ = candidates[self.best_index_]
+        self.best_score_ = self.cv_results_['mean_test_' + self.refit][self.best_index_]
+
+        start_time = time.time()
+        self.best_estimator_ = clone(self.estimator).set_params(**self.best_params_)
+        self.best_estimator_.fit(X, y)
+        self.refit_time_ = time.time() - start_time
+
+        return self
+
+    def score(self, X, y):
+        return self.scoring[self.refit](self.best_estimator_, X, y)
+
+    def predict(self, X):
+        return self.best_estimator_.predict(X)
+
+    def decision_function(self, X):
+        return self.best_estimator_.decision_function(X)
+
+    def predict_proba(self, X):
+        return self.best_estimator_.predict_proba(X)
+
+    @property
+    def classes_(self):
+        return self.best_estimator_.classes_
@@ -0,0 +1,395 @@
+import importlib
+import os
+import subprocess
+import sys
+import time
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+
+# A stage is one call of a step entry function. The same step can be called several times with different arguments,
+# e.g. step 50 for the sections Model and ModelFinal.
+# step: Step number, which is used to select stages with a range like 20-61
+# name: Unique name of the stage
+# module: Module name of the step script
+# function: Name of the entry function in the module. The first argument of the function is the config path
+# kwargs: Further arguments of the entry function
+# deps: Names of the stages, which have to be finished before the stage can start
+# cpus: Number of cpu cores, which the stage uses. None for stages, which use all cores of the cpu budget, e.g. searches
+# with n_jobs=-1
+Stage = namedtuple('Stage', ['step', 'name', 'module', 'function', 'kwargs', 'deps', 'cpus'])
+
+# Stages of the complete training, in the same order as in omxs30debugx_run_step100_complete_training.bat
+TRAINING_STAGES = [
+    Stage(20, 'step20', 'step20_generate_groundtruth_stockmarket', 'main', {}, [], 1),
+    Stage(21, 'step21', 'step21_generate_features', 'main', {'debug_param': 'debug'}, [], 1),
+    Stage(22, 'step22', 'step22_adapt_dimensions', 'main', {}, ['step20', 'step21'], 1),
+    Stage(30, 'step30', 'step30_clean_raw_data', 'main', {'on_inference_data': False, 'no_images': False},
+          ['step22'], 1),
+    Stage(31, 'step31', 'step31_adapt_features', 'main', {}, ['step30'], 1),
+    Stage(33, 'step33', 'step33_analyze_data', 'main', {}, ['step31'], 1),
+    Stage(34, 'step34', 'step34_analyze_temporal_data', 'main', {}, ['step31'], 1),
+    Stage(35, 'step35', 'step35_perform_feature_selection', 'main', {}, ['step31'], 1),
+    Stage(36, 'step36', 'step36_split_training_validation', 'split_train_validation_data', {}, ['step31'], 1),
+    Stage(42, 'step42', 'step42_analyze_training_time_svm', 'run_training_predictors', {'algorithm': 'svm'},
+          ['step36'], 1),
+    Stage(43, 'step43', 'step43_wide_hyperparameter_search_svm', 'execute_wide_run',
+          {'execute_search': True, 'debug_parameters': 'debug'}, ['step35', 'step36'], None),
+    Stage(44, 'step44', 'step44_narrow_hyperparameter_search_svm', 'execute_narrow_search', {}, ['step43'], None),
+    Stage(45, 'step45', 'step45_define_precision_recall', 'define_precision_recall_threshold', {}, ['step44'], 1),
+    Stage(50, 'step50_model', 'step50_train_model_from_pipe', 'train_final_model', {'config_section': 'Model'},
+          ['step44', 'step45'], 1),
+    Stage(50, 'step50_model_final', 'step50_train_model_from_pipe', 'train_final_model',
+          {'config_section': 'ModelFinal'}, ['step44', 'step45'], 1),
+    Stage(60, 'step60_evaluation_training', 'step60_evaluate_model', 'evaluate_model',
+          {'config_section': 'EvaluationTraining'}, ['step50_model'], 1),
+    Stage(61, 'step61_evaluation_training', 'step61_evaluate_model_temporal_data', 'visualize_temporal_data',
+          {'config_section': 'EvaluationTraining'}, ['step50_model'], 1),
+    Stage(60, 'step60_evaluation', 'step60_evaluate_model', 'evaluate_model', {'config_section': 'Evaluation'},
+          ['step50_model'], 1),
+    Stage(61, 'step61_evaluation', 'step61_evaluate_model_temporal_data', 'visualize_temporal_data',
+          {'config_section': 'Evaluation'}, ['step50_model'], 1),
+]
+
+# Stages of the inference, in the same order as in omxs30debugx_run_step100_complete_inference.bat
+INFERENCE_STAGES = [
+    Stage(21, 'step21', 'step21_generate_features', 'main', {'debug_param': 'debug'}, [], 1),
+    Stage(22, 'step22', 'step22_adapt_dimensions', 'main', {}, ['step21'], 1),
+    Stage(30, 'step30', 'step30_clean_raw_data', 'main', {'on_inference_data': True, 'no_images': True},
+          ['step22'], 1),
+    Stage(31, 'step31', 'step31_adapt_features', 'main', {}, ['step30'], 1),
+    Stage(70, 'step70', 'step70_predict_temporal_data', 'visualize_temporal_data', {'config_section': 'Evaluation'},
+          ['step31'], 1),
+]
+
+PIPELINES = {'training': TRAINING_STAGES, 'inference': INFERENCE_STAGES}
+
+# Maximum import time in seconds of the inference entry points. Heavy libraries, which are only needed for images or
+# searches, are imported within the functions, which use them. step21 needs pandas_ta and step70 needs sklearn to load
+# the model, which is why they get a higher budget.
+IMPORT_TIME_BUDGETS = {
+    'step21_generate_features': 2.0,
+    'step22_adapt_dimensions': 1.0,
+    'step30_clean_raw_data': 1.0,
+    'step31_adapt_features': 1.0,
+    'step70_predict_temporal_data': 2.5,
+}
+
+
+def parse_step_selection(selection):
+    '''
+    Parse a step selection string into a set of step numbers
+
+    :args:
+        selection: Comma separated step numbers or ranges, e.g. "20-36,43". None selects all steps
+    :return:
+        steps: Set of selected step numbers or None for all steps
+    '''
+
+    if selection is None or selection.strip() == "":
+        return None
+
+    steps = set()
+    for part in selection.split(','):
+        part = part.strip()
+        if '-' in part:
+            start, stop = part.split('-', 1)
+            steps.update(range(int(start), int(stop) + 1))
+        else:
+            steps.add(int(part))
+
+    return steps
+
+
+def select_stages(pipeline_name, selection=None):
+    '''
+    Get the stages of a pipeline, which are within the step selection
+
+    :args:
+        pipeline_name: Name of the pipeline, training or inference
+        selection: Step selection string, e.g. "20-61"
+    :return:
+        stages: List of selected stages in execution order
+    '''
+
+    if pipeline_name not in PIPELINES:
+        raise Exception("Unknown pipeline {}. Use one of {}".format(pipeline_name, list(PIPELINES.keys())))
+
+    steps = parse_step_selection(selection)
+    stages = [stage for stage in PIPELINES[pipeline_name] if steps is None or stage.step in steps]
+
+    return stages
+
+
+def limit_stage_cpus(cpus):
+    '''
+    Limit the current process to a number of cpu cores. joblib resolves n_jobs=-1 with the environment variable
+    LOKY_MAX_CPU_COUNT, i.e. the searches with n_jobs=-1 start at most cpus workers, and the BLAS threads of the process
+    are limited to cpus.
+
+    :args:
+        cpus: Number of cpu cores
+    :return:
+        Nothing
+    '''
+
+    from threadpoolctl import threadpool_limits
+
+    os.environ['LOKY_MAX_CPU_COUNT'] = str(cpus)
+    threadpool_limits(limits=cpus)
+
+
+def run_stage(stage, config_path, debug=False, cpus=None):
+    '''
+    Import the step module of a stage and call its entry function in the current interpreter
+
+    :args:
+        stage: Stage to run
+        config_path: Configuration file path, which is the first argument of all entry functions
+        debug: Value for all stage arguments, which are set to 'debug'
+        cpus: Number of cpu cores, which the stage may use. None for no limit
+    :return:
+        duration: Duration of the stage in seconds
+    '''
+
+    if cpus is not None:
+        limit_stage_cpus(cpus)
+
+    # Arguments with the value 'debug' take the debug flag of the run
+    kwargs = {k: (debug if v == 'debug' else v) for k, v in stage.kwargs.items()}
+
+    print("=== Run stage {}: {}.{}({}, {}) ===".format(stage.name, stage.module, stage.function, config_path, kwargs))
+    t = time.time()
+    module = importlib.import_module(stage.module)
+    getattr(module, stage.function)(config_path, **kwargs)
+    duration = time.time() - t
+    print("=== Stage {} finished in {:.1f}s ===".format(stage.name, duration))
+
+    return duration
+
+
+def run_pipeline(config_path, pipeline_name='training', selection=None, debug=False):
+    '''
+    Run the stages of a pipeline one after another in one interpreter. Libraries are imported only once and csv
+    files, which are written by one step and read by the next steps, are kept in the csv cache of the process and
+    are not read from disk again (see sup.write_csv_cached and sup.read_csv_cached).
+
+    :args:
+        config_path: Configuration file path
+        pipeline_name: Name of the pipeline, training or inference
+        selection: Step selection string, e.g. "20-61". None runs all steps
+        debug: Use debug parameters in the steps, which support it
+    :return:
+        durations: Dict of stage names and durations in seconds
+    '''
+
+    stages = select_stages(pipeline_name, selection)
+    print("Run {} pipeline with the stages {}".format(pipeline_name, [stage.name for stage in stages]))
+
+    durations = dict()
+    t = time.time()
+    for stage in stages:
+        durations[stage.name] = run_stage(stage, config_path, debug)
+    total_duration = time.time() - t
+
+    print("=== Pipeline summary ===")
+    for name, duration in durations.items():
+        print("{:<30} {:>10.1f}s".format(name, duration))
+    print("{:<30} {:>10.1f}s".format("Total", total_duration))
+
+    return durations
+
+
+def get_stage_cpus(stage, cpu_budget):
+    '''
+    Get the number of cpu cores, which a stage reserves from the cpu budget
+
+    :args:
+        stage: Stage
+        cpu_budget: Number of cpu cores, which are available for the whole pipeline
+    :return:
+        cpus: Number of reserved cores. Stages, which use all cores, reserve the whole budget and run with n_jobs=-1
+        on the cores of the budget (see limit_stage_cpus)
+    '''
+
+    if stage.cpus is None:
+        return cpu_budget
+    return min(stage.cpus, cpu_budget)
+
+
+def get_critical_path(stages, durations):
+    '''
+    Get the chain of dependent stages with the longest total duration. This chain bounds the duration of a parallel
+    run, independent of the number of cores.
+
+    :args:
+        stages: List of the run stages in execution order
+        durations: Dict of stage names and durations in seconds
+    :return:
+        critical_path: List of stage names from the first to the last stage of the chain
+        critical_duration: Sum of the durations of the chain in seconds
+    '''
+
+    # Longest finish time of each stage, if it starts as soon as all its dependencies are finished
+    finish = dict()
+    predecessor = dict()
+    for stage in stages:
+        deps = [d for d in stage.deps if d in finish]
+        start = 0
+        predecessor[stage.name] = None
+        for d in deps:
+            if finish[d] > start:
+                start = finish[d]
+                predecessor[stage.name] = d
+        finish[stage.name] = start + durations[stage.name]
+
+    last = max(finish, key=finish.get)
+    critical_path = []
+    name = last
+    while name is not None:
+        critical_path.insert(0, name)
+        name = predecessor[name]
+
+    return critical_path, finish[last]
+
+
+def run_pipeline_parallel(config_path, pipeline_name='training', selection=None, debug=False, cpu_budget=None):
+    '''
+    Run the stages of a pipeline as a dependency graph. Each stage is started in a process pool as soon as all its
+    dependencies are finished and enough cores of the cpu budget are free. Each stage is limited to its reserved cores,
+    i.e. the searches, which reserve the whole budget, use cpu_budget workers and not all cores of the machine.
+    Dependencies, which are not in the selection, are considered as finished by an earlier run. The csv cache is per process, i.e. the stages of the pool do not share
+    it and read the files of the other stages from disk.
+
+    :args:
+        config_path: Configuration file path
+        pipeline_name: Name of the pipeline, training or inference
+        selection: Step selection string, e.g. "20-61". None runs all steps
+        debug: Use debug parameters in the steps, which support it
+        cpu_budget: Number of cpu cores for all running stages together. None uses all cores of the machine
+    :return:
+        durations: Dict of stage names and durations in seconds
+    '''
+
+    if cpu_budget is None:
+        cpu_budget = os.cpu_count()
+
+    stages = select_stages(pipeline_name, selection)
+    selected_names = [stage.name for stage in stages]
+    print("Run {} pipeline in parallel with a budget of {} cpus and the stages {}".format(
+        pipeline_name, cpu_budget, selected_names))
+
+    pending = list(stages)
+    finished = set()
+    running = dict()
+    free_cpus = cpu_budget
+    durations = dict()
+    start_times = dict()
+    error = None
+
+    t = time.time()
+    with ProcessPoolExecutor(max_workers=cpu_budget) as executor:
+        while pending or running:
+            # Start all ready stages in pipeline order, which fit into the free cpus
+            if error is None:
+                for stage in list(pending):
+                    ready = all(d in finished or d not in selected_names for d in stage.deps)
+                    cpus = get_stage_cpus(stage, cpu_budget)
+                    if ready and cpus <= free_cpus:
+                        future = executor.submit(run_stage, stage, config_path, debug, cpus)
+                        running[future] = (stage, cpus)
+                        start_times[stage.name] = time.time() - t
+                        free_cpus -= cpus
+                        pending.remove(stage)
+            else:
+                pending = []
+
+            if not running:
+                break
+
+            done, _ = wait(list(running.keys()), return_when=FIRST_COMPLETED)
+            for future in done:
+                stage, cpus = running.pop(future)
+                free_cpus += cpus
+                try:
+                    durations[stage.name] = future.result()
+                    finished.add(stage.name)
+                except Exception as e:
+                    print("Stage {} failed: {}".format(stage.name, e))
+                    if error is None:
+                        error = e
+    total_duration = time.time() - t
+
+    if error is not None:
+        raise error
+
+    critical_path, critical_duration = get_critical_path(stages, durations)
+
+    print("=== Pipeline summary ===")
+    print("{:<30} {:>10} {:>10} {:>10}".format("Stage", "Start", "Duration", "Critical"))
+    for stage in stages:
+        print("{:<30} {:>9.1f}s {:>9.1f}s {:>10}".format(stage.name, start_times[stage.name], durations[stage.name],
+                                                        "x" if stage.name in critical_path else ""))
+    print("{:<30} {:>10} {:>9.1f}s".format("Total", "", total_duration))
+    print("Sequential duration: {:.1f}s".format(sum(durations.values())))
+    print("Critical path: {:.1f}s, {}".format(critical_duration, " -> ".join(critical_path)))
+
+    return durations
+
+
+def measure_import_time(module_name):
+    '''
+    Measure the import time of a module in a new interpreter with python -X importtime
+
+    :args:
+        module_name: Name of the module, e.g. step30_clean_raw_data
+    :return:
+        import_time: Cumulative import time of the module including all its imports in seconds
+    '''
+
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import ' + module_name],
+                            cwd=os.path.dirname(os.path.abspath(__file__)), stdout=subprocess.PIPE,
+                            stderr=subprocess.PIPE, universal_newlines=True)
+    if result.returncode != 0:
+        raise Exception("Import of {} failed: {}".format(module_name, result.stderr.strip().splitlines()[-1]))
+
+    # Lines have the format "import time: self [us] | cumulative | module". The top level module has no indent.
+    for line in result.stderr.splitlines():
+        if line.startswith('import time:') and line.split('|')[-1] == ' ' + module_name:
+            return int(line.split('|')[1]) / 1e6
+
+    raise Exception("No import time found for {}".format(module_name))
+
+
+def check_import_times(budgets=None, repeats=3):
+    '''
+    Check that the entry points can be imported within their import time budget. A module, which exceeds its budget,
+    is measured again up to repeats times and the fastest import counts, as other processes only make an import slower.
+
+    :args:
+        budgets: Dict of module names and maximum import times in seconds. Default: IMPORT_TIME_BUDGETS
+        repeats: Maximum number of measurements of a module
+    :return:
+        violations: List of module names, which exceed their budget or cannot be imported
+    '''
+
+    if budgets is None:
+        budgets = IMPORT_TIME_BUDGETS
+
+    violations = []
+    print("{:<40} {:>10} {:>10}".format("Module", "Import", "Budget"))
+    for module_name, budget in budgets.items():
+        try:
+            import_time = measure_import_time(module_name)
+            for _ in range(repeats - 1):
+                if import_time <= budget:
+                    break
+                import_time = min(import_time, measure_import_time(module_name))
+            print("{:<40} {:>9.2f}s {:>9.2f}s {}".format(module_name, import_time, budget,
+                                                       "" if import_time <= budget else "EXCEEDED"))
+            if import_time > budget:
+                violations.append(module_name)
+        except Exception as e:
+            print("{:<40} {}".format(module_name, e))
+            violations.append(module_name)
+
+    return violations
@@ -0,0 +1,11 @@
+#!/bin/sh
+echo "#===========================================#"
+echo "# Alexander Wendts Machine Learning Toolbox #"
+echo "#===========================================#"
+
+# define config file to use
+config_file="config/debug_timedata_omxs30.ini"
+script_prefix="../.."
+
+# Run all training steps in one python interpreter
+python $script_prefix/toolbox.py run --config_path=$config_file --pipeline training --steps 20-61 -debug
@@ -0,0 +1,2320 @@
+import hashlib
+import json
+import os
+import pickle
+import sqlite3
+import time
+import warnings
+
+import numpy as np
+import pandas as pd
+from joblib import Parallel, cpu_count, delayed, effective_n_jobs
+from scipy.spatial.distance import cdist
+from scipy.stats import rankdata
+from sklearn.base import BaseEstimator, clone
+from sklearn.model_selection import ParameterGrid, ParameterSampler
+from sklearn.exceptions import ConvergenceWarning
+from sklearn.neighbors import NearestNeighbors
+from sklearn.svm import LinearSVC
+from threadpoolctl import threadpool_limits
+
+
+def grid_candidates(param_grid):
+    '''
+    Get all candidates of a parameter grid like GridSearchCV
+
+    :args:
+        param_grid: Dict or list of dicts with parameter names and lists of values
+    :return:
+        candidates: List of parameter dicts
+    '''
+
+    return list(ParameterGrid(param_grid))
+
+
+def random_candidates(param_distributions, n_iter, random_state=None):
+    '''
+    Sample candidates from parameter distributions like RandomizedSearchCV. A fixed random state is necessary to get
+    the same candidates in a restarted run.
+
+    :args:
+        param_distributions: Dict with parameter names and distributions or lists of values
+        n_iter: Number of candidates
+        random_state: Random state of the sampling
+    :return:
+        candidates: List of parameter dicts
+    '''
+
+    return list(ParameterSampler(param_distributions, n_iter, random_state=random_state))
+
+
+def low_discrepancy_candidates(param_distributions, n_iter, random_state=None, method='sobol'):
+    '''
+    Sample candidates from parameter distributions with a scrambled Sobol or Halton sequence instead of independent
+    random values. The points of the sequence in the unit cube are mapped to the parameters with the inverse
+    distribution function, e.g. to log(C) x log(gamma) for reciprocal distributions. The candidates cover the
+    parameter space more evenly than random candidates, i.e. fewer candidates are needed for the same coverage. The
+    sequence is a drop-in for random_candidates.
+
+    :args:
+        param_distributions: Dict with parameter names and distributions with ppf or lists of values
+        n_iter: Number of candidates
+        random_state: Random state of the scrambling. It has to be fixed to get the same candidates in a restarted run
+        method: sobol or halton
+    :return:
+        candidates: List of parameter dicts
+    '''
+
+    # Only imported for the low discrepancy sampling. It needs scipy>=1.7
+    from scipy.stats import qmc
+
+    if n_iter <= 0:
+        return []
+
+    names = sorted(param_distributions.keys())
+    if method == 'sobol':
+        # The balance properties of a Sobol sequence need a power of 2 points. The first n_iter points are used
+        sampler = qmc.Sobol(d=len(names), scramble=True, seed=random_state)
+        points = sampler.random_base2(int(np.ceil(np.log2(n_iter))))[:n_iter]
+    elif method == 'halton':
+        points = qmc.Halton(d=len(names), scramble=True, seed=random_state).random(n_iter)
+    else:
+        raise Exception("Unknown low discrepancy sampling method {}. Use sobol or halton".format(method))
+
+    candidates = [dict() for _ in range(n_iter)]
+    for j, name in enumerate(names):
+        distribution = param_distributions[name]
+        if hasattr(distribution, 'ppf'):
+            values = distribution.ppf(points[:, j])
+        else:
+            values = [distribution[int(u * len(distribution))] for u in np.minimum(points[:, j], 1 - 1e-12)]
+        for candidate, value in zip(candidates, values):
+            candidate[name] = value
+
+    return candidates
+
+
+def get_candidate_coverage(candidates, param_distributions):
+    '''
+    Measure how evenly candidates cover the continuous parameters. The parameters are mapped to the unit cube with the
+    distribution function, e.g. log(C) x log(gamma) for reciprocal distributions.
+
+    :args:
+        candidates: List of parameter dicts
+        param_distributions: Dict with parameter names and distributions or lists of values. Only distributions with
+        cdf are measured
+    :return:
+        coverage: Dict with the centered L2 discrepancy, which is lower for more even candidates, the share of occupied
+        cells of a grid with about one cell per candidate and the smallest distance between two candidates in the unit
+        cube
+    '''
+
+    # Only imported for the low discrepancy sampling. It needs scipy>=1.7
+    from scipy.stats import qmc
+
+    names = sorted(name for name, distribution in param_distributions.items() if hasattr(distribution, 'cdf'))
+    if len(names) == 0 or len(candidates) < 2:
+        return {'discrepancy': np.nan, 'occupied_cells': np.nan, 'min_distance': np.nan}
+
+    points = np.clip(np.array([[param_distributions[name].cdf(params[name]) for name in names]
+                               for params in candidates], dtype=np.float64), 0.0, 1.0)
+    cells_per_axis = max(1, int(np.floor(len(candidates) ** (1.0 / len(names)))))
+    cells = np.minimum((points * cells_per_axis).astype(int), cells_per_axis - 1)
+    n_occupied = len(set(map(tuple, cells)))
+
+    return {'discrepancy': float(qmc.discrepancy(points, method='CD')),
+            'occupied_cells': n_occupied / cells_per_axis ** len(names),
+            'min_distance': float(np.sqrt(cdist(points, points, 'sqeuclidean')[np.triu_indices(len(points), 1)].min()))}
+
+
+def get_candidate_key(params):
+    '''
+    Get a key for a candidate, which is the same in every run of the search
+
+    :args:
+        params: Parameter dict of the candidate
+    :return:
+        key: String of the sorted parameter names and values
+    '''
+
+    return repr(sorted((name, repr(value)) for name, value in params.items()))
+
+
+def get_estimator_key(estimator):
+    '''
+    Get a key of all parameters of an estimator. Sub estimators are represented by their class names and their own
+    parameters, which are also in the deep parameters.
+
+    :args:
+        estimator: Estimator or pipeline
+    :return:
+        key: String of the sorted parameter names and values
+    '''
+
+    items = []
+    for name, value in estimator.get_params(deep=True).items():
+        if name == 'steps':
+            continue
+        if hasattr(value, 'get_params'):
+            items.append((name, value.__class__.__name__))
+        else:
+            items.append((name, repr(value)))
+
+    return repr(sorted(items))
+
+
+def get_data_fingerprint(X, y):
+    '''
+    Get a hash of the data, which is used to recognize a restart on the same data
+
+    :args:
+        X: Features as data frame or array
+        y: Labels as series or array
+    :return:
+        fingerprint: Hex string
+    '''
+
+    h = hashlib.sha1()
+    for data in [X, y]:
+        if isinstance(data, (pd.DataFrame, pd.Series)):
+            h.update(pd.util.hash_pandas_object(data, index=True).values.tobytes())
+            if isinstance(data, pd.DataFrame):
+                h.update(repr(list(data.columns)).encode())
+        else:
+            data = np.ascontiguousarray(data)
+            h.update(repr(data.shape).encode())
+            h.update(data.tobytes())
+
+    return h.hexdigest()
+
+
+def index_rows(data, indices):
+    '''
+    Select rows of a data frame, series or array
+
+    '''
+
+    if hasattr(data, 'iloc'):
+        return data.iloc[indices]
+    return data[indices]
+
+
+def get_stratified_order(y, random_state=0):
+    '''
+    Get an order of the samples, in which each prefix is a stratified random subset. The samples of each class are
+    shuffled and spread evenly over the order. Subsets of growing size are therefore nested and have the same class
+    distribution as the whole data.
+
+    :args:
+        y: Labels
+        random_state: Random state of the shuffle
+    :return:
+        order: Array of sample indices
+    '''
+
+    rng = np.random.RandomState(random_state)
+    y = np.asarray(y)
+    positions = np.empty(y.shape[0])
+    for label in np.unique(y):
+        class_index = rng.permutation(np.flatnonzero(y == label))
+        positions[class_index] = (np.arange(class_index.shape[0]) + 0.5) / class_index.shape[0]
+
+    return np.argsort(positions, kind='stable')
+
+
+class NestedFolds:
+    '''
+    Folds of the stages of an iterated search on nested data subsets. The data of a stage is the prefix of
+    sample_sizes[-1] samples of a stratified order, see get_stratified_order, i.e. the data of a stage is a prefix of
+    the data of the next stage. Each stage adds kfolds[stage] folds of its own prefix, in which the test samples of a
+    fold are every kfolds[stage]-th sample. The folds of the last stage are the folds of all stages up to it, in the
+    order of the stages. The folds of the earlier stages therefore have the same training and test samples in all
+    later stages and candidates, which are carried forward from an earlier stage, only need the folds of the later
+    stages. The small folds of the earlier stages are evaluated first, which lets fold pruning remove bad candidates
+    cheaply.
+
+    '''
+
+    def __init__(self, sample_sizes, kfolds):
+        self.sample_sizes = [int(n) for n in sample_sizes]
+        self.kfolds = [int(k) for k in kfolds]
+
+    def split(self, X=None, y=None, groups=None):
+        for n_samples, n_folds in zip(self.sample_sizes, self.kfolds):
+            positions = np.arange(n_samples)
+            for fold in range(n_folds):
+                yield positions[positions % n_folds != fold], positions[positions % n_folds == fold]
+
+    def get_n_splits(self, X=None, y=None, groups=None):
+        return sum(self.kfolds)
+
+
+class SearchJournal:
+    '''
+    Durable journal of finished (candidate, fold) scores of a search. The journal is a json lines file, to which each
+    finished fit is appended and flushed to disk at once. If a search is restarted after a crash, the finished fits are
+    read from the journal and only the missing fits are executed. Entries of other searches, e.g. on other data, are
+    ignored.
+
+    '''
+
+    def __init__(self, file_path, search_key):
+        self.file_path = file_path
+        self.search_key = search_key
+
+    def load(self):
+        '''
+        Load the finished fits of this search
+
+        :return:
+            records: Dict of (candidate key, fold) and journal records
+        '''
+
+        records = dict()
+        if self.file_path is None or not os.path.isfile(self.file_path):
+            return records
+
+        with open(self.file_path, 'r') as f:
+            lines = f.readlines()
+        for line in lines:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                # The last line can be incomplete, if the process was killed while writing
+                continue
+            if record.get('search') == self.search_key:
+                records[(record['candidate'], record['fold'])] = record
+
+        # Terminate an incomplete last line, so that the next record starts in a new line
+        if len(lines) > 0 and not lines[-1].endswith("\n"):
+            with open(self.file_path, 'a') as f:
+                f.write("\n")
+
+        return records
+
+    def append(self, record):
+        '''
+        Append a record to the journal and write it to disk. It is called from the worker processes. Each record is
+        written with a single write call in append mode, which does not interleave with other workers.
+
+        :args:
+            record: Dict of the finished fit
+        :return:
+            Nothing
+        '''
+
+        if self.file_path is None:
+            return
+
+        line = json.dumps(dict(record, search=self.search_key)) + "\n"
+        with open(self.file_path, 'a') as f:
+            f.write(line)
+            f.flush()
+            os.fsync(f.fileno())
+
+
+class TrialStore:
+    '''
+    Persistent SQLite store of the finished (candidate, fold) scores of all searches across runs. A trial is keyed by
+    the search key, i.e. the data fingerprint, the folds, the estimator and the scorers, by the canonical parameters of
+    the candidate and by the fold. A search loads the stored trials before it fits and only fits the missing trials.
+    Repeated and overlapping searches on the same data and folds therefore only fit new candidates.
+
+    The store is only written from the main process after the fits of a search are finished. The search journal
+    covers crashes during the search.
+
+    '''
+
+    def __init__(self, file_path):
+        self.file_path = file_path
+        with self.connect() as connection:
+            connection.execute("CREATE TABLE IF NOT EXISTS searches (search TEXT PRIMARY KEY, data TEXT, "
+                               "n_samples INTEGER, n_splits INTEGER, estimator TEXT, scorers TEXT, "
+                               "return_train_score INTEGER, created REAL)")
+            connection.execute("CREATE TABLE IF NOT EXISTS trials (search TEXT, candidate TEXT, fold INTEGER, "
+                               "params BLOB, test TEXT, train TEXT, fit_time REAL, score_time REAL, created REAL, "
+                               "PRIMARY KEY (search, candidate, fold))")
+            # Stores of older versions have no sampler time
+            columns = [row[1] for row in connection.execute("PRAGMA table_info(trials)").fetchall()]
+            if 'sample_time' not in columns:
+                connection.execute("ALTER TABLE trials ADD COLUMN sample_time REAL")
+
+    def connect(self):
+        directory = os.path.dirname(self.file_path)
+        if directory != "" and not os.path.isdir(directory):
+            os.makedirs(directory)
+        return sqlite3.connect(self.file_path, timeout=60)
+
+    def load(self, search_key):
+        '''
+        Load the trials of a search
+
+        :args:
+            search_key: Key of the search
+        :return:
+            records: Dict of (canonical candidate key, fold) and records in the format of the search journal
+        '''
+
+        with self.connect() as connection:
+            rows = connection.execute("SELECT candidate, fold, test, train, fit_time, score_time, sample_time "
+                                      "FROM trials WHERE search=?", (search_key,)).fetchall()
+
+        records = dict()
+        for candidate_key, fold, test, train, fit_time, score_time, sample_time in rows:
+            records[(candidate_key, fold)] = {'candidate': candidate_key, 'fold': fold, 'test': json.loads(test),
+                                              'train': json.loads(train), 'fit_time': fit_time,
+                                              'score_time': score_time,
+                                              'sample_time': np.nan if sample_time is None else sample_time}
+
+        return records
+
+    def save(self, search_key, search_info, trials):
+        '''
+        Save the trials of a search. Trials, which are already in the store, are kept.
+
+        :args:
+            search_key: Key of the search
+            search_info: Dict with data, n_samples, n_splits, estimator, scorers and return_train_score of the search
+            trials: List of (canonical candidate key, parameters, record)
+        :return:
+            Nothing
+        '''
+
+        created = time.time()
+        with self.connect() as connection:
+            connection.execute("INSERT OR IGNORE INTO searches VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                               (search_key, search_info['data'], search_info['n_samples'], search_info['n_splits'],
+                                search_info['estimator'], json.dumps(search_info['scorers']),
+                                int(search_info['return_train_score']), created))
+            connection.executemany("INSERT OR IGNORE INTO trials (search, candidate, fold, params, test, train, "
+                                   "fit_time, score_time, created, sample_time) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                                   [(search_key, candidate_key, record['fold'], pickle.dumps(params),
+                                     json.dumps(record['test']), json.dumps(record['train']), record['fit_time'],
+                                     record['score_time'], created, record.get('sample_time'))
+                                    for candidate_key, params, record in trials])
+
+    def get_fit_history(self, max_trials=5000):
+        '''
+        Get the fit times of the latest trials of all searches to learn the cost of candidates
+
+        :args:
+            max_trials: Maximum number of trials
+        :return:
+            history: List of (parameters, number of training samples, fit time in seconds)
+        '''
+
+        with self.connect() as connection:
+            rows = connection.execute("SELECT trials.params, searches.n_samples, searches.n_splits, trials.fit_time "
+                                      "FROM trials JOIN searches ON trials.search=searches.search "
+                                      "ORDER BY trials.created DESC LIMIT ?", (max_trials,)).fetchall()
+
+        return [(pickle.loads(params), n_samples * (n_splits - 1) / n_splits, fit_time)
+                for params, n_samples, n_splits, fit_time in rows]
+
+    def get_searches(self):
+        '''
+        Get all searches in the store with their number of trials
+
+        :return:
+            searches: Data frame with one row per search
+        '''
+
+        with self.connect() as connection:
+            searches = pd.read_sql_query("SELECT searches.*, COUNT(trials.candidate) AS trials FROM searches "
+                                         "LEFT JOIN trials ON searches.search=trials.search "
+                                         "GROUP BY searches.search ORDER BY searches.created", connection)
+
+        return searches
+
+    def get_cv_results(self, search_key):
+        '''
+        Create a cv_results_ dict of all candidates of a search, which have been evaluated on all folds in any run. It
+        can be used in sklearn_utils.generate_result_table instead of a search.
+
+        :args:
+            search_key: Key of the search
+        :return:
+            results: Dict of numpy arrays in the format of GridSearchCV.cv_results_
+        '''
+
+        with self.connect() as connection:
+            search_row = connection.execute("SELECT n_splits, scorers, return_train_score FROM searches "
+                                            "WHERE search=?", (search_key,)).fetchone()
+            if search_row is None:
+                raise Exception("Search {} is not in the trial store {}".format(search_key, self.file_path))
+            n_splits, scorer_names, return_train_score = search_row
+            candidate_rows = connection.execute("SELECT candidate, params FROM trials WHERE search=? "
+                                                "GROUP BY candidate HAVING COUNT(fold)=? ORDER BY MIN(created), "
+                                                "MIN(rowid)", (search_key, n_splits)).fetchall()
+
+        records = self.load(search_key)
+        candidate_keys = [candidate_key for candidate_key, _ in candidate_rows]
+        candidates = [pickle.loads(params) for _, params in candidate_rows]
+
+        return create_cv_results(candidates, candidate_keys, records, n_splits, json.loads(scorer_names),
+                                 bool(return_train_score))
+
+
+def fit_and_score_candidate(estimator, X, y, train, test, params, candidate_key, fold, scorers, return_train_score,
+                            journal, verbose=0):
+    '''
+    Fit a candidate on the training part of a fold, score it on the test part and append the scores to the journal.
+    If the fit fails, all scores are nan like error_score=np.nan in GridSearchCV.
+
+    :args:
+        estimator: Unfitted estimator
+        X: Features
+        y: Labels
+        train: Training indices of the fold
+        test: Test indices of the fold
+        params: Parameters of the candidate
+        candidate_key: Key of the candidate
+        fold: Fold number
+        scorers: Dict of scorer names and scorers
+        return_train_score: If True, the scores on the training part are calculated too
+        journal: SearchJournal
+        verbose: Print each fit if > 1
+    :return:
+        record: Dict with the candidate, fold, test and train scores and the fit and score times
+    '''
+
+    X_train, y_train = index_rows(X, train), index_rows(y, train)
+    X_test, y_test = index_rows(X, test), index_rows(y, test)
+
+    test_scores = dict()
+    train_scores = dict()
+    fit_time = 0.0
+    score_time = 0.0
+    start_time = time.time()
+    try:
+        estimator.set_params(**clone(params, safe=False))
+        estimator.fit(X_train, y_train)
+        fit_time = time.time() - start_time
+
+        start_time = time.time()
+        for name, scorer in scorers.items():
+            test_scores[name] = float(scorer(estimator, X_test, y_test))
+            if return_train_score:
+                train_scores[name] = float(scorer(estimator, X_train, y_train))
+        score_time = time.time() - start_time
+    except Exception as e:
+        fit_time = time.time() - start_time
+        warnings.warn("Fit of candidate {} on fold {} failed. Score is set to nan. Error: {}".format(params, fold, e))
+        test_scores = {name: np.nan for name in scorers.keys()}
+        train_scores = {name: np.nan for name in scorers.keys()} if return_train_score else dict()
+
+    record = {'candidate': candidate_key, 'fold': fold, 'test': test_scores, 'train': train_scores,
+              'fit_time': fit_time, 'score_time': score_time}
+    journal.append(record)
+
+    if verbose > 1:
+        print("[CV {}] {}; {}; total time={:.1f}s".format(fold, params, test_scores, fit_time + score_time))
+
+    return record
+
+
+def get_prefix_length(estimator, prefix_end):
+    '''
+    Get the number of pipeline steps before the step prefix_end. These steps are the prefix, which is fitted once per
+    fold and prefix parameters.
+
+    :args:
+        estimator: Estimator or pipeline
+        prefix_end: Name of the first step after the prefix, e.g. feat. None for no prefix
+    :return:
+        prefix_length: Number of prefix steps. 0 if the estimator is no pipeline or has no step prefix_end
+    '''
+
+    if prefix_end is None or not hasattr(estimator, 'steps'):
+        return 0
+    step_names = [name for name, _ in estimator.steps]
+    if prefix_end not in step_names:
+        return 0
+
+    return step_names.index(prefix_end)
+
+
+def get_prefix_params(params, prefix_step_names):
+    '''
+    Get the parameters of a candidate, which belong to the prefix steps
+
+    '''
+
+    return {name: value for name, value in params.items() if name.split('__')[0] in prefix_step_names}
+
+
+def fit_prefix(prefix_steps, X_train, y_train, X_test):
+    '''
+    Fit the prefix steps of a pipeline on the training part of a fold like the imblearn pipeline does. Samplers only
+    resample the data, on which the following steps are fitted. Transformers are fitted and transform the training
+    and the test data.
+
+    :args:
+        prefix_steps: List of (name, step) of the prefix
+        X_train: Training features
+        y_train: Training labels
+        X_test: Test features
+    :return:
+        X_fit: Transformed and resampled training features to fit the rest of the pipeline
+        y_fit: Resampled training labels
+        X_train_transformed: Transformed training features without resampling to score the training part
+        X_test_transformed: Transformed test features
+        sample_time: Time of the samplers in seconds
+    '''
+
+    return continue_prefix(prefix_steps, X_train, y_train, X_train, X_test)
+
+
+def continue_prefix(prefix_steps, X_fit, y_fit, X_train_transformed, X_test_transformed):
+    '''
+    Fit further prefix steps on the output of the prior prefix steps. See fit_prefix.
+
+    '''
+
+    sample_time = 0.0
+    for name, step in prefix_steps:
+        if step is None or step == 'passthrough':
+            continue
+        if hasattr(step, 'fit_resample'):
+            start_time = time.time()
+            X_fit, y_fit = step.fit_resample(X_fit, y_fit)
+            sample_time += time.time() - start_time
+        else:
+            X_fit = step.fit(X_fit, y_fit).transform(X_fit)
+            X_train_transformed = step.transform(X_train_transformed)
+            X_test_transformed = step.transform(X_test_transformed)
+
+    return X_fit, y_fit, X_train_transformed, X_test_transformed, sample_time
+
+
+# Neighbour indexes of the samplers of a fold, which are shared in a worker. The samplers clone their neighbour
+# objects, therefore the objects only reference their cache by its key.
+NEIGHBOR_CACHES = dict()
+
+# Parameters of the samplers, which define their k nearest neighbours. The neighbour object has one neighbour more
+# than the parameter, as the sample itself is its nearest neighbour.
+SAMPLER_NEIGHBOR_PARAMS = {'SMOTE': 'k_neighbors', 'ADASYN': 'n_neighbors', 'EditedNearestNeighbours': 'n_neighbors'}
+
+
+def get_array_key(X):
+    '''
+    Get a hash of the shape and the values of an array
+
+    '''
+
+    X = np.ascontiguousarray(X)
+    return hashlib.sha1(repr(X.shape).encode() + X.tobytes()).hexdigest()
+
+
+class CachedNearestNeighbors(NearestNeighbors):
+    '''
+    Nearest neighbours, which share the fitted index and the neighbours of each query with all objects of the same
+    cache key in a process. If samplers fit the same data and query the same samples, e.g. SMOTE, SMOTEENN and
+    SMOTETomek on the minority class of a fold, the neighbours are only searched once. Neighbours with fewer
+    neighbours than the cached ones are taken from the cached ones.
+
+    '''
+
+    def __init__(self, n_neighbors=5, cache_key=None, n_jobs=None):
+        super().__init__(n_neighbors=n_neighbors, n_jobs=n_jobs)
+        self.cache_key = cache_key
+
+    def get_cache(self):
+        return NEIGHBOR_CACHES.setdefault(self.cache_key, {'indexes': dict(), 'neighbors': dict(), 'queries': 0,
+                                                           'hits': 0})
+
+    def fit(self, X, y=None):
+        cache = self.get_cache()
+        self.fit_key_ = get_array_key(X)
+        if self.fit_key_ not in cache['indexes']:
+            cache['indexes'][self.fit_key_] = NearestNeighbors(n_jobs=self.n_jobs).fit(X)
+        self.n_samples_fit_ = np.asarray(X).shape[0]
+        self.n_features_in_ = np.asarray(X).shape[1]
+        return self
+
+    def kneighbors(self, X=None, n_neighbors=None, return_distance=True):
+        cache = self.get_cache()
+        index = cache['indexes'][self.fit_key_]
+        n_neighbors = self.n_neighbors if n_neighbors is None else n_neighbors
+        if X is None:
+            return index.kneighbors(None, n_neighbors, return_distance)
+
+        cache['queries'] += 1
+        query_key = (self.fit_key_, get_array_key(X))
+        cached = cache['neighbors'].get(query_key)
+        if cached is not None and cached[1].shape[1] >= n_neighbors:
+            cache['hits'] += 1
+        else:
+            cached = index.kneighbors(X, n_neighbors, return_distance=True)
+            cache['neighbors'][query_key] = cached
+        distances, indices = cached[0][:, :n_neighbors], cached[1][:, :n_neighbors]
+
+        return (distances, indices) if return_distance else indices
+
+
+def share_sampler_neighbors(sampler, cache_key):
+    '''
+    Replace the neighbour parameters of a sampler and its sub samplers by CachedNearestNeighbors with the cache key.
+    Combined samplers get explicit sub samplers with the same settings as their defaults, e.g. SMOTE and
+    EditedNearestNeighbours of SMOTEENN, so that their neighbours can be shared too.
+
+    :args:
+        sampler: Unfitted sampler, which is changed
+        cache_key: Key of the neighbour cache
+    :return:
+        sampler
+    '''
+
+    from imblearn.over_sampling import SMOTE
+    from imblearn.under_sampling import EditedNearestNeighbours
+
+    params = sampler.get_params(deep=False)
+    if 'smote' in params and params['smote'] is None:
+        sampler.set_params(smote=SMOTE(sampling_strategy=sampler.sampling_strategy,
+                                       random_state=sampler.random_state))
+    if 'enn' in params and params['enn'] is None:
+        sampler.set_params(enn=EditedNearestNeighbours(sampling_strategy='all'))
+
+    for name, value in [('', sampler)] + list(sampler.get_params(deep=True).items()):
+        param_name = SAMPLER_NEIGHBOR_PARAMS.get(type(value).__name__)
+        if param_name is not None and isinstance(getattr(value, param_name), int):
+            value.set_params(**{param_name: CachedNearestNeighbors(n_neighbors=getattr(value, param_name) + 1,
+                                                                   cache_key=cache_key)})
+
+    return sampler
+
+
+def get_sampler_index(estimator, candidates, prefix_length):
+    '''
+    Get the index of the first prefix step, which is a sampler in the estimator or in any candidate
+
+    :return:
+        sampler_index: Index of the step. None, if the prefix has no sampler
+    '''
+
+    for index, (name, step) in enumerate(estimator.steps[:prefix_length]):
+        values = [step] + [params[name] for params in candidates if name in params]
+        if any(hasattr(value, 'fit_resample') for value in values):
+            return index
+
+    return None
+
+
+def fit_resampling_group(estimator, prefix_length, sampler_index, X, y, train, test, prefix_groups, fold, scorers,
+                         return_train_score, journal, verbose, precompute_kernel, kernel_memory_mb, liblinear,
+                         cache_key):
+    '''
+    Fit and score the prefix groups of a fold, which have the same steps before the sampler, e.g. the same scaler, but
+    different samplers. The steps before the sampler are fitted once and all samplers share one neighbour cache. The
+    candidates of each prefix group are fitted in this worker on the resampled data of their prefix, see
+    fit_and_score_prefix_group. Only one resampled fold is kept at a time and no resampled data is returned to the
+    parent process.
+
+    :args:
+        estimator: Unfitted pipeline
+        prefix_length: Number of prefix steps
+        sampler_index: Index of the sampler step in the pipeline
+        X: Features
+        y: Labels
+        train: Training indices of the fold
+        test: Test indices of the fold
+        prefix_groups: List of (prefix parameters, list of (parameters, candidate key)) of the prefix groups
+        fold: Fold number
+        scorers: Dict of scorer names and scorers
+        return_train_score: If True, the scores on the training part are calculated too
+        journal: SearchJournal
+        verbose: Print each fit if > 1
+        precompute_kernel: If True, fit all C values of the SVM on a precomputed kernel matrix
+        kernel_memory_mb: Maximum size of the kernel matrices of a fold in MB
+        liblinear: If True, fit linear kernel candidates with liblinear
+        cache_key: Key of the neighbour cache
+    :return:
+        group_results: List of the results of fit_and_score_prefix_group in the order of prefix_groups
+        neighbor_stats: Dict with the number of neighbour queries and the queries, which were taken from the cache
+    '''
+
+    X_train, y_train = index_rows(X, train), index_rows(y, train)
+    X_test = index_rows(X, test)
+
+    start_time = time.time()
+    try:
+        head_estimator = clone(estimator).set_params(**clone(prefix_groups[0][0], safe=False))
+        head_output = fit_prefix(head_estimator.steps[:sampler_index], X_train, y_train, X_test)
+        head_error = None
+    except Exception as e:
+        head_error = e
+    head_time = (time.time() - start_time) / len(prefix_groups)
+
+    group_results = []
+    for prefix_params, group_candidates in prefix_groups:
+        start_time = time.time()
+        try:
+            if head_error is not None:
+                raise head_error
+            prefix_estimator = clone(estimator).set_params(**clone(prefix_params, safe=False))
+            tail_steps = [(name, share_sampler_neighbors(step, cache_key) if hasattr(step, 'fit_resample') else step)
+                          for name, step in prefix_estimator.steps[sampler_index:prefix_length]]
+            X_fit, y_fit, X_train_transformed, X_test_transformed, sample_time = continue_prefix(tail_steps,
+                                                                                                 *head_output[:4])
+            prefix_output = (X_fit, y_fit, X_train_transformed, X_test_transformed,
+                             head_time + time.time() - start_time, head_output[4] + sample_time)
+        except Exception as e:
+            prefix_output = e
+        group_results.append(fit_and_score_prefix_group(estimator, prefix_length, X, y, train, test,
+                                                        group_candidates, fold, scorers, return_train_score, journal,
+                                                        verbose, precompute_kernel, kernel_memory_mb, prefix_output,
+                                                        liblinear))
+
+    cache = NEIGHBOR_CACHES.pop(cache_key, {'queries': 0, 'hits': 0})
+
+    return group_results, {'queries': cache['queries'], 'hits': cache['hits']}
+
+
+# Kernels, which can be precomputed with the same formulas as libsvm
+PRECOMPUTED_KERNELS = ['linear', 'poly', 'rbf', 'sigmoid']
+
+
+def get_kernel_params(svm, X_fit):
+    '''
+    Get the kernel parameters of an SVC like libsvm uses them. gamma='scale' and gamma='auto' are resolved on the data,
+    on which the SVC is fitted.
+
+    :args:
+        svm: SVC with the parameters of the candidate
+        X_fit: Data to fit the SVC
+    :return:
+        kernel_params: Dict with kernel, gamma, degree and coef0
+    '''
+
+    params = svm.get_params()
+    gamma = params['gamma']
+    if gamma == 'scale':
+        X_var = np.asarray(X_fit, dtype=np.float64).var()
+        gamma = 1.0 / (X_fit.shape[1] * X_var) if X_var != 0 else 1.0
+    elif gamma == 'auto':
+        gamma = 1.0 / X_fit.shape[1]
+
+    return {'kernel': params['kernel'], 'gamma': float(gamma), 'degree': params['degree'],
+            'coef0': float(params['coef0'])}
+
+
+def compute_kernel_matrix(X, Y, kernel, gamma, degree, coef0, chunk_mb=64, cross=False):
+    '''
+    Compute the kernel matrix between the rows of X and Y in float64 with the formulas of libsvm. The matrix is
+    computed in blocks of rows, so that the temporary arrays do not use more than chunk_mb. libsvm uses the squared
+    norms and the dot product for the rbf kernel during training, but the sum of squared differences for the
+    prediction. For a cross kernel matrix to predict, the differences are used too.
+
+    :args:
+        X: Array of shape (n_x, n_features)
+        Y: Array of shape (n_y, n_features)
+        kernel: linear, poly, rbf or sigmoid
+        gamma: Kernel coefficient
+        degree: Degree of the poly kernel
+        coef0: Independent term of the poly and sigmoid kernel
+        chunk_mb: Maximum size of the temporary arrays of a block in MB
+        cross: If True, the matrix is used for the prediction of X
+    :return:
+        K: Kernel matrix of shape (n_x, n_y)
+    '''
+
+    X = np.asarray(X, dtype=np.float64)
+    Y = np.asarray(Y, dtype=np.float64)
+    K = np.empty((X.shape[0], Y.shape[0]), dtype=np.float64)
+    block_rows = max(1, int(chunk_mb * 1024 * 1024 / (8 * 2 * max(Y.shape[0], 1))))
+    if kernel == 'rbf':
+        X_square = np.einsum('ij,ij->i', X, X)
+        Y_square = np.einsum('ij,ij->i', Y, Y)
+
+    for start in range(0, X.shape[0], block_rows):
+        end = min(start + block_rows, X.shape[0])
+        dot = np.dot(X[start:end], Y.T)
+        if kernel == 'linear':
+            K[start:end] = dot
+        elif kernel == 'poly':
+            K[start:end] = (gamma * dot + coef0) ** degree
+        elif kernel == 'sigmoid':
+            K[start:end] = np.tanh(gamma * dot + coef0)
+        elif kernel == 'rbf' and cross:
+            K[start:end] = np.exp(-gamma * cdist(X[start:end], Y, 'sqeuclidean'))
+        elif kernel == 'rbf':
+            K[start:end] = np.exp(-gamma * (X_square[start:end, np.newaxis] + Y_square[np.newaxis, :] - 2 * dot))
+        else:
+            raise Exception("Kernel {} cannot be precomputed".format(kernel))
+
+    return K
+
+
+def compute_squared_distances(X, Y, chunk_mb=64, cross=False):
+    '''
+    Compute the squared euclidean distances between the rows of X and Y in float64 with the same formulas as the rbf
+    kernel in compute_kernel_matrix, so that np.exp(-gamma * D) equals the rbf kernel matrix of gamma. The matrix is
+    computed in blocks of rows, so that the temporary arrays do not use more than chunk_mb.
+
+    :args:
+        X: Array of shape (n_x, n_features)
+        Y: Array of shape (n_y, n_features)
+        chunk_mb: Maximum size of the temporary arrays of a block in MB
+        cross: If True, the matrix is used for the prediction of X and the differences are used
+    :return:
+        D: Squared distance matrix of shape (n_x, n_y)
+    '''
+
+    X = np.asarray(X, dtype=np.float64)
+    Y = np.asarray(Y, dtype=np.float64)
+    D = np.empty((X.shape[0], Y.shape[0]), dtype=np.float64)
+    block_rows = max(1, int(chunk_mb * 1024 * 1024 / (8 * 2 * max(Y.shape[0], 1))))
+    X_square = np.einsum('ij,ij->i', X, X)
+    Y_square = np.einsum('ij,ij->i', Y, Y)
+
+    for start in range(0, X.shape[0], block_rows):
+        end = min(start + block_rows, X.shape[0])
+        if cross:
+            D[start:end] = cdist(X[start:end], Y, 'sqeuclidean')
+        else:
+            D[start:end] = X_square[start:end, np.newaxis] + Y_square[np.newaxis, :] - 2 * np.dot(X[start:end], Y.T)
+
+    return D
+
+
+# Parameters of the SVM, which are ignored by a kernel
+KERNEL_IGNORED_PARAMS = {'linear': ['gamma', 'degree', 'coef0'], 'poly': [], 'rbf': ['degree', 'coef0'],
+                         'sigmoid': ['degree']}
+# Kernels, which depend on the order of the features. The random Fourier features of rff_rbf draw one random weight
+# vector per feature, i.e. the same columns in another order give another model
+ORDER_DEPENDENT_KERNELS = ['rff_rbf']
+
+
+def get_svm_prefix(estimator):
+    '''
+    Get the parameter name prefix of the SVM in an estimator, e.g. svm__ for the pipelines of the searches
+
+    :args:
+        estimator: Pipeline with the SVM as last step or an SVM
+    :return:
+        svm_prefix: Parameter name prefix of the SVM
+        svm: SVM of the estimator
+    '''
+
+    if hasattr(estimator, 'steps'):
+        svm_name, svm = estimator.steps[-1]
+        return svm_name + '__', svm
+    return '', estimator
+
+
+def get_canonical_params(params, estimator):
+    '''
+    Normalize the parameters of a candidate, so that candidates, which fit the same model, get the same parameters.
+    Parameters, which are ignored by the kernel of the SVM, e.g. gamma of the linear kernel, are dropped. Feature
+    column lists are replaced by a hash of the column set, so that the same columns under different feature selection
+    names are equal. For the kernels of ORDER_DEPENDENT_KERNELS, the hash is computed from the column list in its
+    order, as the other kernels do not depend on the order of the features.
+
+    :args:
+        params: Parameters of the candidate
+        estimator: Estimator of the search
+    :return:
+        canonical_params: Dict with the normalized parameters
+    '''
+
+    svm_prefix, svm = get_svm_prefix(estimator)
+    canonical_params = dict()
+    if hasattr(svm, 'kernel'):
+        kernel = params.get(svm_prefix + 'kernel', svm.get_params()['kernel'])
+        ignored_names = [svm_prefix + name for name in KERNEL_IGNORED_PARAMS.get(kernel, [])]
+    else:
+        kernel = None
+        ignored_names = []
+
+    for name, value in params.items():
+        if name in ignored_names:
+            continue
+        if name.endswith('__cols') and value is not None:
+            if kernel in ORDER_DEPENDENT_KERNELS:
+                value = 'cols_' + hashlib.sha1(repr(list(value)).encode()).hexdigest()
+            else:
+                value = 'cols_' + hashlib.sha1(repr(sorted(set(value))).encode()).hexdigest()
+        canonical_params[name] = value
+
+    return canonical_params
+
+
+def get_kernel_group_key(params, estimator, share_distances=False):
+    '''
+    Get the key of all parameters of a candidate, which change the kernel matrix, i.e. all canonical parameters except
+    C. Candidates with the same key have the same kernel matrix. If share_distances is True, gamma of the rbf kernel is
+    dropped too, because all rbf kernels are computed from the same squared distances.
+
+    '''
+
+    svm_prefix, svm = get_svm_prefix(estimator)
+    canonical_params = get_canonical_params(params, estimator)
+    canonical_params.pop(svm_prefix + 'C', None)
+    if share_distances and hasattr(svm, 'kernel') and \
+            params.get(svm_prefix + 'kernel', svm.get_params()['kernel']) == 'rbf':
+        canonical_params.pop(svm_prefix + 'gamma', None)
+
+    return get_candidate_key(canonical_params)
+
+
+def score_candidate(estimator, scorers, X_test, y_test, X_train, y_train, return_train_score):
+    '''
+    Score a fitted estimator on the test and optionally the training data
+
+    :return:
+        test_scores: Dict of scorer names and test scores
+        train_scores: Dict of scorer names and training scores
+    '''
+
+    test_scores = dict()
+    train_scores = dict()
+    for name, scorer in scorers.items():
+        test_scores[name] = float(scorer(estimator, X_test, y_test))
+        if return_train_score:
+            train_scores[name] = float(scorer(estimator, X_train, y_train))
+
+    return test_scores, train_scores
+
+
+def fit_and_score_kernel_group(estimator, prefix_length, X_fit, y_fit, X_train, y_train, X_test, y_test,
+                               candidates, scorers, return_train_score, kernel_memory_mb):
+    '''
+    Fit and score candidates, which only differ in C of the SVM, on a precomputed kernel matrix. The steps between
+    the prefix and the SVM, e.g. the column extractor, are fitted once, the kernel matrix of the fit data is computed
+    once and all C values are fitted with kernel='precomputed'. The test and training data are scored with the kernel
+    matrix between them and the fit data.
+
+    rbf candidates may differ in gamma too. As K = exp(-gamma * D) for the squared distances D, the distance matrices
+    are computed once and the kernel matrix of each gamma is formed with one exp in a reused buffer. This needs twice
+    the memory of the kernel matrices.
+
+    :args:
+        estimator: Unfitted pipeline
+        prefix_length: Number of prefix steps
+        X_fit: Transformed and resampled training features of the fold
+        y_fit: Resampled training labels
+        X_train: Transformed training features without resampling
+        y_train: Training labels
+        X_test: Transformed test features
+        y_test: Test labels
+        candidates: List of (parameters, candidate key) with the same kernel matrix or, for rbf, the same distances
+        scorers: Dict of scorer names and scorers
+        return_train_score: If True, the scores on the training part are calculated too
+        kernel_memory_mb: Maximum size of the kernel and distance matrices in MB
+    :return:
+        results: List of (test scores, train scores, fit time, score time) in the order of the candidates or None, if
+        the kernel cannot be precomputed
+    '''
+
+    start_time = time.time()
+    tail = clone(estimator).set_params(**clone(candidates[0][0], safe=False))[prefix_length:]
+    svm_name, svm = tail.steps[-1]
+    if not hasattr(svm, 'kernel') or svm.get_params()['kernel'] not in PRECOMPUTED_KERNELS:
+        return None
+
+    for name, step in tail.steps[:-1]:
+        if step is None or step == 'passthrough':
+            continue
+        X_fit = step.fit(X_fit, y_fit).transform(X_fit)
+        X_train = step.transform(X_train)
+        X_test = step.transform(X_test)
+
+    # Candidates with the same resolved kernel parameters, e.g. gamma='scale' and its value, share a kernel matrix
+    kernel_groups = dict()
+    for k, (params, candidate_key) in enumerate(candidates):
+        candidate_svm = clone(svm).set_params(**{name[len(svm_name) + 2:]: value for name, value in params.items()
+                                                 if name.startswith(svm_name + '__')})
+        kernel_params = get_kernel_params(candidate_svm, X_fit)
+        kernel_groups.setdefault(tuple(sorted(kernel_params.items())), []).append(k)
+    share_distances = svm.get_params()['kernel'] == 'rbf' and len(kernel_groups) > 1
+
+    n_train_rows = 0 if not return_train_score else X_train.shape[0]
+    n_matrices = 2 if share_distances else 1
+    if n_matrices * 8 * X_fit.shape[0] * (X_fit.shape[0] + X_test.shape[0] + n_train_rows) > \
+            kernel_memory_mb * 1024 * 1024:
+        return None
+
+    chunk_mb = max(1, kernel_memory_mb // 16)
+    if share_distances:
+        D_fit = compute_squared_distances(X_fit, X_fit, chunk_mb=chunk_mb)
+        D_test = compute_squared_distances(X_test, X_fit, chunk_mb=chunk_mb, cross=True)
+        D_train = None if not return_train_score else compute_squared_distances(X_train, X_fit, chunk_mb=chunk_mb,
+                                                                                cross=True)
+        K_fit, K_test = np.empty_like(D_fit), np.empty_like(D_test)
+        K_train = None if D_train is None else np.empty_like(D_train)
+    kernel_time = time.time() - start_time
+
+    results = [None] * len(candidates)
+    for kernel_key, indices in kernel_groups.items():
+        start_time = time.time()
+        kernel_params = dict(kernel_key)
+        if share_distances:
+            np.exp(np.multiply(D_fit, -kernel_params['gamma'], out=K_fit), out=K_fit)
+            np.exp(np.multiply(D_test, -kernel_params['gamma'], out=K_test), out=K_test)
+            if D_train is not None:
+                np.exp(np.multiply(D_train, -kernel_params['gamma'], out=K_train), out=K_train)
+        else:
+            K_fit = compute_kernel_matrix(X_fit, X_fit, chunk_mb=chunk_mb, **kernel_params)
+            K_test = compute_kernel_matrix(X_test, X_fit, chunk_mb=chunk_mb, cross=True, **kernel_params)
+            if not return_train_score:
+                K_train = None
+            elif kernel_params['kernel'] != 'rbf' and X_train.shape == X_fit.shape and \
+                    np.array_equal(X_train, X_fit):
+                # Without a sampler, the training data is the fit data. Only rbf uses another formula for the
+                # prediction
+                K_train = K_fit
+            else:
+                K_train = compute_kernel_matrix(X_train, X_fit, chunk_mb=chunk_mb, cross=True, **kernel_params)
+        group_kernel_time = kernel_time / len(candidates) + (time.time() - start_time) / len(indices)
+
+        for k in indices:
+            params, candidate_key = candidates[k]
+            start_time = time.time()
+            precomputed_svm = clone(svm).set_params(C=params.get(svm_name + '__C', svm.C), kernel='precomputed')
+            precomputed_svm.fit(K_fit, y_fit)
+            fit_time = group_kernel_time + time.time() - start_time
+
+            start_time = time.time()
+            test_scores, train_scores = score_candidate(precomputed_svm, scorers, K_test, y_test, K_train, y_train,
+                                                        return_train_score)
+            results[k] = (test_scores, train_scores, fit_time, time.time() - start_time)
+
+    return results
+
+
+def fit_and_score_liblinear(estimator, prefix_length, X_fit, y_fit, X_train, y_train, X_test, y_test, candidates,
+                            scorers, return_train_score, check_libsvm=True, intercept_scaling=10.0, max_iter=10000):
+    '''
+    Fit and score linear kernel candidates, which only differ in C of the SVM, with liblinear instead of libsvm. The
+    steps between the prefix and the SVM are fitted once and each C is fitted with LinearSVC and the hinge loss, which
+    solves the same problem as SVC with the linear kernel except for the regularization of the intercept. A large
+    intercept_scaling makes this regularization small. liblinear scales linearly with the samples, while libsvm scales
+    at least quadratically, in particular for large C. LinearSVC cannot be warm started, i.e. each C is a separate fit.
+
+    Only binary targets are fitted, as LinearSVC uses one-vs-rest for multiple classes and SVC one-vs-one. If
+    check_libsvm is True, the candidate with the smallest C, which is the fastest libsvm fit, is fitted with libsvm too
+    and the agreement of its test predictions and the difference of its scores are returned to check the liblinear
+    results.
+
+    :args:
+        estimator: Unfitted pipeline
+        prefix_length: Number of prefix steps
+        X_fit: Transformed and resampled training features of the fold
+        y_fit: Resampled training labels
+        X_train: Transformed training features without resampling
+        y_train: Training labels
+        X_test: Transformed test features
+        y_test: Test labels
+        candidates: List of (parameters, candidate key) with the linear kernel and the same kernel group
+        scorers: Dict of scorer names and scorers
+        return_train_score: If True, the scores on the training part are calculated too
+        check_libsvm: If True, the candidate with the smallest C is compared with libsvm
+        intercept_scaling: Intercept scaling of LinearSVC
+        max_iter: Maximum number of iterations of liblinear
+    :return:
+        results: List of (test scores, train scores, fit time, score time) in the order of the candidates or None, if
+        the SVM has no linear kernel, uses parameters, which LinearSVC does not support, or the target is not binary
+        check: Dict with the checked C, the share of equal test predictions, the maximum absolute difference of the
+        test scores to libsvm and the number of fits, which did not converge. None without check
+    '''
+
+    start_time = time.time()
+    tail = clone(estimator).set_params(**clone(candidates[0][0], safe=False))[prefix_length:]
+    svm_name, svm = tail.steps[-1]
+    if not hasattr(svm, 'kernel') or svm.get_params()['kernel'] != 'linear' or \
+            svm.get_params().get('probability') is True or len(np.unique(y_fit)) != 2:
+        return None, None
+
+    for name, step in tail.steps[:-1]:
+        if step is None or step == 'passthrough':
+            continue
+        X_fit = step.fit(X_fit, y_fit).transform(X_fit)
+        X_train = step.transform(X_train)
+        X_test = step.transform(X_test)
+    transform_time = time.time() - start_time
+
+    C_values = [params.get(svm_name + '__C', svm.C) for params, _ in candidates]
+    check_index = int(np.argmin(C_values))
+    results = [None] * len(candidates)
+    n_not_converged = 0
+    for k, C in enumerate(C_values):
+        start_time = time.time()
+        linear_svm = LinearSVC(C=C, loss='hinge', dual=True, intercept_scaling=intercept_scaling,
+                               class_weight=svm.class_weight, tol=svm.tol, max_iter=max_iter)
+        with warnings.catch_warnings(record=True) as caught_warnings:
+            warnings.simplefilter('always', ConvergenceWarning)
+            linear_svm.fit(X_fit, y_fit)
+        n_not_converged += int(any(issubclass(w.category, ConvergenceWarning) for w in caught_warnings))
+        fit_time = transform_time / len(candidates) + time.time() - start_time
+
+        start_time = time.time()
+        test_scores, train_scores = score_candidate(linear_svm, scorers, X_test, y_test, X_train, y_train,
+                                                    return_train_score)
+        results[k] = (test_scores, train_scores, fit_time, time.time() - start_time)
+        if k == check_index:
+            check_predictions = linear_svm.predict(X_test)
+
+    if not check_libsvm:
+        return results, None
+
+    # Compare the candidate with the smallest C with libsvm
+    libsvm = clone(svm).set_params(C=C_values[check_index]).fit(X_fit, y_fit)
+    libsvm_scores, _ = score_candidate(libsvm, scorers, X_test, y_test, X_train, y_train, False)
+    check = {'C': C_values[check_index],
+             'prediction_agreement': float(np.mean(libsvm.predict(X_test) == check_predictions)),
+             'max_score_difference': float(np.nanmax([abs(libsvm_scores[name] - results[check_index][0][name])
+                                                      for name in scorers.keys()])),
+             'not_converged': n_not_converged}
+
+    return results, check
+
+
+def fit_and_score_prefix_group(estimator, prefix_length, X, y, train, test, candidates, fold, scorers,
+                               return_train_score, journal, verbose=0, precompute_kernel=False,
+                               kernel_memory_mb=1024, prefix_output=None, liblinear=False):
+    '''
+    Fit and score all candidates of a fold, which have the same prefix parameters. The prefix steps, e.g. imputer,
+    scaler and sampler, are fitted only once and the transformed data is used to fit the rest of the pipeline of each
+    candidate. Each finished candidate is appended to the journal.
+
+    If precompute_kernel is True, the candidates, which only differ in C of the SVM, are fitted on one precomputed
+    kernel matrix. rbf candidates, which differ in gamma too, are fitted on kernel matrices from one squared distance
+    matrix. If the kernel cannot be precomputed or the matrices need more than kernel_memory_mb, the candidates
+    are fitted normally.
+
+    If liblinear is True, the linear kernel candidates, which only differ in C, are fitted with liblinear, see
+    fit_and_score_liblinear.
+
+    If the prefix has been fitted before in fit_resampling_group of the same worker, its output is used and the prefix
+    is not fitted.
+
+    :args:
+        estimator: Unfitted pipeline
+        prefix_length: Number of prefix steps
+        X: Features
+        y: Labels
+        train: Training indices of the fold
+        test: Test indices of the fold
+        candidates: List of (parameters, candidate key) with the same prefix parameters
+        fold: Fold number
+        scorers: Dict of scorer names and scorers
+        return_train_score: If True, the scores on the training part are calculated too
+        journal: SearchJournal
+        verbose: Print each fit if > 1
+        precompute_kernel: If True, fit all C values of the SVM on a precomputed kernel matrix
+        kernel_memory_mb: Maximum size of the kernel matrices of a fold in MB
+        prefix_output: (X_fit, y_fit, X_train_transformed, X_test_transformed, prefix_time, sample_time) of the prefix,
+        which was fitted in fit_resampling_group, or its exception. None to fit the prefix
+        liblinear: If True, fit linear kernel candidates with liblinear
+    :return:
+        records: List of dicts with the candidate, fold, test and train scores, the fit and score times and the
+        sampler time, which is part of the fit time
+        prefix_time: Time to fit the prefix in seconds
+        liblinear_checks: List of the libsvm checks of the liblinear fits
+    '''
+
+    X_train, y_train = index_rows(X, train), index_rows(y, train)
+    X_test, y_test = index_rows(X, test), index_rows(y, test)
+
+    # The prefix parameters are the same for all candidates of the group
+    start_time = time.time()
+    sample_time = 0.0
+    try:
+        if isinstance(prefix_output, Exception):
+            raise prefix_output
+        if prefix_output is not None:
+            X_fit, y_fit, X_train_transformed, X_test_transformed, prefix_time, sample_time = prefix_output
+        else:
+            prefix_estimator = clone(estimator).set_params(**clone(candidates[0][0], safe=False))
+            X_fit, y_fit, X_train_transformed, X_test_transformed, sample_time = fit_prefix(
+                prefix_estimator.steps[:prefix_length], X_train, y_train, X_test)
+        prefix_error = None
+    except Exception as e:
+        prefix_error = e
+    if prefix_output is None or prefix_error is not None:
+        prefix_time = time.time() - start_time
+
+    # Candidates, which only differ in C, share one kernel matrix or one liblinear check. rbf candidates, which only
+    # differ in C and gamma, share the squared distances
+    if precompute_kernel or liblinear:
+        kernel_groups = dict()
+        for params, candidate_key in candidates:
+            kernel_groups.setdefault(get_kernel_group_key(params, estimator, share_distances=precompute_kernel),
+                                     []).append((params, candidate_key))
+        kernel_groups = list(kernel_groups.values())
+    else:
+        kernel_groups = [[candidate] for candidate in candidates]
+
+    records = []
+    liblinear_checks = []
+    for kernel_group in kernel_groups:
+        group_results = None
+        if prefix_error is None and liblinear:
+            try:
+                # libsvm is only fitted for the check on the first fold
+                group_results, liblinear_check = fit_and_score_liblinear(estimator, prefix_length, X_fit, y_fit,
+                                                                         X_train_transformed, y_train,
+                                                                         X_test_transformed, y_test, kernel_group,
+                                                                         scorers, return_train_score,
+                                                                         check_libsvm=fold == 0)
+                if liblinear_check is not None:
+                    liblinear_checks.append(liblinear_check)
+            except Exception as e:
+                warnings.warn("liblinear failed. Fit the candidates normally. Error: {}".format(e))
+        if group_results is None and prefix_error is None and precompute_kernel and len(kernel_group) > 1:
+            try:
+                group_results = fit_and_score_kernel_group(estimator, prefix_length, X_fit, y_fit,
+                                                           X_train_transformed, y_train, X_test_transformed, y_test,
+                                                           kernel_group, scorers, return_train_score,
+                                                           kernel_memory_mb)
+            except Exception as e:
+                warnings.warn("Precomputed kernel failed. Fit the candidates normally. Error: {}".format(e))
+
+        for k, (params, candidate_key) in enumerate(kernel_group):
+            fit_time = prefix_time / len(candidates)
+            score_time = 0.0
+            if group_results is not None:
+                test_scores, train_scores, kernel_fit_time, score_time = group_results[k]
+                fit_time += kernel_fit_time
+            else:
+                start_time = time.time()
+                try:
+                    if prefix_error is not None:
+                        raise prefix_error
+                    tail = clone(estimator).set_params(**clone(params, safe=False))[prefix_length:]
+                    tail.fit(X_fit, y_fit)
+                    fit_time += time.time() - start_time
+
+                    start_time = time.time()
+                    test_scores, train_scores = score_candidate(tail, scorers, X_test_transformed, y_test,
+                                                                X_train_transformed, y_train, return_train_score)
+                    score_time = time.time() - start_time
+                except Exception as e:
+                    warnings.warn("Fit of candidate {} on fold {} failed. Score is set to nan. Error: {}".format(
+                        params, fold, e))
+                    test_scores = {name: np.nan for name in scorers.keys()}
+                    train_scores = {name: np.nan for name in scorers.keys()} if return_train_score else dict()
+
+            record = {'candidate': candidate_key, 'fold': fold, 'test': test_scores, 'train': train_scores,
+                      'fit_time': fit_time, 'score_time': score_time, 'sample_time': sample_time / len(candidates)}
+            journal.append(record)
+            records.append(record)
+
+            if verbose > 1:
+                print("[CV {}] {}; {}; total time={:.1f}s".format(fold, params, test_scores, fit_time + score_time))
+
+    return records, prefix_time, liblinear_checks
+
+
+def create_cv_results(candidates, candidate_keys, records, n_splits, scorer_names, return_train_score, pruned=None):
+    '''
+    Create the cv_results_ dict in the same format as GridSearchCV from journal or trial store records. Pruned
+    candidates only have records of some folds. Their missing fold scores are nan, their mean scores are the means of
+    the evaluated folds and they get the worst ranks.
+
+    :args:
+        candidates: List of parameter dicts
+        candidate_keys: Keys of the candidates in candidate order
+        records: Dict of (candidate key, fold) and records
+        n_splits: Number of folds
+        scorer_names: Names of the scorers
+        return_train_score: If True, the training scores are added
+        pruned: List of booleans, which are True for pruned candidates. None for no pruned candidates
+    :return:
+        results: Dict of numpy arrays
+    '''
+
+    n_candidates = len(candidates)
+    pruned = np.zeros(n_candidates, dtype=bool) if pruned is None else np.asarray(pruned, dtype=bool)
+    evaluated = np.array([[(key, fold) in records for fold in range(n_splits)]
+                          for key in candidate_keys]).reshape(n_candidates, n_splits)
+    n_evaluated = np.maximum(np.sum(evaluated, axis=1), 1)
+
+    def get_values(value_function):
+        return np.array([[value_function(records[(key, fold)]) if (key, fold) in records else np.nan
+                          for fold in range(n_splits)] for key in candidate_keys],
+                        dtype=float).reshape(n_candidates, n_splits)
+
+    def get_mean_std(values):
+        # Mean and standard deviation of the evaluated folds. A failed fit with a nan score gives a nan mean
+        mean = np.sum(np.where(evaluated, values, 0), axis=1) / n_evaluated
+        std = np.sqrt(np.sum(np.where(evaluated, values - mean[:, np.newaxis], 0) ** 2, axis=1) / n_evaluated)
+        return mean, std
+
+    results = dict()
+    for time_name in ['fit_time', 'score_time']:
+        results['mean_' + time_name], results['std_' + time_name] = get_mean_std(
+            get_values(lambda record: record[time_name]))
+    # The sampler time is part of the fit time. It is nan for records without sampler time
+    results['mean_sample_time'], results['std_sample_time'] = get_mean_std(
+        get_values(lambda record: record.get('sample_time', np.nan)))
+
+    # Parameters, which are not used by a candidate are masked like in GridSearchCV
+    param_names = sorted(set(name for params in candidates for name in params.keys()))
+    for name in param_names:
+        results['param_' + name] = np.ma.MaskedArray(np.empty(n_candidates), mask=True, dtype=object)
+    for i, params in enumerate(candidates):
+        for name, value in params.items():
+            results['param_' + name][i] = value
+    results['params'] = list(candidates)
+
+    score_sets = ['test', 'train'] if return_train_score else ['test']
+    for score_set in score_sets:
+        for name in scorer_names:
+            scores = get_values(lambda record: record[score_set][name])
+            for fold in range(n_splits):
+                results['split{}_{}_{}'.format(fold, score_set, name)] = scores[:, fold]
+            results['mean_{}_{}'.format(score_set, name)], results['std_{}_{}'.format(score_set, name)] = \
+                get_mean_std(scores)
+            if score_set == 'test':
+                # Failed candidates with nan scores and pruned candidates get the worst ranks
+                means = results['mean_test_' + name]
+                means = np.where(np.isnan(means), -np.inf, means)
+                means = np.where(pruned, means - np.inf, means)
+                results['rank_test_' + name] = np.asarray(rankdata(-means, method='min'), dtype=np.int32)
+    results['pruned'] = pruned
+
+    return results
+
+
+# Kernels of SVC and sklearn_utils.ApproximateKernelSVC, which are features of the FitCostModel
+COST_MODEL_KERNELS = ['linear', 'poly', 'rbf', 'sigmoid', 'nystroem_rbf', 'rff_rbf']
+
+
+class FitCostModel:
+    '''
+    Model of the fit time of a candidate from the kernel, the sampler, C, gamma, the number of samples and the number
+    of features. The log fit time is a linear function of the logs of these values, the kernel, the log samples of each
+    kernel and the sampler, which is learned from the fit times of finished trials or of the measurements of step42.
+    Without enough trials, the cost is the rough SVM complexity n_samples^2 * n_features * (1 + log10(C)) for C > 1,
+    of which only the order is used. A learned model estimates seconds and is saved for the forecasts of the training
+    time in forecast_utils.
+
+    '''
+
+    def __init__(self, estimator, min_trials=20, regularization=1e-3):
+        self.estimator = estimator
+        self.min_trials = min_trials
+        self.regularization = regularization
+        self.coef_ = None
+        self.samplers_ = []
+
+    def get_sampler_name(self, params):
+        '''
+        Get the class name of the sampler of a candidate. A candidate without a sampler has the Nosampler.
+
+        '''
+
+        sampler = params.get('sampling', dict(getattr(self.estimator, 'steps', [])).get('sampling'))
+
+        return 'Nosampler' if sampler is None else type(sampler).__name__
+
+    def get_features(self, params, n_samples, n_features):
+        '''
+        Get the feature vector of a candidate: constant, log samples, log features, log C, log gamma, the kernel, the
+        log samples of the kernel and the sampler
+
+        '''
+
+        svm_prefix, svm = get_svm_prefix(self.estimator)
+        # The svm step itself may be a parameter, e.g. for the approximated kernels
+        if svm_prefix != '':
+            svm = params.get(svm_prefix[:-2], svm)
+        svm_params = svm.get_params()
+        for name, value in params.items():
+            if name.endswith('__cols') and value is not None:
+                n_features = len(value)
+        C = params.get(svm_prefix + 'C', svm_params.get('C', 1.0))
+        gamma = params.get(svm_prefix + 'gamma', svm_params.get('gamma', 'scale'))
+        if isinstance(gamma, str):
+            gamma = 1 / max(n_features, 1)
+        kernel = params.get(svm_prefix + 'kernel', svm_params.get('kernel', 'rbf'))
+        sampler = self.get_sampler_name(params)
+        log_samples = np.log(max(n_samples, 1))
+
+        return np.array([1.0, log_samples, np.log(max(n_features, 1)), np.log(C), np.log(gamma)] +
+                        [float(kernel == name) for name in COST_MODEL_KERNELS] +
+                        [float(kernel == name) * log_samples for name in COST_MODEL_KERNELS] +
+                        [float(sampler == name) for name in self.samplers_])
+
+    def fit(self, history, n_features):
+        '''
+        Learn the cost model from the fit times of finished trials
+
+        :args:
+            history: List of (parameters, number of training samples, fit time in seconds)
+            n_features: Number of features of candidates without feature columns
+        :return:
+            self
+        '''
+
+        history = [(params, n_samples, fit_time) for params, n_samples, fit_time in history
+                   if fit_time is not None and np.isfinite(fit_time) and fit_time > 0]
+        if len(history) < self.min_trials:
+            self.coef_ = None
+            return self
+
+        # The Nosampler is the reference of the other samplers
+        self.samplers_ = sorted(set(self.get_sampler_name(params) for params, _, _ in history) - {'Nosampler'})
+        features = np.array([self.get_features(params, n_samples, n_features) for params, n_samples, _ in history])
+        log_times = np.log([fit_time for _, _, fit_time in history])
+        # Ridge regression, as some features, e.g. the kernels, may be constant in the history
+        self.coef_ = np.linalg.solve(features.T @ features + self.regularization * np.eye(features.shape[1]),
+                                     features.T @ log_times)
+
+        return self
+
+    def predict(self, params, n_samples, n_features):
+        '''
+        Estimate the fit time of a candidate. Without a learned model, the result is a relative cost.
+
+        '''
+
+        features = self.get_features(params, n_samples, n_features)
+        if self.coef_ is not None:
+            return float(np.exp(features @ self.coef_))
+        n_samples, n_features, C = np.exp(features[1:4])
+
+        return n_samples ** 2 * n_features * (1 + max(0.0, np.log10(C)))
+
+    def save(self, path):
+        '''
+        Save the learned coefficients and samplers as json
+
+        '''
+
+        if self.coef_ is None:
+            raise Exception("The cost model has not enough trials to learn the fit times. It cannot be saved")
+        # The file is replaced at once, as a search in another process may load it
+        with open(path + ".tmp", 'w') as f:
+            json.dump({'kernels': COST_MODEL_KERNELS, 'samplers': self.samplers_,
+                       'coef': [float(c) for c in self.coef_], 'min_trials': self.min_trials,
+                       'regularization': self.regularization}, f, indent=2)
+        os.replace(path + ".tmp", path)
+        print("Saved fit cost model to ", path)
+
+
+def load_fit_cost_model(path, estimator):
+    '''
+    Load the coefficients of a FitCostModel of FitCostModel.save
+
+    :args:
+        path: Path of the cost model
+        estimator: Estimator of the candidates, which are estimated
+    :return:
+        cost_model: FitCostModel
+    '''
+
+    with open(path, 'r') as f:
+        model_dict = json.load(f)
+    if model_dict['kernels'] != COST_MODEL_KERNELS:
+        raise Exception("The cost model {} was saved with the kernels {}. Measure it again".format(
+            path, model_dict['kernels']))
+    cost_model = FitCostModel(estimator, min_trials=model_dict['min_trials'],
+                              regularization=model_dict['regularization'])
+    cost_model.samplers_ = model_dict['samplers']
+    cost_model.coef_ = np.array(model_dict['coef'])
+
+    return cost_model
+
+
+def run_with_thread_limit(function, blas_threads, *args):
+    '''
+    Run a function in a worker with at most blas_threads threads of BLAS and OpenMP. The start and end time of the
+    task are returned with the result.
+
+    '''
+
+    start_time = time.time()
+    with threadpool_limits(limits=blas_threads):
+        result = function(*args)
+
+    return result, start_time, time.time()
+
+
+def run_ordered_parallel(function, task_args, costs, n_jobs, verbose=0, blas_threads=None):
+    '''
+    Run a function for all task arguments in parallel. The tasks are dispatched in the order of their estimated costs,
+    longest first, so that no long task starts at the end, when most workers are idle. Each worker uses at most
+    blas_threads BLAS threads, by default the cores divided by the workers, so that the workers do not oversubscribe
+    the cores. The total wall time, the utilization of the workers and the tail, i.e. the time from the first idle
+    worker without remaining tasks to the end, are printed.
+
+    :args:
+        function: Function of a task
+        task_args: List of argument tuples of the tasks
+        costs: List of estimated costs of the tasks
+        n_jobs: Number of workers as for joblib
+        verbose: Verbosity of joblib
+        blas_threads: Number of BLAS threads per worker. None for the cores divided by the workers
+    :return:
+        results: List of the results in the order of task_args
+    '''
+
+    if len(task_args) == 0:
+        return []
+
+    # Cores of the process, which respects the limit of a pipeline stage (see pipeline_utils.limit_stage_cpus)
+    n_cores = cpu_count()
+    # As in joblib, None is one worker unless a parallel backend context sets it and -2 are all cores but one
+    n_workers = min(len(task_args), effective_n_jobs(n_jobs))
+    if blas_threads is None:
+        blas_threads = max(1, n_cores // n_workers)
+    order = np.argsort(-np.asarray(costs, dtype=float), kind='stable')
+
+    start_time = time.time()
+    ordered_results = Parallel(n_jobs=n_jobs, verbose=verbose)(
+        delayed(run_with_thread_limit)(function, blas_threads, *task_args[i]) for i in order)
+    wall_time = time.time() - start_time
+
+    results = [None] * len(task_args)
+    for i, (result, _, _) in zip(order, ordered_results):
+        results[i] = result
+    task_starts = np.array([task_start for _, task_start, _ in ordered_results])
+    task_ends = np.array([task_end for _, _, task_end in ordered_results])
+    # After the start of the last task, no tasks remain and each finishing worker is idle
+    tail_time = np.max(task_ends) - np.min(task_ends[task_ends >= np.max(task_starts)])
+    print("Executed {} tasks on {} workers with {} BLAS threads each{}. Wall time {:.1f}s, worker utilization "
+          "{:.1f}%, tail {:.1f}s".format(
+        len(task_args), n_workers, blas_threads, ", longest estimated first" if len(set(costs)) > 1 else "", wall_time,
+        100 * np.sum(task_ends - task_starts) / max(wall_time * n_workers, 1e-9), tail_time))
+
+    return results
+
+
+class JournaledSearchCV(BaseEstimator):
+    '''
+    Cross validated search over an explicit list of candidates, which can be resumed after a crash. The interface and
+    the results are the same as for GridSearchCV and RandomizedSearchCV, i.e. cv_results_, best_params_, best_score_,
+    best_estimator_, score and predict. Each finished (candidate, fold) is appended to a journal file. A restarted
+    search with the same data, folds, estimator and candidates only executes the missing fits.
+
+    If the estimator is a pipeline with the step prefix_end, the steps before it are a prefix, e.g. imputer, scaler
+    and sampler. The prefix is fitted only once for all candidates with the same prefix parameters in a fold.
+
+    If precompute_kernel is True, candidates of a prefix group, which only differ in C of the SVM, are fitted on one
+    precomputed kernel matrix of at most kernel_memory_mb per fold. The scores are the same as without it.
+
+    If refit_best is False, the best candidate is not fitted on the whole data and best_estimator_ is not available.
+    It is used for intermediate searches, which only rank the candidates.
+
+    If canonicalize is True, candidates, which are the same after get_canonical_params, e.g. the linear kernel with
+    different gamma values, are fitted only once and all of them get the same scores in cv_results_.
+
+    If trial_store_path is set, the trials of earlier runs are loaded from the TrialStore and the new trials are saved
+    to it. The key of the search in the store is search_key_.
+
+    If carried_records is set, the records of candidates of an earlier search on the same folds are used like the
+    records of the journal, i.e. these candidates are only fitted on the folds, which they do not have yet. It is used
+    for the stages of NestedFolds.
+
+    If prune_top_k is set, the folds are evaluated one after the other and candidates, which cannot reach the top
+    prune_top_k candidates, are pruned, see get_pruned_candidates. Their scores are the means of the evaluated folds
+    and they are marked in the column pruned of cv_results_.
+
+    The fits are dispatched longest first by the costs of a FitCostModel, which is learned from the fit times in the
+    journal and the trial store, and each worker uses at most blas_threads BLAS threads, see run_ordered_parallel.
+
+    If share_resampling is True and the prefix contains a sampler, all prefixes of a fold with the same steps before
+    the sampler are fitted together in one worker, see fit_resampling_group. The samplers share their neighbour
+    searches and the resampled data is used by all candidates with the same prefix in the same worker. The sampler
+    time is in mean_sample_time.
+
+    If liblinear is True and the target is binary, the linear kernel candidates are fitted with liblinear instead of
+    libsvm, see fit_and_score_liblinear. The agreement with libsvm is in liblinear_checks_.
+
+    '''
+
+    def __init__(self, estimator, candidates, scoring, refit, cv, n_jobs=-1, verbose=0, return_train_score=True,
+                 journal_path=None, prefix_end='feat', refit_best=True, precompute_kernel=False,
+                 kernel_memory_mb=1024, canonicalize=True, trial_store_path=None, prune_top_k=None, prune_z=2.0,
+                 order_by_cost=True, blas_threads=None, share_resampling=True, liblinear=False,
+                 carried_records=None):
+        self.estimator = estimator
+        self.candidates = candidates
+        self.scoring = scoring
+        self.refit = refit
+        self.cv = cv
+        self.n_jobs = n_jobs
+        self.verbose = verbose
+        self.return_train_score = return_train_score
+        self.journal_path = journal_path
+        self.prefix_end = prefix_end
+        self.refit_best = refit_best
+        self.precompute_kernel = precompute_kernel
+        self.kernel_memory_mb = kernel_memory_mb
+        self.canonicalize = canonicalize
+        self.trial_store_path = trial_store_path
+        self.prune_top_k = prune_top_k
+        self.prune_z = prune_z
+        self.order_by_cost = order_by_cost
+        self.blas_threads = blas_threads
+        self.share_resampling = share_resampling
+        self.liblinear = liblinear
+        self.carried_records = carried_records
+
+    def get_search_key(self, X, y, splits):
+        '''
+        Get the key of a search. It changes, if the data, the folds, the estimator or the scorers change. Searches with
+        liblinear have their own key, as the liblinear scores differ slightly from libsvm. For targets, which are not
+        binary, liblinear is not used and the key is the one of libsvm.
+
+        '''
+
+        h = hashlib.sha1()
+        h.update(get_data_fingerprint(X, y).encode())
+        for train, test in splits:
+            h.update(np.asarray(test).tobytes())
+        h.update(get_estimator_key(self.estimator).encode())
+        h.update(repr(sorted(self.scoring.keys())).encode())
+        h.update(repr(self.return_train_score).encode())
+        if self.liblinear and len(np.unique(y)) == 2:
+            h.update(b'liblinear')
+
+        return h.hexdigest()
+
+    def fit(self, X, y):
+        '''
+        Execute the missing fits of all candidates and folds, create the result table and refit the best candidate on
+        the whole data
+
+        :args:
+            X: Features
+            y: Labels
+        :return:
+            self
+        '''
+
+        splits = list(self.cv.split(X, y))
+        self.n_splits_ = len(splits)
+        candidate_keys = [get_candidate_key(params) for params in self.candidates]
+
+        self.search_key_ = self.get_search_key(X, y, splits)
+        journal = SearchJournal(self.journal_path, self.search_key_)
+        records = journal.load()
+        if self.carried_records is not None:
+            # Folds of carried candidates, which an earlier search on the same folds has fitted
+            n_carried = 0
+            for (candidate_key, fold), record in self.carried_records.items():
+                if fold < self.n_splits_ and (candidate_key, fold) not in records:
+                    records[(candidate_key, fold)] = record
+                    n_carried += 1
+            print("Carried records: {} fits of earlier stages are reused".format(n_carried))
+
+        # Candidates with the same canonical parameters fit the same model. Only the first candidate of each
+        # equivalence class is fitted and its scores are copied to the other candidates
+        if self.canonicalize:
+            canonical_keys = [get_candidate_key(get_canonical_params(params, self.estimator))
+                              for params in self.candidates]
+        else:
+            canonical_keys = candidate_keys
+        representatives = dict()
+        for i, canonical_key in enumerate(canonical_keys):
+            representatives.setdefault(canonical_key, i)
+        self.n_removed_fits_ = (len(self.candidates) - len(representatives)) * self.n_splits_
+        if self.n_removed_fits_ > 0:
+            print("Canonicalization: {} candidates are {} distinct candidates. {} duplicate fits removed".format(
+                len(self.candidates), len(representatives), self.n_removed_fits_))
+
+        # Trials of earlier runs with the same data, folds and estimator are loaded from the trial store
+        store = None if self.trial_store_path is None else TrialStore(self.trial_store_path)
+        if store is not None:
+            stored_records = store.load(self.search_key_)
+            n_stored = 0
+            for i in representatives.values():
+                for fold in range(self.n_splits_):
+                    if (candidate_keys[i], fold) not in records and (canonical_keys[i], fold) in stored_records:
+                        records[(candidate_keys[i], fold)] = dict(stored_records[(canonical_keys[i], fold)],
+                                                                  candidate=candidate_keys[i])
+                        n_stored += 1
+            print("Trial store: {} fits loaded from {}".format(n_stored, self.trial_store_path))
+        self.fit_history_ = [] if store is None else store.get_fit_history()
+
+        tasks = [(i, fold) for i in sorted(representatives.values()) for fold in range(self.n_splits_)
+                 if (candidate_keys[i], fold) not in records]
+        print("Search with {} candidates and {} folds: {} fits, of which {} are finished in the journal {} or the "
+              "trial store".format(
+            len(representatives), self.n_splits_, len(representatives) * self.n_splits_,
+            len(representatives) * self.n_splits_ - len(tasks), self.journal_path))
+
+        if self.prune_top_k is None:
+            self.run_tasks(X, y, splits, tasks, candidate_keys, journal, records)
+            pruned = set()
+        else:
+            pruned = self.run_tasks_with_pruning(X, y, splits, sorted(representatives.values()), candidate_keys,
+                                                 journal, records)
+        if store is not None:
+            search_info = {'data': get_data_fingerprint(X, y), 'n_samples': X.shape[0], 'n_splits': self.n_splits_,
+                           'estimator': get_estimator_key(self.estimator), 'scorers': list(self.scoring.keys()),
+                           'return_train_score': self.return_train_score}
+            store.save(self.search_key_, search_info,
+                       [(canonical_keys[i], self.candidates[i], records[(candidate_keys[i], fold)])
+                        for i in representatives.values() for fold in range(self.n_splits_)
+                        if (candidate_keys[i], fold) in records])
+        for i, canonical_key in enumerate(canonical_keys):
+            representative_key = candidate_keys[representatives[canonical_key]]
+            if representative_key != candidate_keys[i]:
+                for fold in range(self.n_splits_):
+                    if (representative_key, fold) in records:
+                        records[(candidate_keys[i], fold)] = dict(records[(representative_key, fold)],
+                                                                  candidate=candidate_keys[i])
+
+        self.records_ = records
+        self.pruned_ = [representatives[canonical_key] in pruned for canonical_key in canonical_keys]
+        self.cv_results_ = self.create_cv_results(candidate_keys, records)
+
+        self.best_index_ = int(self.cv_results_['rank_test_' + self.refit].argmin())
+        self.best_params_ = self.candidates[self.best_index_]
+        self.best_score_ = self.cv_results_['mean_test_' + self.refit][self.best_index_]
+
+        if self.refit_best:
+            start_time = time.time()
+            self.best_estimator_ = clone(self.estimator).set_params(**self.best_params_)
+            self.best_estimator_.fit(X, y)
+            self.refit_time_ = time.time() - start_time
+
+        return self
+
+    def run_tasks(self, X, y, splits, tasks, candidate_keys, journal, records):
+        '''
+        Execute the fits of the tasks in parallel and add the new records to records
+
+        :args:
+            X: Features
+            y: Labels
+            splits: List of (train, test) indices
+            tasks: List of missing (candidate index, fold)
+            candidate_keys: Keys of the candidates
+            journal: SearchJournal
+            records: Dict of (candidate key, fold) and records, which is extended
+        :return:
+            Nothing
+        '''
+
+        task_costs = self.get_task_costs(X, splits, tasks, candidate_keys, records)
+        prefix_length = get_prefix_length(self.estimator, self.prefix_end)
+        if prefix_length > 0:
+            new_records = self.run_prefix_groups(X, y, splits, tasks, candidate_keys, prefix_length, journal,
+                                                 task_costs)
+        else:
+            new_records = run_ordered_parallel(
+                fit_and_score_candidate,
+                [(clone(self.estimator), X, y, splits[fold][0], splits[fold][1], self.candidates[i],
+                  candidate_keys[i], fold, self.scoring, self.return_train_score, journal, self.verbose)
+                 for i, fold in tasks], task_costs, self.n_jobs, self.verbose, self.blas_threads)
+        for record in new_records:
+            records[(record['candidate'], record['fold'])] = record
+
+    def get_task_costs(self, X, splits, tasks, candidate_keys, records):
+        '''
+        Estimate the fit time of each task with a FitCostModel, which is learned from the finished records of this
+        search and the fit history of the trial store. If order_by_cost is False, all costs are 0 and the tasks run in
+        their original order.
+
+        :args:
+            X: Features
+            splits: List of (train, test) indices
+            tasks: List of missing (candidate index, fold)
+            candidate_keys: Keys of the candidates
+            records: Dict of (candidate key, fold) and the finished records
+        :return:
+            costs: List of the estimated costs of the tasks
+        '''
+
+        if not self.order_by_cost:
+            return [0.0] * len(tasks)
+
+        candidate_params = dict(zip(candidate_keys, self.candidates))
+        history = [(candidate_params[key], len(splits[fold][0]), record['fit_time'])
+                   for (key, fold), record in records.items() if key in candidate_params and fold < len(splits)]
+        self.cost_model_ = FitCostModel(self.estimator).fit(history + self.fit_history_, X.shape[1])
+
+        return [self.cost_model_.predict(self.candidates[i], len(splits[fold][0]), X.shape[1]) for i, fold in tasks]
+
+    def run_tasks_with_pruning(self, X, y, splits, candidate_indices, candidate_keys, journal, records):
+        '''
+        Evaluate the folds one after the other for all candidates, which have not been pruned. The candidates of a fold
+        run in parallel. After each fold, the candidates, which cannot reach the top prune_top_k, are pruned and
+        their remaining folds are not fitted.
+
+        :args:
+            X: Features
+            y: Labels
+            splits: List of (train, test) indices
+            candidate_indices: Indices of the candidates to evaluate
+            candidate_keys: Keys of the candidates
+            journal: SearchJournal
+            records: Dict of (candidate key, fold) and records, which is extended
+        :return:
+            pruned: Set of the indices of the pruned candidates
+        '''
+
+        pruned = set()
+        for fold in range(self.n_splits_):
+            tasks = [(i, fold) for i in candidate_indices
+                     if i not in pruned and (candidate_keys[i], fold) not in records]
+            self.run_tasks(X, y, splits, tasks, candidate_keys, journal, records)
+            if fold < self.n_splits_ - 1:
+                new_pruned = self.get_pruned_candidates([i for i in candidate_indices if i not in pruned],
+                                                        candidate_keys, records, fold + 1)
+                pruned.update(new_pruned)
+                if len(new_pruned) > 0:
+                    print("Pruning after {} folds: {} candidates pruned, {} remaining. {} fits saved".format(
+                        fold + 1, len(new_pruned), len(candidate_indices) - len(pruned),
+                        len(new_pruned) * (self.n_splits_ - fold - 1)))
+
+        return pruned
+
+    def get_pruned_candidates(self, candidate_indices, candidate_keys, records, n_folds):
+        '''
+        Get the candidates, which cannot reach the top prune_top_k. The uncertainty of the mean score of a candidate
+        after n_folds folds is estimated with the pooled standard deviation of the fold scores around the candidate
+        means. A candidate is pruned, if its upper bound mean + prune_z * std / sqrt(n_folds) is below the
+        prune_top_k-th best lower bound of all candidates. Candidates with failed fits are pruned too.
+
+        :args:
+            candidate_indices: Indices of the candidates, which have not been pruned
+            candidate_keys: Keys of the candidates
+            records: Dict of (candidate key, fold) and records
+            n_folds: Number of evaluated folds
+        :return:
+            pruned: List of the indices of the candidates to prune
+        '''
+
+        if n_folds < 2 or len(candidate_indices) <= self.prune_top_k:
+            return []
+
+        scores = np.array([[records[(candidate_keys[i], fold)]['test'][self.refit] for fold in range(n_folds)]
+                           for i in candidate_indices], dtype=float)
+        means = np.mean(scores, axis=1)
+        valid = ~np.isnan(means)
+        if np.sum(valid) <= self.prune_top_k:
+            return []
+
+        deviations = scores[valid] - means[valid, np.newaxis]
+        pooled_std = np.sqrt(np.sum(deviations ** 2) / (np.sum(valid) * (n_folds - 1)))
+        margin = self.prune_z * pooled_std / np.sqrt(n_folds)
+        threshold = np.sort(means[valid] - margin)[::-1][self.prune_top_k - 1]
+
+        return [i for i, mean in zip(candidate_indices, means) if np.isnan(mean) or mean + margin < threshold]
+
+    def run_prefix_groups(self, X, y, splits, tasks, candidate_keys, prefix_length, journal, task_costs):
+        '''
+        Group the missing fits by fold and prefix parameters and run each group in a worker, which fits the prefix only
+        once. The groups with the highest sum of task costs are dispatched first. The hit rate of the prefix cache and
+        the saved time are printed.
+
+        :args:
+            X: Features
+            y: Labels
+            splits: List of (train, test) indices
+            tasks: List of missing (candidate index, fold)
+            candidate_keys: Keys of the candidates
+            prefix_length: Number of prefix steps
+            journal: SearchJournal
+            task_costs: List of the estimated costs of the tasks
+        :return:
+            records: List of new records
+        '''
+
+        prefix_step_names = [name for name, _ in self.estimator.steps[:prefix_length]]
+        groups = dict()
+        group_costs = dict()
+        for (i, fold), cost in zip(tasks, task_costs):
+            group_key = (fold, get_candidate_key(get_prefix_params(self.candidates[i], prefix_step_names)))
+            groups.setdefault(group_key, []).append((self.candidates[i], candidate_keys[i]))
+            group_costs[group_key] = group_costs.get(group_key, 0.0) + cost
+
+        sampler_index = get_sampler_index(self.estimator, self.candidates, prefix_length)
+        if self.share_resampling and sampler_index is not None:
+            results = self.run_resampling_groups(X, y, splits, groups, group_costs, prefix_length, sampler_index,
+                                                 journal)
+        else:
+            results = run_ordered_parallel(
+                fit_and_score_prefix_group,
+                [(clone(self.estimator), prefix_length, X, y, splits[fold][0], splits[fold][1], group_candidates,
+                  fold, self.scoring, self.return_train_score, journal, self.verbose, self.precompute_kernel,
+                  self.kernel_memory_mb, None, self.liblinear)
+                 for (fold, prefix_key), group_candidates in groups.items()],
+                [group_costs[group_key] for group_key in groups.keys()], self.n_jobs, self.verbose, self.blas_threads)
+
+        records = [record for group_records, _, _ in results for record in group_records]
+        liblinear_checks = [liblinear_check for _, _, group_checks in results for liblinear_check in group_checks]
+        if len(liblinear_checks) > 0:
+            print("liblinear: {} groups of C values, {} fits did not converge. Check with libsvm at the smallest C: "
+                  "minimum prediction agreement {:.1f}%, maximum score difference {:.4f}".format(
+                len(liblinear_checks), sum(check['not_converged'] for check in liblinear_checks),
+                100 * min(check['prediction_agreement'] for check in liblinear_checks),
+                max(check['max_score_difference'] for check in liblinear_checks)))
+        self.liblinear_checks_ = liblinear_checks
+        if len(records) > 0:
+            # Without the cache, the prefix would have been fitted for every candidate
+            saved_time = sum(prefix_time * (len(group_records) - 1) for group_records, prefix_time, _ in results)
+            print("Prefix cache of {}: {} prefix fits for {} candidate fits. Hit rate {:.1f}%. Saved about {:.1f}s "
+                  "of fit time.".format(prefix_step_names, len(groups), len(records),
+                                        100 * (1 - len(groups) / len(records)), saved_time))
+            sample_time = sum(record['sample_time'] for record in records)
+            print("Fit time {:.1f}s, of which {:.1f}s in the samplers".format(
+                sum(record['fit_time'] for record in records), sample_time))
+
+        return records
+
+    def run_resampling_groups(self, X, y, splits, groups, group_costs, prefix_length, sampler_index, journal):
+        '''
+        Fit and score the prefix groups in parallel. All prefix groups of a fold with the same steps before the sampler
+        are fitted in one worker with a shared neighbour cache, which also fits their candidates on the resampled data,
+        see fit_resampling_group. The groups with the highest sum of task costs are dispatched first.
+
+        :args:
+            X: Features
+            y: Labels
+            splits: List of (train, test) indices
+            groups: Dict of (fold, prefix key) and the list of (parameters, candidate key) of the prefix group
+            group_costs: Dict of (fold, prefix key) and the estimated costs of the prefix group
+            prefix_length: Number of prefix steps
+            sampler_index: Index of the first sampler in the pipeline
+            journal: SearchJournal
+        :return:
+            results: List of the results of fit_and_score_prefix_group of all prefix groups
+        '''
+
+        prefix_step_names = [name for name, _ in self.estimator.steps[:prefix_length]]
+        head_step_names = prefix_step_names[:sampler_index]
+        resampling_groups = dict()
+        resampling_costs = dict()
+        for (fold, prefix_key), group_candidates in groups.items():
+            params = group_candidates[0][0]
+            resampling_key = (fold, get_candidate_key(get_prefix_params(params, head_step_names)))
+            resampling_groups.setdefault(resampling_key, []).append(
+                (get_prefix_params(params, prefix_step_names), group_candidates))
+            resampling_costs[resampling_key] = resampling_costs.get(resampling_key, 0.0) + group_costs[
+                (fold, prefix_key)]
+
+        resampling_results = run_ordered_parallel(
+            fit_resampling_group,
+            [(clone(self.estimator), prefix_length, sampler_index, X, y, splits[fold][0], splits[fold][1],
+              prefix_groups, fold, self.scoring, self.return_train_score, journal, self.verbose,
+              self.precompute_kernel, self.kernel_memory_mb, self.liblinear, "{}_{}".format(fold, head_key))
+             for (fold, head_key), prefix_groups in resampling_groups.items()],
+            [resampling_costs[resampling_key] for resampling_key in resampling_groups.keys()], self.n_jobs,
+            self.verbose, self.blas_threads)
+
+        results = [group_result for group_results, _ in resampling_results for group_result in group_results]
+        n_queries = sum(neighbor_stats['queries'] for _, neighbor_stats in resampling_results)
+        n_hits = sum(neighbor_stats['hits'] for _, neighbor_stats in resampling_results)
+        print("Resampling of {} prefixes in {} groups. Shared neighbour cache: {} of {} neighbour searches "
+              "reused".format(len(results), len(resampling_groups), n_hits, n_queries))
+
+        return results
+
+    def create_cv_results(self, candidate_keys, records):
+        '''
+        Create the cv_results_ dict in the same format as GridSearchCV from the journal records
+
+        :args:
+            candidate_keys: Keys of the candidates in candidate order
+            records: Dict of (candidate key, fold) and records
+        :return:
+            results: Dict of numpy arrays
+        '''
+
+        return create_cv_results(self.candidates, candidate_keys, records, self.n_splits_, list(self.scoring.keys()),
+                                 self.return_train_score, self.pruned_)
+
+    def score(self, X, y):
+        return self.scoring[self.refit](self.best_estimator_, X, y)
+
+    def predict(self, X):
+        return self.best_estimator_.predict(X)
+
+    def decision_function(self, X):
+        return self.best_estimator_.decision_function(X)
+
+    def predict_proba(self, X):
+        return self.best_estimator_.predict_proba(X)
+
+    @property
+    def classes_(self):
+        return self.best_estimator_.classes_
+
+
+def get_rung_sizes(n_candidates, min_samples, max_samples, factor):
+    '''
+    Get the number of samples of each rung of a successive halving search. The last rung uses max_samples and each
+    rung before uses 1/factor of the samples of the next rung. There are only as many rungs as necessary to reduce the
+    candidates to one and as possible without going below min_samples.
+
+    :args:
+        n_candidates: Number of candidates in the first rung
+        min_samples: Minimum number of samples of the first rung
+        max_samples: Number of samples of the last rung
+        factor: Reduction factor eta. The best 1/factor of the candidates are kept after each rung
+    :return:
+        sizes: List of sample numbers of the rungs
+    '''
+
+    min_samples = min(min_samples, max_samples)
+    n_possible_rungs = int(np.floor(np.log(max_samples / min_samples) / np.log(factor))) + 1
+    n_required_rungs = int(np.ceil(np.log(max(n_candidates, 1)) / np.log(factor))) + 1
+    n_rungs = min(n_possible_rungs, n_required_rungs)
+
+    return [int(max_samples / factor ** (n_rungs - 1 - rung)) for rung in range(n_rungs)]
+
+
+class SuccessiveHalvingSearchCV(BaseEstimator):
+    '''
+    Successive halving search over an explicit list of candidates. All candidates start on a small stratified sample
+    of the data. After each rung, only the best 1/factor of the candidates are kept and the sample grows by factor
+    until the last rung uses max_samples, which is the whole data by default. The samples of the rungs are nested.
+
+    Each rung is a JournaledSearchCV, which shares the journal, i.e. a restarted search resumes in the rung, where it
+    stopped. cv_results_, best_params_, best_score_ and best_estimator_ are the ones of the last rung, so that the
+    results can be used like the results of GridSearchCV. The sizes and scores of all rungs are in rung_results_.
+
+    If prune_folds is True, the candidates of each rung, which cannot reach the kept 1/factor of the candidates, are
+    pruned after some folds, see JournaledSearchCV. In the last rung, prune_top_k is the number of candidates, which
+    have to be evaluated on all folds.
+
+    '''
+
+    def __init__(self, estimator, candidates, scoring, refit, cv, factor=3, min_samples=300, max_samples=None,
+                 n_jobs=-1, verbose=0, return_train_score=True, journal_path=None, prefix_end='feat',
+                 precompute_kernel=False, kernel_memory_mb=1024, trial_store_path=None, prune_folds=False, prune_z=2.0,
+                 prune_top_k=None, liblinear=False):
+        self.estimator = estimator
+        self.candidates = candidates
+        self.scoring = scoring
+        self.refit = refit
+        self.cv = cv
+        self.factor = factor
+        self.min_samples = min_samples
+        self.max_samples = max_samples
+        self.n_jobs = n_jobs
+        self.verbose = verbose
+        self.return_train_score = return_train_score
+        self.journal_path = journal_path
+        self.prefix_end = prefix_end
+        self.precompute_kernel = precompute_kernel
+        self.kernel_memory_mb = kernel_memory_mb
+        self.trial_store_path = trial_store_path
+        self.prune_folds = prune_folds
+        self.prune_z = prune_z
+        self.prune_top_k = prune_top_k
+        self.liblinear = liblinear
+
+    def fit(self, X, y):
+        '''
+        Run the rungs, keep the best candidates after each rung and refit the best candidate of the last rung on its
+        samples
+
+        :args:
+            X: Features
+            y: Labels
+        :return:
+            self
+        '''
+
+        if self.factor <= 1:
+            raise Exception("The halving factor has to be > 1, but is {}".format(self.factor))
+
+        max_samples = X.shape[0] if self.max_samples is None else min(int(self.max_samples), X.shape[0])
+        sizes = get_rung_sizes(len(self.candidates), self.min_samples, max_samples, self.factor)
+        order = get_stratified_order(y)
+        print("Successive halving with {} candidates, factor {} and the rung sizes {}".format(
+            len(self.candidates), self.factor, sizes))
+
+        candidates = list(self.candidates)
+        self.rung_results_ = []
+        for rung, n_samples in enumerate(sizes):
+            is_last_rung = rung == len(sizes) - 1
+            n_keep = max(1, int(np.ceil(len(candidates) / self.factor)))
+            if not self.prune_folds:
+                prune_top_k = None
+            elif is_last_rung:
+                prune_top_k = self.prune_top_k
+            else:
+                prune_top_k = n_keep
+            sample_index = np.sort(order[:n_samples])
+            X_rung, y_rung = index_rows(X, sample_index), index_rows(y, sample_index)
+
+            start_time = time.time()
+            rung_search = JournaledSearchCV(self.estimator, candidates, self.scoring, self.refit, self.cv,
+                                            n_jobs=self.n_jobs, verbose=self.verbose,
+                                            return_train_score=self.return_train_score,
+                                            journal_path=self.journal_path, prefix_end=self.prefix_end,
+                                            refit_best=is_last_rung, precompute_kernel=self.precompute_kernel,
+                                            kernel_memory_mb=self.kernel_memory_mb,
+                                            trial_store_path=self.trial_store_path, prune_top_k=prune_top_k,
+                                            prune_z=self.prune_z, liblinear=self.liblinear).fit(X_rung, y_rung)
+            duration = time.time() - start_time
+
+            self.rung_results_.append({'rung': rung, 'n_samples': n_samples, 'n_candidates': len(candidates),
+                                       'best_score': rung_search.best_score_, 'duration': duration})
+            print("Rung {}: {} candidates on {} samples. Best {}={:.3f}. Duration {:.1f}s".format(
+                rung, len(candidates), n_samples, self.refit, rung_search.best_score_, duration))
+
+            if not is_last_rung:
+                # Keep the best candidates in their original order. Failed candidates with nan scores and pruned
+                # candidates are last
+                means = rung_search.cv_results_['mean_test_' + self.refit]
+                means = np.where(np.isnan(means) | rung_search.cv_results_['pruned'], -np.inf, means)
+                keep = np.sort(np.argsort(-means, kind='stable')[:n_keep])
+                candidates = [candidates[i] for i in keep]
+
+        full_samples = len(self.candidates) * max_samples
+        used_samples = sum(r['n_candidates'] * r['n_samples'] for r in self.rung_results_)
+        print("Successive halving used {} candidate samples instead of {} for the full search on {} samples "
+              "({:.1f}%)".format(used_samples, full_samples, max_samples, 100 * used_samples / full_samples))
+
+        self.cv_results_ = rung_search.cv_results_
+        # Parameters of candidates, which were removed in earlier rungs, are masked in the table of the last rung
+        n_candidates = len(candidates)
+        for params in self.candidates:
+            for name in params.keys():
+                if 'param_' + name not in self.cv_results_:
+                    self.cv_results_['param_' + name] = np.ma.MaskedArray(np.empty(n_candidates), mask=True,
+                                                                          dtype=object)
+
+        self.n_splits_ = rung_search.n_splits_
+        self.search_key_ = rung_search.search_key_
+        self.best_index_ = rung_search.best_index_
+        self.best_params_ = rung_search.best_params_
+        self.best_score_ = rung_search.best_score_
+        self.best_estimator_ = rung_search.best_estimator_
+        self.refit_time_ = rung_search.refit_time_
+
+        return self
+
+    def score(self, X, y):
+        return self.scoring[self.refit](self.best_estimator_, X, y)
+
+    def predict(self, X):
+        return self.best_estimator_.predict(X)
+
+    def decision_function(self, X):
+        return self.best_estimator_.decision_function(X)
+
+    def predict_proba(self, X):
+        return self.best_estimator_.predict_proba(X)
+
+    @property
+    def classes_(self):
+        return self.best_estimator_.classes_
+
+
+def benchmark_precomputed_kernel(n_samples=2000, n_features=20, n_splits=3, kernel_memory_mb=1024):
+    '''
+    Compare the search with and without precomputed kernel matrices for each kernel on synthetic data. Both searches
+    run with one job, so that the times are comparable. The scores of all candidates have to be the same.
+
+    :args:
+        n_samples: Number of samples of the synthetic data
+        n_features: Number of features of the synthetic data
+        n_splits: Number of folds
+        kernel_memory_mb: Maximum size of the kernel matrices of a fold in MB
+    :return:
+        benchmark: Data frame with one row per kernel with the durations, the speedup and the largest score difference
+    '''
+
+    # Only imported for the benchmark
+    from sklearn.datasets import make_classification
+    from sklearn.metrics import make_scorer, f1_score
+    from sklearn.model_selection import StratifiedKFold
+    from sklearn.pipeline import Pipeline
+    from sklearn.preprocessing import StandardScaler
+    from sklearn.svm import SVC
+
+    import sklearn_utils as modelutil
+
+    X, y = make_classification(n_samples=n_samples, n_features=n_features, n_informative=n_features // 2,
+                               weights=[0.7], random_state=0)
+    scorers = {'f1_score': make_scorer(f1_score)}
+    pipe = Pipeline([('scaler', StandardScaler()), ('feat', modelutil.ColumnExtractor(cols=None)), ('svm', SVC())])
+    cols = [list(range(n_features)), list(range(n_features // 2))]
+    test_C = [1e-2, 1e-1, 1e0, 1e1, 1e2]
+    param_grids = {'linear': {'feat__cols': cols, 'svm__kernel': ['linear'], 'svm__C': test_C},
+                   'poly': {'feat__cols': cols, 'svm__kernel': ['poly'], 'svm__C': test_C[:4], 'svm__degree': [2, 3]},
+                   'rbf': {'feat__cols': cols, 'svm__kernel': ['rbf'], 'svm__C': test_C,
+                           'svm__gamma': ['scale', 1e-3, 1e-2, 1e-1]},
+                   'sigmoid': {'feat__cols': cols, 'svm__kernel': ['sigmoid'], 'svm__C': test_C,
+                               'svm__gamma': ['scale', 1e-2]}}
+
+    rows = []
+    for kernel, param_grid in param_grids.items():
+        candidates = grid_candidates(param_grid)
+        durations = dict()
+        scores = dict()
+        for precompute_kernel in [False, True]:
+            start_time = time.time()
+            search = JournaledSearchCV(pipe, candidates, scorers, 'f1_score',
+                                       StratifiedKFold(n_splits=n_splits, random_state=3, shuffle=True), n_jobs=1,
+                                       precompute_kernel=precompute_kernel, kernel_memory_mb=kernel_memory_mb,
+                                       refit_best=False).fit(X, y)
+            durations[precompute_kernel] = time.time() - start_time
+            scores[precompute_kernel] = np.array([search.cv_results_['split{}_test_f1_score'.format(fold)]
+                                                  for fold in range(n_splits)])
+        rows.append({'kernel': kernel, 'candidates': len(candidates), 'duration_libsvm': durations[False],
+                     'duration_precomputed': durations[True], 'speedup': durations[False] / durations[True],
+                     'max_score_difference': np.nanmax(np.abs(scores[False] - scores[True]))})
+
+    benchmark = pd.DataFrame(rows).set_index('kernel')
+    print("Benchmark of the precomputed kernel with {} samples, {} features and {} folds".format(n_samples,
+                                                                                              n_features, n_splits))
+    print(benchmark.round(4).to_string())
+
+    return benchmark
+
+
+def benchmark_kernel_approximation(sample_sizes=(1000, 4000, 16000), n_features=20, n_components=500,
+                                   max_exact_samples=20000, C=1.0):
+    '''
+    Compare the accuracy and the training time of the exact rbf SVC with the approximated kernels of
+    sklearn_utils.ApproximateKernelSVC at several sample sizes on synthetic data. Each model is trained on the samples
+    and scored on a test set of the same distribution. The exact SVC is skipped above max_exact_samples.
+
+    :args:
+        sample_sizes: Numbers of training samples
+        n_features: Number of features of the synthetic data
+        n_components: Number of components of the approximated kernels
+        max_exact_samples: Largest number of training samples of the exact SVC
+        C: C of all models
+    :return:
+        benchmark: Data frame with one row per sample size and model with the training time and the test accuracy
+    '''
+
+    # Only imported for the benchmark
+    from sklearn.datasets import make_classification
+    from sklearn.metrics import accuracy_score
+    from sklearn.pipeline import Pipeline
+    from sklearn.preprocessing import StandardScaler
+    from sklearn.svm import SVC
+
+    import sklearn_utils as modelutil
+
+    n_test = 5000
+    X, y = make_classification(n_samples=max(sample_sizes) + n_test, n_features=n_features,
+                               n_informative=n_features // 2, flip_y=0.05, random_state=0)
+    X_test, y_test = X[-n_test:], y[-n_test:]
+
+    models = {'exact_rbf': SVC(kernel='rbf', C=C)}
+    for kernel in modelutil.APPROXIMATE_KERNELS.keys():
+        models[kernel] = modelutil.ApproximateKernelSVC(kernel=kernel, C=C, n_components=n_components)
+
+    rows = []
+    for n_samples in sample_sizes:
+        for name, model in models.items():
+            if name == 'exact_rbf' and n_samples > max_exact_samples:
+                continue
+            pipe = Pipeline([('scaler', StandardScaler()), ('svm', clone(model))])
+            start_time = time.time()
+            pipe.fit(X[:n_samples], y[:n_samples])
+            train_time = time.time() - start_time
+            rows.append({'samples': n_samples, 'model': name, 'train_time': train_time,
+                         'accuracy': accuracy_score(y_test, pipe.predict(X_test))})
+
+    benchmark = pd.DataFrame(rows).set_index(['samples', 'model'])
+    print("Benchmark of the approximated kernels with {} features and {} components against the exact rbf "
+          "kernel".format(n_features, n_components))
+    print(benchmark.round(4).to_string())
+
+    return benchmark
@@ -1,8 +1,12 @@
-from sklearn.base import BaseEstimator, TransformerMixin
+import time
+
+from sklearn.base import BaseEstimator, ClassifierMixin, TransformerMixin, clone
 from sklearn.model_selection import train_test_split
 import pandas as pd
 import numpy as np
 
+import threshold_utils as thr
+
 class Nosampler(BaseEstimator, TransformerMixin):
     '''
     The nosampler class do not do any type of sampling. It shall be used to compare with common over, under and
@@ -44,6 +48,271 @@ class ColumnExtractor(BaseEstimator, TransformerMixin):
     def fit(self, X, y=None):
         return self
 
+class LazyCalibratedClassifier(BaseEstimator, ClassifierMixin):
+    '''
+    Classifier, e.g. an SVC with probability=False, with a separate calibrator for the probabilities. libsvm fits the
+    probabilities with an internal 5-fold cross validation, which multiplies the training time, although the
+    threshold selection and the temporal evaluation only use the decision function. Here, the classifier is fitted
+    once on the training data without a held out calibration split of calibration_share of the data. calibrate fits
+    the calibrator, sigmoid or isotonic, on the decision function of this classifier on the calibration split, i.e.
+    the calibrator maps the scores of the model, which it calibrates. The calibration split is kept until calibrate is
+    called and is not saved with a calibrated model.
+
+    decision_function and predict use the classifier without calibration, predict_proba uses the calibrator.
+
+    '''
+
+    def __init__(self, estimator=None, method='sigmoid', calibration_share=0.1, random_state=0):
+        self.estimator = estimator
+        self.method = method
+        self.calibration_share = calibration_share
+        self.random_state = random_state
+
+    def fit(self, X, y):
+        # Only imported for the fit, which inference does not need
+        import search_utils as search
+
+        y = np.asarray(y)
+        n_samples = y.shape[0]
+        n_calibration = max(int(self.calibration_share * n_samples), min(100, n_samples // 2))
+        fit_index, calibration_index = train_test_split(np.arange(n_samples), test_size=n_calibration,
+                                                        random_state=self.random_state, stratify=y)
+        self.estimator_ = clone(self.estimator).fit(search.index_rows(X, fit_index), y[fit_index])
+        self.classes_ = self.estimator_.classes_
+        self.calibrators_ = None
+        self._X_calibration = search.index_rows(X, calibration_index)
+        self._y_calibration = y[calibration_index]
+        return self
+
+    def decision_function(self, X):
+        return self.estimator_.decision_function(X)
+
+    def predict(self, X):
+        return self.estimator_.predict(X)
+
+    def calibrate(self):
+        '''
+        Fit the calibrators on the decision function of the classifier on the calibration split. Binary classifiers
+        get one calibrator of the positive class, multi class classifiers one calibrator per class of the one vs rest
+        decision function. The calibration split is not needed afterwards and is dropped.
+
+        :return:
+            self
+        '''
+
+        # Only imported for the calibration, which inference does not need
+        from sklearn.isotonic import IsotonicRegression
+        from sklearn.linear_model import LogisticRegression
+
+        if getattr(self, '_X_calibration', None) is None:
+            raise Exception("The classifier has no calibration split. Fit it before calibrate")
+        start_time = time.time()
+        scores = self.decision_function(self._X_calibration)
+        y_calibration = self._y_calibration
+        if scores.ndim == 1:
+            scores = scores[:, np.newaxis]
+            targets = [y_calibration == self.classes_[1]]
+        else:
+            targets = [y_calibration == c for c in self.classes_]
+
+        calibrators = []
+        for k, target in enumerate(targets):
+            if self.method == 'sigmoid':
+                calibrator = LogisticRegression(C=1e6).fit(scores[:, k:k + 1], target.astype(int))
+            elif self.method == 'isotonic':
+                calibrator = IsotonicRegression(y_min=0, y_max=1, out_of_bounds='clip').fit(scores[:, k],
+                                                                                            target.astype(int))
+            else:
+                raise Exception("Unknown calibration method {}. Use sigmoid or isotonic".format(self.method))
+            calibrators.append(calibrator)
+        self.calibrators_ = calibrators
+        print("Fitted {} calibrator on the held out scores of {} samples in {:.2f}s".format(
+            self.method, scores.shape[0], time.time() - start_time))
+        # The calibration split is not saved with the model
+        self._X_calibration = None
+        self._y_calibration = None
+
+        return self
+
+    def predict_proba(self, X):
+        if self.calibrators_ is None:
+            raise Exception("The classifier is not calibrated. Call calibrate before predict_proba")
+        calibrators = self.calibrators_
+        scores = self.decision_function(X)
+        if scores.ndim == 1:
+            scores = scores[:, np.newaxis]
+
+        proba = np.empty((scores.shape[0], len(calibrators)))
+        for k, calibrator in enumerate(calibrators):
+            if self.method == 'sigmoid':
+                proba[:, k] = calibrator.predict_proba(scores[:, k:k + 1])[:, 1]
+            else:
+                proba[:, k] = calibrator.predict(scores[:, k])
+
+        if len(calibrators) == 1:
+            return np.hstack([1 - proba, proba])
+        # Normalize the one vs rest probabilities like CalibratedClassifierCV
+        proba_sum = proba.sum(axis=1, keepdims=True)
+        return np.where(proba_sum > 0, proba / np.where(proba_sum > 0, proba_sum, 1), 1.0 / len(calibrators))
+
+# Kernels of ApproximateKernelSVC with their approximation and the approximated kernel
+APPROXIMATE_KERNELS = {'nystroem_rbf': ('nystroem', 'rbf'), 'rff_rbf': ('rff', 'rbf')}
+
+class ApproximateKernelSVC(BaseEstimator, ClassifierMixin):
+    '''
+    SVM for large datasets, which approximates the kernel with an explicit feature map and fits a linear SVM on the
+    mapped features. The exact SVC scales with O(n^2) to O(n^3) of the samples, this approximation linearly.
+    nystroem_rbf maps the features with the Nystroem method on n_components samples, rff_rbf with n_components random
+    Fourier features. The linear SVM is fitted with SGD and the hinge loss or with liblinear in the primal with the
+    squared hinge loss. Both scale linearly with the samples, while the dual hinge solver of liblinear converges slowly
+    on the dense mapped features.
+
+    The parameters C, gamma and kernel are used like in SVC, so that the estimator can replace the svm step of the
+    pipelines and its kernel is selected in the wide search like the kernels of SVC. decision_function and predict
+    work like in SVC, predict_proba is not available.
+
+    '''
+
+    def __init__(self, kernel='nystroem_rbf', C=1.0, gamma='scale', n_components=500, solver='sgd',
+                 class_weight=None, max_iter=10000, random_state=0):
+        self.kernel = kernel
+        self.C = C
+        self.gamma = gamma
+        self.n_components = n_components
+        self.solver = solver
+        self.class_weight = class_weight
+        self.max_iter = max_iter
+        self.random_state = random_state
+
+    def get_gamma(self, X):
+        '''
+        Resolve gamma='scale' and gamma='auto' on the data like SVC
+
+        '''
+
+        if self.gamma == 'scale':
+            X_var = np.asarray(X, dtype=np.float64).var()
+            return 1.0 / (X.shape[1] * X_var) if X_var != 0 else 1.0
+        elif self.gamma == 'auto':
+            return 1.0 / X.shape[1]
+        return float(self.gamma)
+
+    def fit(self, X, y):
+        # Only imported for the approximation, which inference does not need to import
+        from sklearn.kernel_approximation import Nystroem, RBFSampler
+        from sklearn.linear_model import SGDClassifier
+        from sklearn.svm import LinearSVC
+
+        if self.kernel not in APPROXIMATE_KERNELS:
+            raise Exception("Unknown kernel {}. Use one of {}".format(self.kernel, list(APPROXIMATE_KERNELS.keys())))
+        approximation, kernel = APPROXIMATE_KERNELS[self.kernel]
+
+        gamma = self.get_gamma(X)
+        if approximation == 'nystroem':
+            self.feature_map_ = Nystroem(kernel=kernel, gamma=gamma, n_components=min(self.n_components, X.shape[0]),
+                                         random_state=self.random_state)
+        else:
+            self.feature_map_ = RBFSampler(gamma=gamma, n_components=self.n_components,
+                                           random_state=self.random_state)
+        X_mapped = self.feature_map_.fit_transform(X)
+
+        if self.solver == 'sgd':
+            # The hinge loss with alpha=1/(C*n) has the same minimum as the SVM objective with C
+            self.linear_svm_ = SGDClassifier(loss='hinge', alpha=1.0 / (self.C * X.shape[0]),
+                                             class_weight=self.class_weight, max_iter=self.max_iter, tol=1e-4,
+                                             random_state=self.random_state)
+        elif self.solver == 'liblinear':
+            self.linear_svm_ = LinearSVC(C=self.C, loss='squared_hinge', dual=False, class_weight=self.class_weight,
+                                         max_iter=self.max_iter)
+        else:
+            raise Exception("Unknown solver {}. Use sgd or liblinear".format(self.solver))
+        self.linear_svm_.fit(X_mapped, y)
+        self.classes_ = self.linear_svm_.classes_
+
+        return self
+
+    def decision_function(self, X):
+        return self.linear_svm_.decision_function(self.feature_map_.transform(X))
+
+    def predict(self, X):
+        return self.linear_svm_.predict(self.feature_map_.transform(X))
+
+def get_svm_for_kernel(kernel, n_components=500):
+    '''
+    Get an unfitted SVM for a kernel name of the wide search, i.e. an SVC for the kernels of libsvm and an
+    ApproximateKernelSVC for the approximated kernels
+
+    :args:
+        kernel: Kernel name, e.g. rbf or nystroem_rbf
+        n_components: Number of components of the approximated kernels
+    :return:
+        svm: Unfitted SVM
+    '''
+
+    # Only imported here, as the pipelines are mostly loaded with pickle
+    from sklearn.svm import SVC
+
+    if kernel in APPROXIMATE_KERNELS:
+        return ApproximateKernelSVC(kernel=kernel, n_components=n_components)
+    return SVC(kernel=kernel)
+
+def set_probability_mode(pipe, probability_mode='platt', calibration_method='sigmoid', calibration_share=0.1):
+    '''
+    Set how the SVM of a pipe gets probabilities. platt sets probability=True, i.e. libsvm fits the probabilities with
+    an internal cross validation. SVMs without this parameter get the lazy mode instead. lazy wraps the SVM without
+    probabilities into a LazyCalibratedClassifier, which holds out calibration_share of the data and fits a calibrator
+    on the scores of the SVM on it, when calibrate_probabilities is called. none fits the SVM without probabilities.
+
+    :args:
+        pipe: Pipeline with the SVM as step svm
+        probability_mode: platt, lazy or none
+        calibration_method: sigmoid or isotonic for the lazy mode
+        calibration_share: Share of the training data, which is held out to calibrate the lazy mode
+    :return:
+        pipe: Pipeline with the probability mode
+    '''
+
+    svm = pipe['svm']
+    if isinstance(svm, LazyCalibratedClassifier):
+        svm = svm.estimator
+
+    if probability_mode not in ['platt', 'lazy', 'none']:
+        raise Exception("Unknown probability mode {}. Use platt, lazy or none".format(probability_mode))
+
+    if probability_mode == 'platt' and 'probability' not in svm.get_params():
+        # SVMs without Platt scaling, e.g. ApproximateKernelSVC, get the lazy calibrator
+        print("The svm {} has no probability parameter. Use a lazy calibrator".format(svm.__class__.__name__))
+        probability_mode = 'lazy'
+
+    if probability_mode == 'platt':
+        svm.probability = True
+    elif svm.get_params().get('probability') is True:
+        svm.probability = False
+    if probability_mode == 'lazy':
+        svm = LazyCalibratedClassifier(svm, method=calibration_method, calibration_share=calibration_share)
+
+    pipe.steps[-1] = ('svm', svm)
+    print("Probability mode of the svm: ", probability_mode)
+
+    return pipe
+
+
+def calibrate_probabilities(pipe):
+    '''
+    Fit the calibrators of a fitted pipe in the probability mode lazy, see set_probability_mode. Pipes in the other
+    modes are not changed.
+
+    :args:
+        pipe: Fitted pipeline with the SVM as step svm
+    :return:
+        pipe: Pipeline, which can predict probabilities
+    '''
+
+    if isinstance(pipe['svm'], LazyCalibratedClassifier):
+        pipe['svm'].calibrate()
+
+    return pipe
+
 def extract_data_subset(X_train, y_train, number_of_samples, shuffled=True):
     '''
     Extract subset of a dataset with X and y. The subset size is set and if the data shall be shuffled
@@ -75,7 +344,7 @@ def extract_data_subset(X_train, y_train, number_of_samples, shuffled=True):
 def generate_result_table(gridsearch_run, params_run, refit_scorer_name):
     '''
     Generate a result table from a sklearn model run.
-    gridsearch_run: the run
+    gridsearch_run: the run or a cv_results_ dict, e.g. from search_utils.TrialStore.get_cv_results
     params_run: parameters for the grid search
     refit_scorer_name: refit scorer name
 
@@ -101,8 +370,16 @@ def generate_result_table(gridsearch_run, params_run, refit_scorer_name):
     result_columns = metric_parameters
     result_columns.extend(table_parameters)
 
-    results = pd.DataFrame(gridsearch_run.cv_results_)
-    results = results.sort_values(by='mean_test_' + refit_scorer_name, ascending=False)
+    if isinstance(gridsearch_run, dict):
+        results = pd.DataFrame(gridsearch_run)
+    else:
+        results = pd.DataFrame(gridsearch_run.cv_results_)
+    if 'pruned' in results.columns:
+        # Candidates, which were pruned after some folds, are marked and sorted after the fully evaluated candidates
+        result_columns.append('pruned')
+        results = results.sort_values(by=['pruned', 'mean_test_' + refit_scorer_name], ascending=[True, False])
+    else:
+        results = results.sort_values(by='mean_test_' + refit_scorer_name, ascending=False)
     results[result_columns].round(3).head(20)
 
     return results[result_columns]
@@ -154,9 +431,9 @@ def reduce_classes(y_classes, y_val, y_val_pred):
 def adjusted_classes(y_scores, t):
     """
     This function adjusts class predictions based on the prediction threshold (t).
-    Will only work for binary classification problems.
+    Will only work for binary classification problems. The comparison is vectorized and returns a numpy array.
 
     # Create adjusted precision-recall curves
     # https://towardsdatascience.com/fine-tuning-a-classifier-in-scikit-learn-66e048c21e65
     """
-    return [1 if y >= t else 0 for y in y_scores]
\ No newline at end of file
+    return thr.apply_threshold(y_scores, t)
\ No newline at end of file
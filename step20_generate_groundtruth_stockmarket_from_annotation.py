@@ -65,7 +65,6 @@ parser.add_argument("-conf", '--config_path', default="config/debug_timedata_omx
 # parser.add_argument("-i", "--on_inference_data", action='store_true',
 #                    help="Set inference if only inference and no training")
 
-args = parser.parse_args()
 
 
 # def generate_custom_class_labels():
@@ -582,11 +581,12 @@ def main(config_path):
     # Save file
     # Save outcomes to a csv file
     print("Outcomes shape {}".format(outcomes_cut.shape))
-    outcomes_cut.to_csv(outcomes_filename_raw, sep=';', index=True, header=True)
+    sup.write_csv_cached(outcomes_cut, outcomes_filename_raw, sep=';', index=True)
     print("Saved outcomes to " + outcomes_filename_raw)
 
 
 if __name__ == "__main__":
+    args = parser.parse_args()
     #if not args.pb and not args.xml:
     #    sys.exit("Please pass either a frozen pb or IR xml/bin model")
 
@@ -33,13 +33,11 @@ import argparse
 import os
 import pandas as pd
 import matplotlib.pyplot as plt
-from statsmodels.nonparametric.smoothers_lowess import lowess
 import numpy as np
 from scipy.ndimage.interpolation import shift
 from pandas.plotting import register_matplotlib_converters
 
 # Own modules
-import data_visualization_functions as vis
 import custom_methods as custom
 import data_handling_support_functions as sup
 
@@ -68,7 +66,6 @@ parser.add_argument("-debug", '--debug_param', default=False, action='store_true
 # parser.add_argument("-i", "--on_inference_data", action='store_true',
 #                    help="Set inference if only inference and no training")
 
-args = parser.parse_args()
 
 
 def generate_smoothed_trigger(values, alpha=0.5, tailclip=0.1):
@@ -674,13 +671,14 @@ def main(config_path, debug_param):
 
     # Save features to a csv file
     print("Features shape {}".format(features.shape))
-    features.to_csv(features_filename_uncut, sep=';', index=True, header=True)
+    sup.write_csv_cached(features, features_filename_uncut, sep=';', index=True)
     print("Saved features to " + features_filename_uncut)
 
     print("=== Data for {} prepared to be trained or inferred ===".format(conf['Common'].get('dataset_name')))
 
 
 if __name__ == "__main__":
+    args = parser.parse_args()
     main(args.config_path, args.debug_param)
 
 
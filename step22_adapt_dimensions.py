@@ -59,7 +59,6 @@ parser.add_argument("-conf", '--config_path', default="config/debug_timedata_omx
 # parser.add_argument("-i", "--on_inference_data", action='store_true',
 #                    help="Set inference if only inference and no training")
 
-args = parser.parse_args()
 
 
 def cut_unusable_parts_of_dataframe(df, head_index=-1, tail_index=-1):
@@ -133,9 +132,9 @@ def main(config_path):
 
     # Load only a subset of the whole raw data to create a debug dataset
     source_uncut = custom.load_source(conf['Paths'].get('source_path'))
-    features_uncut = pd.read_csv(features_filename_uncut, sep=';').set_index('id')
+    features_uncut = sup.read_csv_cached(features_filename_uncut, sep=';').set_index('id')
     if os.path.isfile(outcomes_filename_uncut):
-        outcomes_uncut = pd.read_csv(outcomes_filename_uncut, sep=';').set_index('id')
+        outcomes_uncut = sup.read_csv_cached(outcomes_filename_uncut, sep=';').set_index('id')
         print("Outcomes file found. Adapting dimensions for training data.")
         print("Outcomes shape: ", outcomes_uncut.shape)
     else:
@@ -193,7 +192,7 @@ def main(config_path):
 
     # Save the graph data for visualization of the results
     print("Feature shape {}".format(features_subset.shape))
-    features_subset.to_csv(features_out_filename, sep=';', index=True, header=True)
+    sup.write_csv_cached(features_subset, features_out_filename, sep=';', index=True)
     print("Saved features graph to " + features_out_filename)
 
     # Save the graph data for visualization of the results
@@ -207,10 +206,11 @@ def main(config_path):
 
         # Save the graph data for visualization of the results
         print("Outcomes shape {}".format(outcomes_subset.shape))
-        outcomes_subset.to_csv(outcomes_out_filename, sep=';', index=True, header=True)
+        sup.write_csv_cached(outcomes_subset, outcomes_out_filename, sep=';', index=True)
         print("Saved source graph to " + outcomes_out_filename)
 
 if __name__ == "__main__":
+    args = parser.parse_args()
 
     main(args.config_path)
 
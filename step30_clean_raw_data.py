@@ -39,7 +39,6 @@ from pandas.core.dtypes.common import is_string_dtype
 from pandas.plotting import register_matplotlib_converters
 
 # Own modules
-import data_visualization_functions as vis
 import data_handling_support_functions as sup
 
 __author__ = 'Alexander Wendt'
@@ -70,7 +69,6 @@ parser.add_argument("-n", "--no_images", action='store_true', default=False,
 parser.add_argument("-i", "--on_inference_data", action='store_true',
                     help="Set inference if only inference and no training")
 
-args = parser.parse_args()
 
 
 def clean_features_first_pass(features_raw, class_name):
@@ -155,13 +153,13 @@ def load_files(features_path, outcomes_path, source_path, labels_path):
     ### Load Features and Outcomes
 
     # === Load Features ===#
-    features_raw = pd.read_csv(input_features_filename, sep=';').set_index('id')  # Set ID to be the data id
+    features_raw = sup.read_csv_cached(input_features_filename, sep=';').set_index('id')  # Set ID to be the data id
     print(features_raw.head(1))
 
     # === Load Outcomes ===#
     if os.path.isfile(input_outcomes_filename):
         #if not on_inference_data:
-        outcomes_raw = pd.read_csv(input_outcomes_filename, sep=';').set_index('id')  # Set ID to be the data id
+        outcomes_raw = sup.read_csv_cached(input_outcomes_filename, sep=';').set_index('id')  # Set ID to be the data id
         print(outcomes_raw.head(1))
     else:
         outcomes_raw =None
@@ -203,6 +201,9 @@ def load_class_labels(labels_filename):
 
 
 def print_characteristics(features_raw, image_save_directory, dataset_name, save_graphs=False):
+    # Only import the visualization functions if images are created, as they take long to import
+    import data_visualization_functions as vis
+
     for i, d in enumerate(features_raw.dtypes):
         if is_string_dtype(d):
             print("Column {} is a categorical string".format(features_raw.columns[i]))
@@ -308,6 +309,7 @@ def main(config_path, on_inference_data, no_images):
 
 
 if __name__ == "__main__":
+    args = parser.parse_args()
 
     main(args.config_path, args.on_inference_data, args.no_images)
 
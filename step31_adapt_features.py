@@ -30,7 +30,6 @@ OR IN CONNECTION WITH THE USE OR PERFORMANCE OF THIS SOFTWARE.
 import argparse
 import os
 import pickle
-import missingno as msno
 import numpy as np
 import pandas as pd
 import matplotlib.pyplot as plt
@@ -66,7 +65,6 @@ parser.add_argument("-conf", '--config_path', default="config/debug_timedata_omx
 # parser.add_argument("-i", "--on_inference_data", action='store_true',
 #                    help="Set inference if only inference and no training")
 
-args = parser.parse_args()
 
 
 def adapt_features_for_model(features_cleaned1, outcomes_cleaned1, result_dir, class_labels, conf):
@@ -158,6 +156,7 @@ def adapt_features_for_model(features_cleaned1, outcomes_cleaned1, result_dir, c
     vis.paintBarChartForMissingValues(features.columns, missingValueShare)
 
     # Visualize missing data with missingno
+    import missingno as msno
     #fig = plt.figure(num=None, figsize=(8, 8), dpi=80, facecolor='w', edgecolor='k')
     msno.matrix(features)
     plt.gcf()
@@ -203,7 +202,7 @@ def main(config_path):
 
     # === Save features to a csv file ===#
     print("Features shape {}".format(features.shape))
-    features.to_csv(model_features_filename, sep=';', index=True)
+    sup.write_csv_cached(features, model_features_filename, sep=';', index=True)
     # np.savetxt(filenameprefix + "_X.csv", X, delimiter=";", fmt='%s')
     print("Saved features to " + model_features_filename)
 
@@ -211,7 +210,7 @@ def main(config_path):
     if y is not None:
         print("outcome shape {}".format(y.shape))
         y_true = pd.DataFrame(y, columns=[class_name], index=outcomes_cleaned1.index)
-        y_true.to_csv(model_outcomes_filename, sep=';', index=True, header=True)
+        sup.write_csv_cached(y_true, model_outcomes_filename, sep=';', index=True)
         print("Saved features to " + model_outcomes_filename)
     else:
         print("y values not saved as no ourcome was provided.")
@@ -229,6 +228,7 @@ def main(config_path):
 
 
 if __name__ == "__main__":
+    args = parser.parse_args()
     main(args.config_path)
 
     print("=== Program end ===")
\ No newline at end of file
@@ -65,7 +65,6 @@ parser.add_argument("-conf", '--config_path', default="config/debug_timedata_omx
 # parser.add_argument("-i", "--on_inference_data", action='store_true',
 #                    help="Set inference if only inference and no training")
 
-args = parser.parse_args()
 
 def find_tsne_parmeters(X_scaled_subset, y_subset, class_labels, conf, image_save_directory):
     # Optimize t-sne plot
@@ -140,6 +139,7 @@ def main(config_path):
 
 
 if __name__ == "__main__":
+    args = parser.parse_args()
 
     main(args.config_path)
 
@@ -37,8 +37,6 @@ import numpy as np
 from sklearn.decomposition import PCA
 from sklearn.manifold import TSNE
 
-import umap.umap_ as umap  # Work around from https://github.com/lmcinnes/umap/issues/24
-
 import matplotlib.pyplot as plt
 
 from scipy.cluster import hierarchy
@@ -75,7 +73,6 @@ parser = argparse.ArgumentParser(description='Step 3 - Analyze Data')
 parser.add_argument("-conf", '--config_path', default="config/debug_timedata_omxS30.ini",
                     help='Configuration file path', required=False)
 
-args = parser.parse_args()
 
 
 def analyse_features(features, y, class_labels, source, conf, image_save_directory):
@@ -224,8 +221,9 @@ def plot_pca(X_scaled, class_labels, conf, image_save_directory, y):
 def plot_umap(X_scaled, class_labels, conf, image_save_directory, y):
     # Use a supervised / unsupervised analysis to make the clusters
 
+    import umap.umap_ as umap  # Work around from https://github.com/lmcinnes/umap/issues/24
+
     sns.set(style='white', context='poster')
-    # import umap
     # %time #Time of the whole cell
     embeddingUnsupervised = umap.UMAP(n_neighbors=5).fit_transform(X_scaled)
     # %time #Time of the whole cell
@@ -557,6 +555,7 @@ def main(config_path):
 
 
 if __name__ == "__main__":
+    args = parser.parse_args()
     main(args.config_path)
 
 
@@ -62,7 +62,6 @@ parser = argparse.ArgumentParser(description='Step 3 - Analyze Data Temporal Ana
 parser.add_argument("-conf", '--config_path', default="config/debug_timedata_omxS30.ini",
                     help='Configuration file path', required=False)
 
-args = parser.parse_args()
 
 
 def rescale(conf, features, y):
@@ -193,6 +192,7 @@ def main(config_path):
 
 
 if __name__ == "__main__":
+    args = parser.parse_args()
 
     main(args.config_path)
 
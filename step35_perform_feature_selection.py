@@ -69,7 +69,6 @@ parser = argparse.ArgumentParser(description='Step 3 - Perform feature selection
 parser.add_argument("-conf", '--config_path', default="config/debug_timedata_omxS30.ini",
                     help='Configuration file path', required=False)
 
-args = parser.parse_args()
 
 
 def predict_features_simple(X, y):
@@ -325,6 +324,7 @@ def main(config_path):
 
 
 if __name__ == "__main__":
+    args = parser.parse_args()
     main(args.config_path)
 
     print("=== Program end ===")
\ No newline at end of file
@@ -64,7 +64,6 @@ parser.add_argument("-conf", '--config_path', default="config/debug_timedata_omx
 #parser.add_argument("-i", "--do_inference", action='store_true',
 #                    help="Set inference if only inference and no training")
 
-args = parser.parse_args()
 
 
 def split_train_validation_data(config_path):
@@ -92,22 +91,23 @@ def split_train_validation_data(config_path):
         raise Exception("y_test only consists one class after train/test split. Please adjust the data.")
 
     # Save results
-    X_train.to_csv(
-        os.path.join(conf['Paths'].get('prepared_data_directory'), conf['Preparation'].get('features_out_train')),
-        sep=';', index=True, header=True)
-    X_val.to_csv(
-        os.path.join(conf['Paths'].get('prepared_data_directory'), conf['Preparation'].get('features_out_val')),
-        sep=';', index=True, header=True)
-    y_train.to_csv(
-        os.path.join(conf['Paths'].get('prepared_data_directory'), conf['Preparation'].get('outcomes_out_train')),
-        sep=';', index=True, header=True)
-    y_val.to_csv(
-        os.path.join(conf['Paths'].get('prepared_data_directory'), conf['Preparation'].get('outcomes_out_val')),
-        sep=';', index=True, header=True)
+    sup.write_csv_cached(
+        X_train, os.path.join(conf['Paths'].get('prepared_data_directory'), conf['Preparation'].get('features_out_train')),
+        sep=';', index=True)
+    sup.write_csv_cached(
+        X_val, os.path.join(conf['Paths'].get('prepared_data_directory'), conf['Preparation'].get('features_out_val')),
+        sep=';', index=True)
+    sup.write_csv_cached(
+        y_train, os.path.join(conf['Paths'].get('prepared_data_directory'), conf['Preparation'].get('outcomes_out_train')),
+        sep=';', index=True)
+    sup.write_csv_cached(
+        y_val, os.path.join(conf['Paths'].get('prepared_data_directory'), conf['Preparation'].get('outcomes_out_val')),
+        sep=';', index=True)
 
     print("Saved training and validation files.")
 
 if __name__ == "__main__":
+    args = parser.parse_args()
 
     split_train_validation_data(args.config_path)
 
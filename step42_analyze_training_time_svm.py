@@ -36,13 +36,14 @@ import logging
 import numpy as np
 from pandas.plotting import register_matplotlib_converters
 from sklearn.svm import SVC
-from xgboost import XGBClassifier
 import matplotlib.pyplot as plt
 
 # Own modules
 #import data_visualization_functions as vis
 #import data_handling_support_functions as sup
 import execution_utils as exe
+import forecast_utils as forecast
+import sklearn_utils as modelutil
 from evaluation_utils import Metrics
 import data_handling_support_functions as sup
 
@@ -63,10 +64,6 @@ np.set_printoptions(precision=3)
 #Suppress print out in scientific notiation
 np.set_printoptions(suppress=True)
 
-logging.basicConfig(level=logging.DEBUG,
-                    format='%(asctime)s %(message)s',
-                    datefmt='%Y%m%d %H:%M:%S',
-                    handlers=[logging.FileHandler("logs/" + "test" + ".log"), logging.StreamHandler()])
 log = logging.getLogger(__name__)
 
 
@@ -76,7 +73,6 @@ parser.add_argument("-conf", '--config_path', default="config/debug_timedata_omx
 parser.add_argument("-algo", '--algorithm', default="svm",
                     help='Select algorithm to test: SVM (svm) or XGBoost (xgboost). Deafult: SVM.', required=False)
 
-args = parser.parse_args()
 
 
 
@@ -181,6 +177,51 @@ def run_training_estimation(X_train, y_train, X_test, y_test, scorer, model_clf,
     plt.pause(0.1)
     plt.close()
 
+def run_training_cost_model(conf, X_train, y_train, selected_features, cost_model_path, image_save_directory=None):
+    '''
+    Measure the fit times of the kernels and samplers of the wide search, which the search_utils.FitCostModel needs,
+    learn the cost model and save it for the forecasts of step43 and step44
+
+    :args:
+        conf: Configuration
+        X_train: Training data
+        y_train: Training labels as numbers
+        selected_features: List of feature column lists
+        cost_model_path: Path of the cost model
+        image_save_directory: Directory of the figure of the measured and estimated fit times
+    :return:
+        cost_model: Training cost model
+    '''
+
+    cost_model, measurements = forecast.fit_training_cost_model(conf, X_train, y_train, selected_features,
+                                                                cost_model_path)
+
+    # Paint the measured and estimated fit times of the kernels
+    plt.figure()
+    n_features = measurements['n_features'].max()
+    kernel_measurements = measurements[(measurements['sampler'] == 'Nosampler') & (measurements['C'] == 1.0) &
+                                       (measurements['gamma'] == 'scale') & (measurements['n_features'] == n_features)]
+    for kernel, group in kernel_measurements.groupby('kernel', sort=False):
+        line = plt.loglog(group['n_samples'], group['duration'], 'o')[0]
+        kernel_params = dict(forecast.get_kernel_params(kernel), sampling=modelutil.Nosampler())
+        plt.loglog(group['n_samples'], [cost_model.predict(kernel_params, n, n_features) for n in group['n_samples']],
+                   '-', color=line.get_color(), label=kernel)
+    plt.xlabel('Number of training examples')
+    plt.ylabel('Duration [s]')
+    plt.title("Training Cost Model with {} Features".format(n_features))
+    plt.legend()
+
+    if image_save_directory:
+        if not os.path.isdir(image_save_directory):
+            os.makedirs(image_save_directory)
+        plt.savefig(os.path.join(image_save_directory, 'SVM_Cost_Model'), dpi=300)
+
+    plt.show(block = False)
+    plt.pause(0.1)
+    plt.close()
+
+    return cost_model
+
 def run_training_predictors(data_input_path, algorithm):
     '''
 
@@ -203,6 +244,7 @@ def run_training_predictors(data_input_path, algorithm):
 
     #Set classifier and estimate performance
     if algorithm=='xgboost':
+        from xgboost import XGBClassifier
         model_clf = XGBClassifier(objective="binary:logistic", random_state=42)
         log.info("XBoost Classifier selected.")
     else:
@@ -211,8 +253,19 @@ def run_training_predictors(data_input_path, algorithm):
 
     run_training_estimation(X_train, y_train, X_val, y_val, scorer, model_clf, save_fig_prefix)
 
+    #Fit the cost model of the searches of step43 and step44
+    if algorithm != 'xgboost':
+        run_training_cost_model(conf, X_train, y_train, selected_features,
+                                paths['svm_training_cost_model_filename'], save_fig_prefix)
+
 
 if __name__ == "__main__":
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.DEBUG,
+                        format='%(asctime)s %(message)s',
+                        datefmt='%Y%m%d %H:%M:%S',
+                        handlers=[logging.FileHandler("logs/" + "test" + ".log"), logging.StreamHandler()])
 
     #if not args.pb and not args.xml:
     #    sys.exit("Please pass either a frozen pb or IR xml/bin model")
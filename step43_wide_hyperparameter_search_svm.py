@@ -25,6 +25,7 @@ OR IN CONNECTION WITH THE USE OR PERFORMANCE OF THIS SOFTWARE.
 #from __future__ import print_function
 
 # Built-in/Generic Imports
+import json
 import os
 
 # Libs
@@ -33,6 +34,7 @@ import warnings
 
 from pandas.plotting import register_matplotlib_converters
 import pickle
+import time
 from pickle import dump
 
 #from IPython.core.display import display
@@ -54,6 +56,8 @@ from imblearn.combine import SMOTETomek
 import data_visualization_functions as vis
 import data_handling_support_functions as sup
 import execution_utils as exe
+import forecast_utils as forecast
+import search_utils as search
 from evaluation_utils import Metrics
 from filepaths import Paths
 
@@ -80,7 +84,6 @@ parser.add_argument("-debug", '--debug_param', default=False, action='store_true
 parser.add_argument("-conf", '--config_path', default="config/debug_timedata_omxs30.ini",
                     help='Configuration file path', required=False)
 
-args = parser.parse_args()
 
 
 def load_input(conf):
@@ -124,6 +127,77 @@ def load_input(conf):
 
     return X_train, y_train, X_val, y_val, y_classes, selected_features, feature_dict, paths, scorers, refit_scorer_name
 
+def check_wide_search_budget(config, X_train, y_train, selected_features, parameters, subset_share, n_splits,
+                             halving_factor, halving_min_samples, halving_max_share, cost_model_path):
+    '''
+    Forecast the CPU-hours and the wall time of the wide search and of the following narrow search of step44 with the
+    training cost model and compare their sum with training_budget_hours. If it exceeds the budget, warn or, with
+    budget_action=shrink, shrink subset_share or halving_max_share, so that the wide search and the unshrunk narrow
+    search fit into the budget. The narrow search is forecasted with the rbf kernel and the slowest sampler, as its
+    kernel is not known yet. Its sample shares are not shrunk here: step44 checks the narrow search again with the
+    rest of the budget after the measured wall time of the wide search and shrinks them there.
+
+    :args:
+        config: Configuration
+        X_train: Training data
+        y_train: Training labels
+        selected_features: List of feature column lists
+        parameters: Parameter grid of the wide search
+        subset_share: Share of the training data of the grid search
+        n_splits: Number of folds
+        halving_factor: Halving factor or None for the grid search
+        halving_min_samples: Number of samples of the first rung of successive halving
+        halving_max_share: Share of the training data of the last rung of successive halving
+        cost_model_path: Path of the cost model of step42. If it does not exist and a budget is set, it is measured
+    :return:
+        subset_share: Share of the training data of the grid search within the budget
+        halving_max_share: Share of the training data of the last rung within the budget
+    '''
+
+    cost_model = forecast.get_training_cost_model(config, forecast.get_cost_model_pipeline(), X_train, y_train,
+                                                  selected_features, cost_model_path)
+    if cost_model is None:
+        return subset_share, halving_max_share
+    budget_hours = forecast.get_training_budget_hours(config)
+    budget_action = config['Training'].get('budget_action', 'warn')
+
+    candidates = search.grid_candidates(parameters)
+    n_train = X_train.shape[0]
+    n_features = X_train.shape[1]
+    if halving_factor is None:
+        # run_basic_svm uses at least 300 samples
+        n_subset = max(300, subset_share * n_train)
+        min_factor = 300 / n_subset
+        wide_function = lambda factor: forecast.forecast_search(cost_model, candidates, int(factor * n_subset),
+                                                                n_splits, n_features)
+    else:
+        max_samples = int(halving_max_share * n_train)
+        min_factor = min(halving_min_samples, max_samples) / max_samples
+        wide_function = lambda factor: forecast.forecast_halving_search(cost_model, candidates, halving_min_samples,
+                                                                        int(factor * max_samples), halving_factor,
+                                                                        n_splits, n_features)
+
+    # The narrow search is forecasted with rbf and the slowest sampler of the grid
+    samplers = {type(sampler).__name__: sampler for grid in parameters for sampler in grid.get('sampling', [])}
+    narrow_samples = json.loads(config['Training'].get('narrow_samples'))
+    narrow_forecast = max(
+        [forecast.forecast_narrow_search(cost_model, {'svm__kernel': 'rbf', 'sampling': sampler}, n_features, n_train,
+                                         narrow_samples, json.loads(config['Training'].get('narrow_kfolds')),
+                                         json.loads(config['Training'].get('narrow_iterations')))
+         for sampler in list(samplers.values()) + [modelutil.Nosampler()]],
+        key=lambda narrow: narrow['wall_seconds'])
+    forecast.print_forecast('wide search', wide_function(1.0))
+    forecast.print_forecast('narrow search with rbf and the slowest sampler', narrow_forecast)
+    factor = forecast.check_training_budget('wide and narrow search',
+                                            lambda factor: forecast.add_forecasts(wide_function(factor),
+                                                                                  narrow_forecast),
+                                            budget_hours, budget_action, min_factor)
+
+    if halving_factor is None:
+        return factor * subset_share, halving_max_share
+    return subset_share, factor * halving_max_share
+
+
 def execute_wide_search(config, use_debug_parameters=False):
     ''' Execute the wide search algorithm
 
@@ -136,6 +210,29 @@ def execute_wide_search(config, use_debug_parameters=False):
 
     subset_share = float(config['Training'].get('subset_share')) #0.1
     max_features = int(config.get('Training', 'max_features'))
+    # Successive halving replaces the grid search on a fixed subset
+    if config['Training'].get('wide_search_mode', 'grid') == 'halving':
+        halving_factor = float(config['Training'].get('halving_factor', '3'))
+        halving_min_samples = int(config['Training'].get('halving_min_samples', '300'))
+        halving_max_share = float(config['Training'].get('halving_max_share', '1.0'))
+    else:
+        halving_factor = None
+        halving_min_samples = 300
+        halving_max_share = 1.0
+    # Fit all C values of a kernel on one precomputed kernel matrix per fold
+    precompute_kernel = config['Training'].get('precompute_kernel', 'False') == 'True'
+    kernel_memory_mb = int(config['Training'].get('kernel_memory_mb', '1024'))
+    # Prune candidates after some folds, which cannot reach the top share, which is used in the analysis of the results
+    if config['Training'].get('prune_folds', 'False') == 'True':
+        prune_top_share = 0.2
+    else:
+        prune_top_share = None
+    prune_z = float(config['Training'].get('prune_z', '2.0'))
+    # Fit the linear kernel candidates with liblinear instead of libsvm
+    liblinear = config['Training'].get('liblinear', 'False') == 'True'
+    # Kernels of ApproximateKernelSVC, which are searched like the kernels of SVC, e.g. ["nystroem_rbf", "rff_rbf"]
+    approximate_kernels = json.loads(config['Training'].get('approximate_kernels', '[]'))
+    approximate_components = int(config['Training'].get('approximate_components', '500'))
 
     # Load complete training input
     X_train, y_train, X_val, y_val, y_classes, selected_features, \
@@ -153,6 +250,13 @@ def execute_wide_search(config, use_debug_parameters=False):
     if not os.path.isdir(os.path.dirname(results_file_path)):
         os.makdir(os.path.dirname(results_file_path))
         print("Directory created: ", os.path.dirname(results_file_path))
+    # Finished fits are saved in the journal. If the search is restarted, they are loaded instead of fitted again
+    journal_path = results_file_path + "_journal.jsonl"
+    # Trials of earlier runs on the same data are loaded from the trial store and only new candidates are fitted
+    if config['Training'].get('use_trial_store', 'True') == 'True':
+        trial_store_path = paths['svm_trial_store_filename']
+    else:
+        trial_store_path = None
 
     # Define parameters as an array of dicts in case different parameters are used for different optimizations
     params_debug = [{'scaler': [StandardScaler()],
@@ -171,19 +275,69 @@ def execute_wide_search(config, use_debug_parameters=False):
                         'svm__gamma': [1]
                         # Only relevant in rbf, default='auto'=1/n_features
                     }]
-
+    if approximate_kernels:
+        params_debug.append({'scaler': [StandardScaler()],
+                             'sampling': [modelutil.Nosampler()],
+                             'feat__cols': reduced_selected_features[0:1],
+                             'svm': [modelutil.ApproximateKernelSVC(n_components=approximate_components)],
+                             'svm__C': [1],
+                             'svm__kernel': approximate_kernels,
+                             'svm__gamma': [1]})
+
+    # Forecast the wide and the narrow search with the training cost model and keep them within the training budget
+    if use_debug_parameters:
+        debug_subset_share, halving_max_share = check_wide_search_budget(config, X_train, y_train,
+                                                                         reduced_selected_features, params_debug,
+                                                                         0.01, 2, halving_factor, halving_min_samples,
+                                                                         halving_max_share,
+                                                                         paths['svm_training_cost_model_filename'])
+    else:
+        subset_share, halving_max_share = check_wide_search_budget(
+            config, X_train, y_train, reduced_selected_features, exe.get_wide_search_parameters(X_train, reduced_selected_features,
+                                                            approximate_kernels=approximate_kernels,
+                                                            approximate_components=approximate_components),
+            subset_share, 3, halving_factor, halving_min_samples, halving_max_share,
+            paths['svm_training_cost_model_filename'])
+
+    search_start_time = time.time()
     if use_debug_parameters:
         grid_search_run1, params_run1, pipe_run1, results_run1 = exe.run_basic_svm(X_train, y_train,
                                                                                       reduced_selected_features,
                                                                                       scorers, refit_scorer_name,
-                                                                                      subset_share=0.01, n_splits=2,
-                                                                                      parameters=params_debug)
+                                                                                      subset_share=debug_subset_share, n_splits=2,
+                                                                                      parameters=params_debug,
+                                                                                      journal_path=journal_path,
+                                                                                      halving_factor=halving_factor,
+                                                                                      halving_min_samples=halving_min_samples,
+                                                                                      halving_max_share=halving_max_share,
+                                                                                      precompute_kernel=precompute_kernel,
+                                                                                      kernel_memory_mb=kernel_memory_mb,
+                                                                                      trial_store_path=trial_store_path,
+                                                                                      prune_top_share=prune_top_share,
+                                                                                      prune_z=prune_z,
+                                                                                      liblinear=liblinear,
+                                                                                      approximate_kernels=approximate_kernels,
+                                                                                      approximate_components=approximate_components)
     else:
 
         grid_search_run1, params_run1, pipe_run1, results_run1 = exe.run_basic_svm(X_train, y_train, reduced_selected_features,
                                                                               scorers, refit_scorer_name,
                                                                               subset_share=subset_share, n_splits=3,
-                                                                              )
+                                                                              journal_path=journal_path,
+                                                                              halving_factor=halving_factor,
+                                                                              halving_min_samples=halving_min_samples,
+                                                                              halving_max_share=halving_max_share,
+                                                                              precompute_kernel=precompute_kernel,
+                                                                              kernel_memory_mb=kernel_memory_mb,
+                                                                              trial_store_path=trial_store_path,
+                                                                              prune_top_share=prune_top_share,
+                                                                              prune_z=prune_z,
+                                                                              liblinear=liblinear,
+                                                                              approximate_kernels=approximate_kernels,
+                                                                              approximate_components=approximate_components)
+
+    # The rest of the training budget is left for the narrow search of step44
+    forecast.save_search_time(paths['svm_search_times_filename'], 'wide_search', time.time() - search_start_time)
 
     print('Final score is: ', grid_search_run1.score(X_val, y_val))
 
@@ -210,6 +364,11 @@ def execute_wide_search(config, use_debug_parameters=False):
 
     print("Stored results of run 1 to ", results_file_path)
 
+    # The results are complete. The journal is not needed anymore
+    if os.path.isfile(journal_path):
+        os.remove(journal_path)
+        print("Removed search journal ", journal_path)
+
 
 def extract_categorical_visualize_graphs(config, top_percentage = 0.2):
     '''
@@ -252,14 +411,22 @@ def extract_categorical_visualize_graphs(config, top_percentage = 0.2):
     # Get the top x% values from the results
     # number of results to consider
     #top_percentage = 0.2
-    number_results = np.int(results_run1.shape[0] * top_percentage)
+    # Pruned candidates have the mean score of only their first folds, which would bias the medians, histograms and
+    # the significance matrix, as only bad candidates are pruned. Only fully evaluated candidates are compared.
+    results_complete = results_run1
+    if 'pruned' in results_run1.columns:
+        results_complete = results_run1[~results_run1['pruned'].astype(bool)]
+        print("{} pruned candidates are excluded from the comparison".format(results_run1.shape[0] -
+                                                                              results_complete.shape[0]))
+    number_results = np.int(results_complete.shape[0] * top_percentage)
     print("The top {}% of the results are used, i.e {} samples".format(top_percentage * 100, number_results))
-    results_subset = results_run1.iloc[0:number_results,:]
+    results_subset = results_complete.iloc[0:number_results,:]
 
     # Prepare the inputs: Replace the lists with strings
     result_subset_copy = results_subset.copy()
     print("Convert feature lists to names")
-    sup.list_to_name(selected_features, list(feature_dict.keys()), result_subset_copy['param_feat__cols'])
+    result_subset_copy['param_feat__cols'] = sup.list_to_name(selected_features, list(feature_dict.keys()),
+                                                             result_subset_copy['param_feat__cols'])
 
     # Replace lists in the parameters with strings
     params_run1_copy = copy.deepcopy(params_run1)
@@ -305,7 +472,8 @@ def extract_categorical_visualize_graphs(config, top_percentage = 0.2):
         ('scaler', best_scaler),
         ('sampling', best_sampler),
         ('feat', modelutil.ColumnExtractor(cols=best_columns)),
-        ('svm', SVC(kernel=best_kernel))
+        ('svm', modelutil.get_svm_for_kernel(best_kernel, n_components=int(
+            config['Training'].get('approximate_components', '500'))))
     ])
 
     print(pipe_run_best_first_selection)
@@ -315,7 +483,8 @@ def extract_categorical_visualize_graphs(config, top_percentage = 0.2):
     print("Stored pipe_run_best_first_selection at ", svm_pipe_first_selection)
 
     result_save = results_run1.copy()
-    sup.list_to_name(selected_features, list(feature_dict.keys()), result_save['param_feat__cols'])
+    result_save['param_feat__cols'] = sup.list_to_name(selected_features, list(feature_dict.keys()),
+                                                      result_save['param_feat__cols'])
     result_save.to_csv(results_file_path + ".csv", sep=";")
 
     #result['pipe'].to_json(results_file_path + ".csv", sep=";")
@@ -363,6 +532,7 @@ def execute_wide_run(config_path, execute_search=True, debug_parameters=False):
 
 
 if __name__ == "__main__":
+    args = parser.parse_args()
 
     # Execute wide search
     execute_wide_run(args.config_path, execute_search=args.execute_wide=="True", debug_parameters=args.debug_param)
@@ -42,6 +42,7 @@ import pickle
 #from IPython.core.display import display
 
 import execution_utils as exe
+import forecast_utils as forecast
 import data_visualization_functions_for_SVM as svmvis
 import matplotlib.pyplot as plt
 
@@ -64,6 +65,7 @@ import numpy as np
 #import data_visualization_functions as vis
 import data_handling_support_functions as sup
 import execution_utils as exe
+import search_utils as search
 
 __author__ = 'Alexander Wendt'
 __copyright__ = 'Copyright 2020, Christian Doppler Laboratory for ' \
@@ -87,10 +89,12 @@ parser = argparse.ArgumentParser(description='Step 4 - Execute narrow incrementa
 parser.add_argument("-conf", '--config_path', default="config/debug_timedata_omxs30.ini",
                     help='Configuration file path', required=False)
 
-args = parser.parse_args()
 
 def execute_search_iterations_random_search_SVM(X_train, y_train, init_parameter_svm, pipe_run_random, scorers,
-                                                refit_scorer_name, iter_setup, save_fig_prefix=None):
+                                                refit_scorer_name, iter_setup, save_fig_prefix=None,
+                                                checkpoint_prefix=None, trial_store_path=None, prune_folds=False,
+                                                prune_z=2.0, racing=False, precompute_kernel=False,
+                                                kernel_memory_mb=1024, sampling='random'):
     '''
     Iterated search for parameters. Set sample size, kfolds, number of iterations and top result selection. Execute
     random search cv for the number of entries and extract the best parameters from that search. As a result the
@@ -104,6 +108,22 @@ def execute_search_iterations_random_search_SVM(X_train, y_train, init_parameter
         scorers: scorers to use
         refit_scorer_name: Refit scrorer
         save_fig_prefix: Prefix for images from the analysis
+        checkpoint_prefix: Prefix for the results of each sub run and the search journal. If the search is restarted,
+        finished sub runs are loaded and the search continues with the first unfinished sub run. None for no
+        checkpoints
+        trial_store_path: Path of the trial store with the trials of earlier runs. None for no trial store
+        prune_folds: If True, candidates, which cannot reach the selection of the best results, are pruned after some
+        folds
+        prune_z: Number of standard errors of the pruning bound
+        racing: If True, the best candidates of a run are carried forward to the next run and topped up with new
+        candidates. The data subsets are nested and each run adds its folds to the folds of the earlier runs, see
+        search_utils.NestedFolds, so that the carried candidates are only fitted on the new folds. New candidates,
+        which cannot reach the selection, are pruned after some folds, i.e. they race against the carried ones
+        precompute_kernel: If True, the squared distances of each fold are computed once and the rbf kernels of all
+        gamma values are formed from them
+        kernel_memory_mb: Maximum size of the kernel and distance matrices of a fold in MB
+        sampling: random for independent random candidates, sobol or halton for a scrambled low discrepancy sequence,
+        which needs fewer iterations for the same coverage
 
     :return:
         param_final: Final parameters C and gamma
@@ -114,6 +134,7 @@ def execute_search_iterations_random_search_SVM(X_train, y_train, init_parameter
 
 
     sample_size = list((np.array(iter_setup['samples'])*X_train.shape[0]).astype(int))
+    sample_size_list = sample_size
     kfolds = iter_setup['kfolds']
     number_of_interations = iter_setup['iter']
     select_from_best = iter_setup['selection']
@@ -121,6 +142,11 @@ def execute_search_iterations_random_search_SVM(X_train, y_train, init_parameter
     combined_parameters = zip(sample_size, kfolds, number_of_interations, select_from_best)
 
     new_parameter_rand = init_parameter_svm  # Initialize the system with the parameter borders
+    # Best candidates of the last run and their fold records in the racing mode
+    carried_candidates = None
+    carried_records = None
+    if racing and any(np.diff(sample_size) < 0):
+        raise Exception("Racing needs growing sample sizes, but the sample sizes are {}".format(sample_size))
 
     for i, combination in enumerate(combined_parameters):
         sample_size, folds, iterations, selection = combination
@@ -130,12 +156,30 @@ def execute_search_iterations_random_search_SVM(X_train, y_train, init_parameter
         print("Number of tries: ", iterations)
         print("Number of best results to select from: ", selection)
 
-        # Run random search
-        new_parameter_rand, results_random_search, clf = exe.run_random_cv_for_SVM(X_train, y_train, new_parameter_rand,
-                                                                   pipe_run_random, scorers,
-                                                                   refit_scorer_name, number_of_samples=sample_size,
-                                                                   kfolds=folds,
-                                                                   n_iter_search=iterations, plot_best=selection)
+        # Load the sub run if it has been finished before with the same setup, else run random search
+        subrun_setup = {'sample_size': sample_size, 'folds': folds, 'iterations': iterations, 'selection': selection,
+                        'parameter_in': new_parameter_rand}
+        if sampling != 'random':
+            subrun_setup['sampling'] = sampling
+        if racing:
+            subrun_setup['carried_candidates'] = carried_candidates
+        subrun = load_subrun(checkpoint_prefix, i, subrun_setup)
+        if subrun is not None:
+            new_parameter_rand, results_random_search, clf = subrun
+        else:
+            new_parameter_rand, results_random_search, clf = exe.run_random_cv_for_SVM(
+                X_train, y_train, new_parameter_rand, pipe_run_random, scorers, refit_scorer_name,
+                number_of_samples=sample_size, kfolds=folds, n_iter_search=iterations, plot_best=selection,
+                journal_path=None if checkpoint_prefix is None else checkpoint_prefix + "_journal.jsonl",
+                random_state=i, trial_store_path=trial_store_path, prune_folds=prune_folds or racing, prune_z=prune_z,
+                precompute_kernel=precompute_kernel, kernel_memory_mb=kernel_memory_mb, sampling=sampling,
+                nested_folds=search.NestedFolds(sample_size_list[:i + 1], kfolds[:i + 1]) if racing else None,
+                carried_candidates=carried_candidates, carried_records=carried_records)
+            save_subrun(checkpoint_prefix, i, subrun_setup, (new_parameter_rand, results_random_search, clf))
+        if racing:
+            carried_candidates, carried_records = exe.get_best_candidates_for_SVM(results_random_search, clf,
+                                                                                  selection)
+            print("Carry {} candidates forward to the next run".format(len(carried_candidates)))
         print("Got best parameters: ")
         print(new_parameter_rand)
 
@@ -171,6 +215,222 @@ def execute_search_iterations_random_search_SVM(X_train, y_train, init_parameter
     return param_final, results_random_search
 
 
+def execute_tpe_search_SVM(X_train, y_train, init_parameter_svm, pipe_run, scorers, refit_scorer_name, tpe_setup,
+                           warm_start=None, save_fig_prefix=None, checkpoint_prefix=None, trial_store_path=None,
+                           precompute_kernel=False, kernel_memory_mb=1024):
+    '''
+    Model based search for C and gamma with a tree-structured Parzen estimator instead of the iterated random search.
+    The optimizer proposes batches of candidates, which are evaluated in parallel, and is warm started with the results
+    of the wide search and the trial store.
+
+    :args:
+        X_train: Training data, featrues X
+        y_train: Training labels, ground truth y
+        init_parameter_svm: Initial SVM parameter range of C and gamma
+        pipe_run: ML Pipe
+        scorers: scorers to use
+        refit_scorer_name: Refit scrorer
+        tpe_setup: Dict with the sample share, folds, iterations and batch size
+        warm_start: List of (parameters, score) of the wide search. None for no warm start
+        save_fig_prefix: Prefix for images from the analysis
+        checkpoint_prefix: Prefix of the search journal. None for no journal
+        trial_store_path: Path of the trial store with the trials of earlier runs. None for no trial store
+        precompute_kernel: If True, the rbf kernels of a batch are formed from the squared distances of each fold
+        kernel_memory_mb: Maximum size of the kernel and distance matrices of a fold in MB
+
+    :return:
+        param_final: Final parameters C and gamma
+        results: Result table
+    '''
+
+    sample_size = int(tpe_setup['samples'] * X_train.shape[0])
+    print("Start TPE optimization with the following parameters: ")
+    print("Sample size: ", sample_size)
+    print("Number of folds: ", tpe_setup['kfolds'])
+    print("Number of tries: ", tpe_setup['iter'])
+    print("Batch size: ", tpe_setup['batch_size'])
+
+    _, results, clf = exe.run_tpe_cv_for_SVM(
+        X_train, y_train, init_parameter_svm, pipe_run, scorers, refit_scorer_name, number_of_samples=sample_size,
+        kfolds=tpe_setup['kfolds'], n_iter_search=tpe_setup['iter'], batch_size=tpe_setup['batch_size'],
+        warm_start=warm_start, journal_path=None if checkpoint_prefix is None else checkpoint_prefix + "_journal.jsonl",
+        random_state=0, trial_store_path=trial_store_path, precompute_kernel=precompute_kernel,
+        kernel_memory_mb=kernel_memory_mb)
+
+    # Display the search results
+    ax = svmvis.visualize_random_search_results(clf, refit_scorer_name)
+    svmvis.add_best_results_to_random_search_visualization(ax, results, min(10, results.shape[0]))
+
+    plt.gca()
+    plt.tight_layout()
+    plt.savefig(save_fig_prefix + '_' + 'run2_tpe_samples' + str(sample_size) + '_fold' + str(tpe_setup['kfolds'])
+                + '_iter' + str(tpe_setup['iter']), dpi=300)
+    plt.show(block=False)
+    plt.pause(0.01)
+    plt.close()
+
+    print("Best results: ")
+    print(results.round(3).head(10))
+
+    param_final = {}
+    param_final['C'] = results.iloc[0]['param_svm__C']
+    param_final['gamma'] = results.iloc[0]['param_svm__gamma']
+    print("Hyper parameters found")
+    print(param_final)
+
+    return param_final, results
+
+
+def load_warm_start(results_run1_file_path, pipe_run, refit_scorer_name):
+    '''
+    Load the observations of C and gamma from the results of the wide search for the warm start of the TPE search
+
+    '''
+
+    if not os.path.isfile(results_run1_file_path):
+        print("No results of the wide search for the warm start in ", results_run1_file_path)
+        return []
+
+    with open(results_run1_file_path, 'rb') as f:
+        result_run1 = pickle.load(f)
+
+    return exe.get_warm_start_from_results(result_run1['result'], pipe_run, refit_scorer_name)
+
+
+def get_subrun_path(checkpoint_prefix, subrun):
+    '''
+    Get the path of the saved results of a sub run
+
+    '''
+
+    return checkpoint_prefix + "_subrun" + str(subrun) + ".pkl"
+
+
+def load_subrun(checkpoint_prefix, subrun, subrun_setup):
+    '''
+    Load the results of a finished sub run, if it was executed with the same setup
+
+    :args:
+        checkpoint_prefix: Prefix of the sub run files. If None, nothing is loaded
+        subrun: Number of the sub run
+        subrun_setup: Dict with sample size, folds, iterations, selection, the input parameter range and the optional
+        sampling and carried candidates
+    :return:
+        subrun_result: Tuple of the new parameter range, the result table and the search or None if there is no
+        finished sub run with this setup
+    '''
+
+    if checkpoint_prefix is None or not os.path.isfile(get_subrun_path(checkpoint_prefix, subrun)):
+        return None
+
+    with open(get_subrun_path(checkpoint_prefix, subrun), 'rb') as f:
+        saved = pickle.load(f)
+
+    # All keys of the setup are compared, i.e. optional keys like the sampling or the carried candidates too
+    saved_setup = saved['setup']
+    same_setup = saved_setup.keys() == subrun_setup.keys() and \
+                 all(saved_setup[k].equals(subrun_setup[k]) if hasattr(subrun_setup[k], 'equals')
+                     else saved_setup[k] == subrun_setup[k] for k in subrun_setup)
+    if not same_setup:
+        print("Saved sub run {} has another setup. It is executed again.".format(subrun))
+        return None
+
+    print("Loaded finished sub run {} from {}".format(subrun, get_subrun_path(checkpoint_prefix, subrun)))
+    return saved['result']
+
+
+def save_subrun(checkpoint_prefix, subrun, subrun_setup, subrun_result):
+    '''
+    Save the results of a finished sub run together with its setup
+
+    '''
+
+    if checkpoint_prefix is None:
+        return
+
+    with open(get_subrun_path(checkpoint_prefix, subrun), 'wb') as f:
+        dump({'setup': subrun_setup, 'result': subrun_result}, f)
+    print("Stored sub run {} to {}".format(subrun, get_subrun_path(checkpoint_prefix, subrun)))
+
+
+def remove_checkpoints(checkpoint_prefix, number_of_subruns):
+    '''
+    Remove the sub run files and the search journal after the final results have been saved
+
+    '''
+
+    paths = [get_subrun_path(checkpoint_prefix, i) for i in range(number_of_subruns)]
+    paths.append(checkpoint_prefix + "_journal.jsonl")
+    for path in paths:
+        if os.path.isfile(path):
+            os.remove(path)
+    print("Removed checkpoints of the narrow search ", checkpoint_prefix)
+
+
+def check_narrow_search_budget(config, X_train, y_train, selected_features, pipe_run, parameter_svm, iter_setup,
+                               tpe_setup, narrow_optimizer, cost_model_path, search_times_path):
+    '''
+    Forecast the CPU-hours and the wall time of the narrow search with the training cost model for the kernel and
+    sampler of the wide search and compare it with the rest of training_budget_hours after the wall time of the wide
+    search of step43. If it exceeds the rest of the budget, warn or, with budget_action=shrink, shrink the sample
+    shares of the runs to it.
+
+    :args:
+        config: Configuration
+        X_train: Training data
+        y_train: Training labels
+        selected_features: List of feature column lists
+        pipe_run: Best pipe of the wide search
+        parameter_svm: Initial range of C and gamma
+        iter_setup: Dict with the sample shares, folds, iterations and selections of the iterated random search
+        tpe_setup: Dict with the sample share, folds, iterations and batch size of the TPE search
+        narrow_optimizer: random or tpe
+        cost_model_path: Path of the cost model of step42. If it does not exist and a budget is set, it is measured
+        search_times_path: Path of the wall times of the searches
+    :return:
+        Nothing. The sample shares of iter_setup or tpe_setup of the narrow optimizer are shrunk
+    '''
+
+    cost_model = forecast.get_training_cost_model(config, pipe_run, X_train, y_train, selected_features,
+                                                  cost_model_path)
+    if cost_model is None:
+        return
+    budget_hours = forecast.get_training_budget_hours(config)
+    if budget_hours is not None:
+        wide_seconds = forecast.load_search_times(search_times_path).get('wide_search', 0.0)
+        budget_hours = max(0.0, budget_hours - wide_seconds / 3600)
+        print("The wide search took {:.3f} hours. {:.3f} hours of the training budget are left for the narrow "
+              "search".format(wide_seconds / 3600, budget_hours))
+    budget_action = config['Training'].get('budget_action', 'warn')
+
+    kernel = str(pipe_run['svm'].get_params()['kernel']).strip()
+    sampler = type(pipe_run['sampling']).__name__
+    cols = pipe_run['feat'].cols
+    n_train = X_train.shape[0]
+    n_features = len(cols) if cols is not None else X_train.shape[1]
+    C_bounds = (parameter_svm.loc['param_svm__C', 'min'], parameter_svm.loc['param_svm__C', 'max'])
+    gamma_bounds = (parameter_svm.loc['param_svm__gamma', 'min'], parameter_svm.loc['param_svm__gamma', 'max'])
+    if narrow_optimizer == 'tpe':
+        samples = [tpe_setup['samples']]
+        forecast_function = lambda factor: forecast.forecast_narrow_search(
+            cost_model, {}, n_features, n_train, [factor * tpe_setup['samples']], [tpe_setup['kfolds']],
+            [tpe_setup['iter']], C_bounds=C_bounds, gamma_bounds=gamma_bounds, batch_size=tpe_setup['batch_size'])
+    else:
+        samples = iter_setup['samples']
+        forecast_function = lambda factor: forecast.forecast_narrow_search(
+            cost_model, {}, n_features, n_train, [factor * share for share in iter_setup['samples']],
+            iter_setup['kfolds'], iter_setup['iter'], C_bounds=C_bounds, gamma_bounds=gamma_bounds)
+    # The smallest run keeps at least 300 samples
+    min_factor = 300 / max(300, min(samples) * n_train)
+    factor = forecast.check_training_budget('narrow search with {} and {}'.format(kernel, sampler),
+                                            forecast_function, budget_hours, budget_action, min_factor)
+
+    if narrow_optimizer == 'tpe':
+        tpe_setup['samples'] = factor * tpe_setup['samples']
+    else:
+        iter_setup['samples'] = [factor * share for share in iter_setup['samples']]
+
+
 def execute_narrow_search(config_path):
     '''
     Execute a narrow search on the subset of data
@@ -197,6 +457,24 @@ def execute_narrow_search(config_path):
     iter_setup['iter'] = iterations
     iter_setup['selection'] = selection
 
+    # The model based optimizer replaces the iterated random search
+    narrow_optimizer = config['Training'].get('narrow_optimizer', 'random')
+    tpe_setup = dict()
+    tpe_setup['samples'] = float(config['Training'].get('tpe_samples', str(samples[-1])))
+    tpe_setup['kfolds'] = int(config['Training'].get('tpe_kfolds', str(kfolds[-1])))
+    tpe_setup['iter'] = int(config['Training'].get('tpe_iterations', '40'))
+    tpe_setup['batch_size'] = int(config['Training'].get('tpe_batch_size', '4'))
+    # Prune candidates after some folds, which cannot reach the selection of the best results
+    prune_folds = config['Training'].get('prune_folds', 'False') == 'True'
+    prune_z = float(config['Training'].get('prune_z', '2.0'))
+    # The rbf kernels of all gamma values are formed from one squared distance matrix per fold
+    precompute_kernel = config['Training'].get('precompute_kernel', 'False') == 'True'
+    kernel_memory_mb = int(config['Training'].get('kernel_memory_mb', '1024'))
+    # Carry the best candidates forward between the runs of the iterated random search
+    racing = config['Training'].get('narrow_racing', 'False') == 'True'
+    # Candidates of the iterated random search from a low discrepancy sequence
+    narrow_sampling = config['Training'].get('narrow_sampling', 'random')
+
     #f = open(data_input_path, "rb")
     #prepared_data = pickle.load(f)
     #print("Loaded data: ", prepared_data)
@@ -208,6 +486,11 @@ def execute_narrow_search(config_path):
     #scorers = model['scorers']
     #refit_scorer_name = model['refit_scorer_name']
     results_run2_file_path = paths['svm_run2_result_filename']
+    # Trials of earlier runs on the same data are loaded from the trial store and only new candidates are fitted
+    if config['Training'].get('use_trial_store', 'True') == 'True':
+        trial_store_path = paths['svm_trial_store_filename']
+    else:
+        trial_store_path = None
     svm_pipe_first_selection = paths['svm_pipe_first_selection']
     #svm_pipe_final_selection = paths['svm_pipe_final_selection']
     #Use predefined export location for the pipe
@@ -231,14 +514,40 @@ def execute_narrow_search(config_path):
     # Based on the kernel, get the initial range of continuous parameters
     parameter_svm = exe.get_continuous_parameter_range_for_SVM_based_on_kernel(pipe_run_best_first_selection)
 
-    # Execute iterated random search where parameters are even more limited
-    param_final, results_run2 = execute_search_iterations_random_search_SVM(X_train, y_train,
-                                                                            parameter_svm,
-                                                                            pipe_run_best_first_selection,
-                                                                            scorers,
-                                                                            refit_scorer_name,
-                                                                            iter_setup,
-                                                                            save_fig_prefix=save_fig_prefix + '/')
+    # Forecast the search with the training cost model and keep it within the rest of the training budget
+    check_narrow_search_budget(config, X_train, y_train, selected_features, pipe_run_best_first_selection,
+                               parameter_svm, iter_setup, tpe_setup, narrow_optimizer,
+                               paths['svm_training_cost_model_filename'], paths['svm_search_times_filename'])
+
+    if narrow_optimizer == 'tpe':
+        # Execute the model based search, which is warm started with the results of the wide search
+        warm_start = load_warm_start(paths['svm_run1_result_filename'], pipe_run_best_first_selection,
+                                     refit_scorer_name)
+        param_final, results_run2 = execute_tpe_search_SVM(X_train, y_train, parameter_svm,
+                                                           pipe_run_best_first_selection, scorers, refit_scorer_name,
+                                                           tpe_setup, warm_start=warm_start,
+                                                           save_fig_prefix=save_fig_prefix + '/',
+                                                           checkpoint_prefix=results_run2_file_path,
+                                                           trial_store_path=trial_store_path,
+                                                           precompute_kernel=precompute_kernel,
+                                                           kernel_memory_mb=kernel_memory_mb)
+    else:
+        # Execute iterated random search where parameters are even more limited
+        param_final, results_run2 = execute_search_iterations_random_search_SVM(X_train, y_train,
+                                                                                parameter_svm,
+                                                                                pipe_run_best_first_selection,
+                                                                                scorers,
+                                                                                refit_scorer_name,
+                                                                                iter_setup,
+                                                                                save_fig_prefix=save_fig_prefix + '/',
+                                                                                checkpoint_prefix=results_run2_file_path,
+                                                                                trial_store_path=trial_store_path,
+                                                                                prune_folds=prune_folds,
+                                                                                prune_z=prune_z,
+                                                                                racing=racing,
+                                                                                precompute_kernel=precompute_kernel,
+                                                                                kernel_memory_mb=kernel_memory_mb,
+                                                                                sampling=narrow_sampling)
 
     # Enhance kernel with found parameters
     pipe_run_best_first_selection['svm'].C = param_final['C']
@@ -255,6 +564,9 @@ def execute_narrow_search(config_path):
     dump(results_run2, open(results_run2_file_path, 'wb'))
     print("Stored results ", results_run2_file_path)
 
+    # The results are complete. The sub runs and the journal are not needed anymore
+    remove_checkpoints(results_run2_file_path, len(samples))
+
     result_save = results_run2.copy()
     #sup.list_to_name(selected_features, list(feature_dict.keys()), result_save['param_feat__cols'])
     results_run2.round(4).to_csv(results_run2_file_path + "_results.csv", sep=";")
@@ -268,6 +580,7 @@ def execute_narrow_search(config_path):
 
 
 if __name__ == "__main__":
+    args = parser.parse_args()
 
     # Execute narrow search
     execute_narrow_search(args.config_path)
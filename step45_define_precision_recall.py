@@ -31,12 +31,13 @@ import time
 
 # Libs
 from sklearn.metrics import f1_score, accuracy_score, precision_score, recall_score, roc_auc_score
-from sklearn.metrics import precision_recall_curve
 from sklearn.metrics import classification_report, confusion_matrix
 
-from sklearn.model_selection import train_test_split
+from sklearn.base import clone
+from sklearn.model_selection import train_test_split, StratifiedKFold
 
 import sklearn_utils as model_util
+import threshold_utils as thr
 
 import argparse
 from pandas.plotting import register_matplotlib_converters
@@ -48,6 +49,7 @@ import numpy as np
 import data_visualization_functions as vis
 import data_handling_support_functions as sup
 import execution_utils as exe
+import search_utils as search
 
 __author__ = 'Alexander Wendt'
 __copyright__ = 'Copyright 2020, Christian Doppler Laboratory for ' \
@@ -70,10 +72,12 @@ parser = argparse.ArgumentParser(description='Step 4 - Define precision/recall')
 parser.add_argument("-conf", '--config_path', default="config/debug_timedata_omxs30.ini",
                     help='Configuration file path', required=False)
 
-args = parser.parse_args()
 
-def get_optimal_precision_recall_threshold(X_train_full, y_train_full, y_classes, model_pipe, figure_path_prefix):
+def get_optimal_precision_recall_threshold(X_train_full, y_train_full, y_classes, model_pipe, figure_path_prefix,
+                                           objective='pr_break_even', beta=1.0, cost_fp=1.0, cost_fn=1.0):
     '''
+    Fit the model on a part of the training data and select the threshold of the decision function on the rest. The
+    threshold table of all thresholds is computed once with the scores sorted, see threshold_utils.
 
 
     args:
@@ -82,6 +86,10 @@ def get_optimal_precision_recall_threshold(X_train_full, y_train_full, y_classes
         y_classes: Class dict key number, value label
         model_pipe: Pipe of the model
         figure_path_prefix: Prefix path for saving images of the graphs
+        objective: Objective to select the threshold: pr_break_even, max_f_beta or min_cost. Default: pr_break_even
+        beta: Weight of the recall in the F-beta score. Default: 1.0
+        cost_fp: Cost of a false positive. Default: 1.0
+        cost_fn: Cost of a false negative. Default: 1.0
 
     return:
         optimal_threshold: Threshold calculated to be the optimum
@@ -102,7 +110,7 @@ def get_optimal_precision_recall_threshold(X_train_full, y_train_full, y_classes
     t = time.time()
     local_time = time.ctime(t)
     print("=== Start training the SVM at {} ===".format(local_time))
-    optclf = model_pipe.fit(X_train, y_train)
+    optclf = model_util.calibrate_probabilities(model_pipe.fit(X_train, y_train))
 
     print("Predict training data")
     y_trainsub_pred = optclf.predict(X_train.values)
@@ -119,17 +127,18 @@ def get_optimal_precision_recall_threshold(X_train_full, y_train_full, y_classes
 
     reduced_class_dict = model_util.reduce_classes(y_classes, y_val, y_val_pred)
 
-    vis.plot_precision_recall_evaluation(y_train, y_trainsub_pred, y_trainsub_pred_proba, reduced_class_dict, figure_path_prefix + "_training_data_")
-    vis.plot_precision_recall_evaluation(y_val, y_val_pred, y_val_pred_proba, reduced_class_dict, figure_path_prefix + "_validation_data_")
+    vis.plot_precision_recall_evaluation(y_train, y_trainsub_pred, y_trainsub_pred_proba, reduced_class_dict, save_fig_prefix=figure_path_prefix + "_training_data_")
+    vis.plot_precision_recall_evaluation(y_val, y_val_pred, y_val_pred_proba, reduced_class_dict, save_fig_prefix=figure_path_prefix + "_validation_data_")
 
-    precision, recall, thresholds = precision_recall_curve(y_val, y_val_pred_scores)
+    # Table of all thresholds with the confusion matrix, precision, recall, F-beta and cost
+    threshold_table = thr.get_threshold_table(y_val, y_val_pred_scores, beta=beta, cost_fp=cost_fp, cost_fn=cost_fn)
+    precision, recall, thresholds = thr.get_precision_recall_curve(threshold_table)
     # custom_threshold = 0.25
 
     # Get the optimal threshold
-    closest_zero_index = np.argmin(np.abs(precision - recall))
-    optimal_threshold = thresholds[closest_zero_index]
-    closest_zero_p = precision[closest_zero_index]
-    closest_zero_r = recall[closest_zero_index]
+    optimal_threshold, optimal_row = thr.select_threshold(threshold_table, objective)
+    print("Threshold of the objective {}: ".format(objective))
+    print(optimal_row)
 
     print("Optimal threshold value = {0:.2f}".format(optimal_threshold))
     y_val_pred_roc_adjusted = model_util.adjusted_classes(y_val_pred_scores, optimal_threshold)
@@ -140,14 +149,12 @@ def get_optimal_precision_recall_threshold(X_train_full, y_train_full, y_classes
                                            save_fig_prefix=figure_path_prefix)
     print("Optimal threshold value = {0:.2f}".format(optimal_threshold))
 
-    from sklearn.metrics import roc_curve, auc
-
-    fpr, tpr, auc_thresholds = roc_curve(y_val, y_val_pred_scores)
-    print("AUC without P/R adjustments: ", auc(fpr, tpr))  # AUC of ROC
+    fpr, tpr = thr.get_roc_curve(threshold_table)
+    print("AUC without P/R adjustments: ", thr.get_auc(fpr, tpr))  # AUC of ROC
     vis.plot_roc_curve(fpr, tpr, label='ROC', save_fig_prefix=figure_path_prefix + "_without adjustments_")
 
-    fpr, tpr, auc_thresholds = roc_curve(y_val, y_val_pred_roc_adjusted)
-    print("AUC with P/R adjustments: ", auc(fpr, tpr))  # AUC of ROC
+    fpr, tpr = thr.get_roc_curve(thr.get_threshold_table(y_val, y_val_pred_roc_adjusted))
+    print("AUC with P/R adjustments: ", thr.get_auc(fpr, tpr))  # AUC of ROC
     vis.plot_roc_curve(fpr, tpr, label='ROC', save_fig_prefix=figure_path_prefix + "_with adjustments_")
 
     print("Classification report without threshold adjustment.")
@@ -161,6 +168,78 @@ def get_optimal_precision_recall_threshold(X_train_full, y_train_full, y_classes
 
     return optimal_threshold
 
+def get_fold_decision_scores(model_pipe, X_train, y_train, X_test):
+    '''
+    Fit a model on the training part of a fold without probabilities and get the decision function of the test part
+
+    '''
+
+    fold_pipe = model_util.set_probability_mode(clone(model_pipe), 'none')
+    return fold_pipe.fit(X_train, y_train).decision_function(X_test)
+
+
+def get_cross_validated_threshold(X_train_full, y_train_full, model_pipe, figure_path_prefix, kfolds=5,
+                                  objective='pr_break_even', beta=1.0, cost_fp=1.0, cost_fn=1.0, n_jobs=-1):
+    '''
+    Select the threshold on the out-of-fold decision scores of a stratified k-fold cross validation instead of one
+    80/20 split. The folds are fitted in parallel without probabilities, so that the wall time on k cores is similar
+    to one fit. The threshold is selected on the pooled scores of all folds. The threshold of each fold on its own
+    scores shows how stable the threshold is.
+
+    args:
+        X_train_full: Trainingdaten X
+        y_train_full: Ground truth y
+        model_pipe: Pipe of the model
+        figure_path_prefix: Prefix path for saving images of the graphs
+        kfolds: Number of folds. Default: 5
+        objective: Objective to select the threshold: pr_break_even, max_f_beta or min_cost. Default: pr_break_even
+        beta: Weight of the recall in the F-beta score. Default: 1.0
+        cost_fp: Cost of a false positive. Default: 1.0
+        cost_fn: Cost of a false negative. Default: 1.0
+        n_jobs: Number of parallel fits. Default: -1 for all cores
+
+    return:
+        optimal_threshold: Threshold on the pooled out-of-fold scores
+        fold_thresholds: List of the thresholds of the single folds
+
+    '''
+
+    y_train_full = np.asarray(y_train_full)
+    splits = list(StratifiedKFold(n_splits=kfolds, shuffle=True, random_state=0).split(X_train_full, y_train_full))
+    print("=== Fit {} folds for the out-of-fold decision scores at {} ===".format(kfolds, time.ctime(time.time())))
+    fold_scores = search.run_ordered_parallel(
+        get_fold_decision_scores,
+        [(model_pipe, search.index_rows(X_train_full, train), y_train_full[train], search.index_rows(X_train_full, test))
+         for train, test in splits],
+        [len(train) for train, _ in splits], n_jobs)
+
+    y_scores = np.empty(y_train_full.shape[0])
+    fold_thresholds = []
+    for (_, test), scores in zip(splits, fold_scores):
+        y_scores[test] = scores
+        fold_table = thr.get_threshold_table(y_train_full[test], scores, beta=beta, cost_fp=cost_fp, cost_fn=cost_fn)
+        fold_thresholds.append(thr.select_threshold(fold_table, objective)[0])
+
+    threshold_table = thr.get_threshold_table(y_train_full, y_scores, beta=beta, cost_fp=cost_fp, cost_fn=cost_fn)
+    optimal_threshold, optimal_row = thr.select_threshold(threshold_table, objective)
+    print("Threshold of the objective {} on the pooled out-of-fold scores: ".format(objective))
+    print(optimal_row)
+    print("Thresholds of the folds: {}. Standard deviation {:.4f}".format(np.round(fold_thresholds, 4),
+                                                                        np.std(fold_thresholds)))
+
+    precision, recall, thresholds = thr.get_precision_recall_curve(threshold_table)
+    vis.plot_precision_recall_vs_threshold(precision, recall, thresholds, optimal_threshold,
+                                           title_prefix="Out-of-fold ", save_fig_prefix=figure_path_prefix)
+    fpr, tpr = thr.get_roc_curve(threshold_table)
+    print("Out-of-fold AUC: ", thr.get_auc(fpr, tpr))
+    vis.plot_roc_curve(fpr, tpr, label='ROC', save_fig_prefix=figure_path_prefix + "_out_of_fold_")
+
+    print("Classification report of the out-of-fold scores with threshold adjustment of {0:.4f}".format(
+        optimal_threshold))
+    print(classification_report(y_train_full, model_util.adjusted_classes(y_scores, optimal_threshold)))
+
+    return optimal_threshold, fold_thresholds
+
 def define_precision_recall_threshold(config_path):
     '''
     Load model data and training data. Check if the problem is a multiclass or single class,
@@ -211,6 +290,7 @@ def define_precision_recall_threshold(config_path):
         print("Created folder: ", result_directory + '/model_images')
 
     # Check if precision recall can be applied, i.e. it is a binary problem
+    fold_thresholds = None
     if len(y_classes) > 2:
         print("The problem is a multi class problem. No precision/recall optimization will be done.")
         optimal_threshold = 0
@@ -221,15 +301,37 @@ def define_precision_recall_threshold(config_path):
         # Load saved results
         r = open(svm_pipe_final_selection, "rb")
         model_pipe = pickle.load(r)
-        model_pipe['svm'].probability = True
-
-        optimal_threshold = get_optimal_precision_recall_threshold(X_train, y_train, y_classes, model_pipe, figure_path_prefix)
+        # The threshold only needs the decision function. Probabilities are only used for the plots
+        model_pipe = model_util.set_probability_mode(
+            model_pipe, config['Training'].get('probability_mode', 'platt'),
+            calibration_method=config['Training'].get('calibration_method', 'sigmoid'),
+            calibration_share=float(config['Training'].get('calibration_share', '0.1')))
+
+        # Objective and costs of the threshold selection
+        objective = config['Training'].get('pr_threshold_objective', 'pr_break_even')
+        beta = float(config['Training'].get('pr_threshold_beta', '1.0'))
+        cost_fp = float(config['Training'].get('pr_threshold_cost_fp', '1.0'))
+        cost_fn = float(config['Training'].get('pr_threshold_cost_fn', '1.0'))
+
+        # split selects the threshold on one 80/20 split, cv on the out-of-fold scores of parallel folds
+        if config['Training'].get('pr_threshold_mode', 'split') == 'cv':
+            optimal_threshold, fold_thresholds = get_cross_validated_threshold(
+                X_train, y_train, model_pipe, figure_path_prefix,
+                kfolds=int(config['Training'].get('pr_threshold_kfolds', '5')), objective=objective, beta=beta,
+                cost_fp=cost_fp, cost_fn=cost_fn)
+        else:
+            optimal_threshold = get_optimal_precision_recall_threshold(X_train, y_train, y_classes, model_pipe,
+                                                                       figure_path_prefix, objective=objective,
+                                                                       beta=beta, cost_fp=cost_fp, cost_fn=cost_fn)
 
     #Store optimal threshold
     # save the optimal precision/recall value to disk
     print("Save external parameters, precision recall threshold to disk")
     extern_param = {}
     extern_param['pr_threshold'] = optimal_threshold
+    if fold_thresholds is not None:
+        extern_param['pr_threshold_std'] = float(np.std(fold_thresholds))
+        extern_param['pr_threshold_folds'] = [float(t) for t in fold_thresholds]
     with open(svm_external_parameters_filename, 'w') as fp:
         json.dump(extern_param, fp)
 
@@ -237,6 +339,7 @@ def define_precision_recall_threshold(config_path):
 
 
 if __name__ == "__main__":
+    args = parser.parse_args()
 
     # Define precision/recall
     define_precision_recall_threshold(args.config_path)
@@ -42,6 +42,7 @@ import numpy as np
 #import data_vsualization_functions as vis
 import data_handling_support_functions as sup
 import execution_utils as exe
+import sklearn_utils as modelutil
 
 __author__ = 'Alexander Wendt'
 __copyright__ = 'Copyright 2020, Christian Doppler Laboratory for ' \
@@ -66,7 +67,6 @@ parser.add_argument("-conf", '--config_path', default="config/debug_timedata_omx
 parser.add_argument("-sec", '--config_section', default="Model",
                     help='Configuration section in config file', required=False)
 
-args = parser.parse_args()
 
 def load_data(conf, config_section="Model"):
     '''
@@ -129,8 +129,12 @@ def train_final_model(config_path, config_section="Evaluation"):
     #model_pipe['svm'].probability = True
     print("")
 
-    print("Set probability measurements in the model to True")
-    pipe['svm'].probability = True
+    # With probability_mode=lazy, the svm is fitted without the internal cross validation of the probabilities and
+    # a calibrator is fitted on the scores of the svm on a held out split after the training
+    print("Set probability measurements in the model")
+    pipe = modelutil.set_probability_mode(pipe, config['Training'].get('probability_mode', 'platt'),
+                                          calibration_method=config['Training'].get('calibration_method', 'sigmoid'),
+                                          calibration_share=float(config['Training'].get('calibration_share', '0.1')))
     print("Original final pipe: ", pipe)
 
     #Merge training and test data
@@ -147,6 +151,9 @@ def train_final_model(config_path, config_section="Evaluation"):
     t_end = time.time() - t
     print("Training took {0:.2f}s".format(t_end))
 
+    # The saved model has to predict probabilities for the evaluation
+    clf = modelutil.calibrate_probabilities(clf)
+
     print("Store model")
     print("Model to save: ", clf)
 
@@ -155,6 +162,7 @@ def train_final_model(config_path, config_section="Evaluation"):
 
 
 if __name__ == "__main__":
+    args = parser.parse_args()
 
     train_final_model(args.config_path, args.config_section)
 
@@ -32,7 +32,6 @@ import time
 # Libs
 import json
 import joblib
-from sklearn.metrics import precision_recall_curve
 import sklearn_utils as model_util
 import argparse
 from pandas.plotting import register_matplotlib_converters
@@ -44,6 +43,7 @@ import data_visualization_functions as vis
 import data_handling_support_functions as sup
 import execution_utils as exe
 import evaluation_utils as eval
+import threshold_utils as thr
 
 __author__ = 'Alexander Wendt'
 __copyright__ = 'Copyright 2020, Christian Doppler Laboratory for ' \
@@ -68,7 +68,6 @@ parser.add_argument("-conf", '--config_path', default="config/debug_timedata_omx
 parser.add_argument("-sec", '--config_section', default="Evaluation",
                     help='Configuration section in config file', required=False)
 
-args = parser.parse_args()
 
 # def load_evaluation_data(conf):
 #     '''
@@ -150,7 +149,7 @@ def evaluate_model(config_path, config_section="Evaluation"):
     # Plot the precision and the recall together with the selected value for the test set
     if len(y_classes) == 2:
         print("Plot precision recall graphs")
-        precision, recall, thresholds = precision_recall_curve(y_val, y_test_pred_scores)
+        precision, recall, thresholds = thr.get_precision_recall_curve(thr.get_threshold_table(y_val, y_test_pred_scores))
         vis.plot_precision_recall_vs_threshold(precision, recall, thresholds, pr_threshold, title_prefix=title + "_", save_fig_prefix=figure_path_prefix)
 
     #Plot evaluation
@@ -167,6 +166,7 @@ def evaluate_model(config_path, config_section="Evaluation"):
 
 
 if __name__ == "__main__":
+    args = parser.parse_args()
     evaluate_model(args.config_path, args.config_section)
 
 
@@ -67,7 +67,6 @@ parser.add_argument("-conf", '--config_path', default="config/debug_timedata_omx
 parser.add_argument("-sec", '--config_section', default="Evaluation",
                     help='Configuration section in config file', required=False)
 
-args = parser.parse_args()
 
 
 def visualize_temporal_data(config_path, config_section):
@@ -109,7 +108,7 @@ def visualize_temporal_data(config_path, config_section):
     y_test_pred_adjust = model_util.adjusted_classes(y_test_pred_scores, pr_threshold)
 
     # Load original data for visualization
-    df_time_graph = pd.read_csv(source_path, delimiter=';').set_index('id')
+    df_time_graph = sup.read_csv_cached(source_path, sep=';').set_index('id')
     df_time_graph['Date'] = pd.to_datetime(df_time_graph['Date'])
     df_time_graph['Date'].apply(mdates.date2num)
     print("Loaded feature names for time graph={}".format(df_time_graph.columns))
@@ -147,6 +146,7 @@ def visualize_temporal_data(config_path, config_section):
 
 
 if __name__ == "__main__":
+    args = parser.parse_args()
     visualize_temporal_data(args.config_path, args.config_section)
 
     print("=== Program end ===")
\ No newline at end of file
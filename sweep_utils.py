@@ -0,0 +1,341 @@
+import configparser
+import json
+import os
+import subprocess
+import sys
+import time
+
+import pandas as pd
+
+import data_handling_support_functions as sup
+from filepaths import Paths
+
+try:
+    import resource
+except ImportError:
+    # Memory limits are only supported on Linux and other unix systems
+    resource = None
+
+# Sections and options of a sweep manifest
+# [Sweep]
+# base_config: Configuration file, which is expanded for each job
+# sweep_directory: Directory of the job configurations, logs and the summary
+# pipeline: Pipeline to run for each job, training or inference
+# steps: Step selection, e.g. 20-61. Empty for all steps
+# debug: Use debug parameters
+# max_jobs: Maximum number of jobs, which run at the same time
+# cpus_per_job: Number of cpu cores of each job. The job is bound to these cores
+# memory_per_job: Maximum memory of each job in MB. 0 for no limit
+# summary_out: File name of the summary table in the sweep directory
+# [Tickers]
+# <ticker name>=<path of the raw data>
+# [Targets]
+# class_names: Json list of target columns, e.g. ["1dTrend", "LongTrend"]
+# binarizations: Json list of dicts with the binarization options of the section Common, e.g.
+# [{"binarize_labels": "True", "class_number": "1"}, {"binarize_labels": "False"}]
+
+# Directories of the base configuration, which get a separate copy for each job, and their names in the job directory
+JOB_DIRECTORIES = {'prepared_data_directory': 'data_prepared', 'result_directory': 'results', 'model_directory': 'models'}
+
+
+class SweepJob:
+    '''
+    One pipeline run of a sweep with its own configuration file and directories
+
+    '''
+
+    def __init__(self, name, config_path, ticker, class_name, binarization):
+        self.name = name
+        self.config_path = config_path
+        self.ticker = ticker
+        self.class_name = class_name
+        self.binarization = binarization
+        self.process = None
+        self.log_file = None
+        self.cpus = []
+        self.start_time = None
+        self.duration = None
+        self.returncode = None
+
+
+def get_job_name(ticker, class_name, binarization):
+    '''
+    Get a unique job name from the ticker, the target column and the binarization options
+
+    '''
+
+    name = ticker + "_" + class_name
+    if binarization.get('binarize_labels', 'False') == 'True':
+        name += "_bin" + binarization.get('class_number', '')
+
+    return name
+
+
+def create_job_config(base_config, sweep_directory, ticker, source_path, class_name, binarization):
+    '''
+    Create the configuration of a job from the base configuration. The dataset name gets the ticker, the source path,
+    target and binarization are set and the prepared data, result and model directories are moved into the job
+    directory. All options, which refer to these directories, e.g. in the sections Model and Evaluation, are adapted too.
+
+    :args:
+        base_config: Base configuration as ConfigParser
+        sweep_directory: Directory of the sweep
+        ticker: Ticker name
+        source_path: Path of the raw data of the ticker
+        class_name: Target column
+        binarization: Dict with options of the section Common
+    :return:
+        config: Configuration of the job as ConfigParser
+        job_name: Name of the job
+    '''
+
+    job_name = get_job_name(ticker, class_name, binarization)
+    job_directory = os.path.join(sweep_directory, job_name)
+
+    config = configparser.ConfigParser()
+    config.read_dict(base_config)
+
+    config['Common']['dataset_name'] = base_config['Common'].get('dataset_name') + "_" + ticker
+    config['Common']['class_name'] = class_name
+    for option, value in binarization.items():
+        config['Common'][option] = str(value)
+    config['Paths']['source_path'] = source_path
+
+    # Replace the longest directories first, in case one directory is the prefix of another
+    directories = sorted([(base_config['Paths'].get(d), name) for d, name in JOB_DIRECTORIES.items()],
+                         key=lambda x: -len(x[0]))
+    for section in config.sections():
+        for option, value in config[section].items():
+            for old_directory, directory_name in directories:
+                if value.startswith(old_directory):
+                    value = os.path.join(job_directory, directory_name) + value[len(old_directory):]
+                    break
+            config[section][option] = value
+
+    return config, job_name
+
+
+def expand_manifest(manifest_path):
+    '''
+    Expand the base configuration of a sweep manifest over tickers, target columns and binarization options and save
+    a configuration file for each job
+
+    :args:
+        manifest_path: Path of the sweep manifest
+    :return:
+        manifest: Manifest as ConfigParser
+        jobs: List of SweepJob
+    '''
+
+    manifest = sup.load_config(manifest_path)
+    base_config = sup.load_config(manifest['Sweep'].get('base_config'))
+    sweep_directory = manifest['Sweep'].get('sweep_directory')
+    class_names = json.loads(manifest['Targets'].get('class_names'))
+    binarizations = json.loads(manifest['Targets'].get('binarizations', '[{}]'))
+
+    jobs = []
+    for ticker, source_path in manifest['Tickers'].items():
+        for class_name in class_names:
+            for binarization in binarizations:
+                config, job_name = create_job_config(base_config, sweep_directory, ticker, source_path, class_name,
+                                                     binarization)
+                job_directory = os.path.join(sweep_directory, job_name)
+                if not os.path.isdir(job_directory):
+                    os.makedirs(job_directory)
+                config_path = os.path.join(job_directory, job_name + ".ini")
+                with open(config_path, 'w') as f:
+                    config.write(f)
+                jobs.append(SweepJob(job_name, config_path, ticker, class_name, binarization))
+
+    print("Expanded sweep {} to {} jobs".format(manifest_path, len(jobs)))
+
+    return manifest, jobs
+
+
+def get_job_limits(cpus, memory_mb):
+    '''
+    Get a function, which binds the job process to its cpus and limits its memory. It is called in the child process
+    before the job starts.
+
+    :args:
+        cpus: List of cpu cores for the job
+        memory_mb: Maximum address space in MB. 0 for no limit
+    :return:
+        set_limits: Function without arguments
+    '''
+
+    def set_limits():
+        if hasattr(os, 'sched_setaffinity'):
+            os.sched_setaffinity(0, cpus)
+        if resource is not None and memory_mb > 0:
+            memory = memory_mb * 1024 * 1024
+            resource.setrlimit(resource.RLIMIT_AS, (memory, memory))
+
+    return set_limits
+
+
+def start_job(job, manifest, cpus):
+    '''
+    Start the pipeline of a job in a new process with toolbox.py. The output is written to a log file in the job
+    directory.
+
+    :args:
+        job: SweepJob
+        manifest: Sweep manifest
+        cpus: List of cpu cores for the job
+    :return:
+        Nothing
+    '''
+
+    toolbox_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'toolbox.py')
+    command = [sys.executable, toolbox_path, 'run', '--config_path', job.config_path,
+               '--pipeline', manifest['Sweep'].get('pipeline', 'training')]
+    steps = manifest['Sweep'].get('steps', '')
+    if steps != '':
+        command.extend(['--steps', steps])
+    if manifest['Sweep'].getboolean('debug', False):
+        command.append('-debug')
+
+    # Libraries with own thread pools only use the cores of the job
+    env = dict(os.environ)
+    for variable in ['OMP_NUM_THREADS', 'OPENBLAS_NUM_THREADS', 'MKL_NUM_THREADS']:
+        env[variable] = str(len(cpus))
+
+    log_file = open(os.path.join(os.path.dirname(job.config_path), job.name + ".log"), 'w')
+    preexec_fn = get_job_limits(cpus, manifest['Sweep'].getint('memory_per_job', 0)) if os.name == 'posix' else None
+    job.process = subprocess.Popen(command, stdout=log_file, stderr=subprocess.STDOUT, env=env, preexec_fn=preexec_fn)
+    job.log_file = log_file
+    job.cpus = cpus
+    job.start_time = time.time()
+    print("Started job {} on cpus {}: {}".format(job.name, cpus, " ".join(command)))
+
+
+def run_jobs(jobs, manifest):
+    '''
+    Run the jobs on a local queue. At most max_jobs jobs run at the same time and each job gets its own cpu cores.
+
+    :args:
+        jobs: List of SweepJob
+        manifest: Sweep manifest
+    :return:
+        Nothing
+    '''
+
+    cpus_per_job = manifest['Sweep'].getint('cpus_per_job', 1)
+    if hasattr(os, 'sched_getaffinity'):
+        available_cpus = sorted(os.sched_getaffinity(0))
+    else:
+        available_cpus = list(range(os.cpu_count()))
+    cpus_per_job = min(cpus_per_job, len(available_cpus))
+    max_jobs = min(manifest['Sweep'].getint('max_jobs', 1), len(available_cpus) // cpus_per_job)
+    free_cpu_sets = [available_cpus[i * cpus_per_job:(i + 1) * cpus_per_job] for i in range(max_jobs)]
+    print("Run {} jobs with at most {} jobs at the same time and {} cpus per job".format(len(jobs), max_jobs,
+                                                                                         cpus_per_job))
+
+    queue = list(jobs)
+    running = []
+    while queue or running:
+        while queue and free_cpu_sets:
+            job = queue.pop(0)
+            start_job(job, manifest, free_cpu_sets.pop(0))
+            running.append(job)
+
+        time.sleep(1)
+        for job in list(running):
+            if job.process.poll() is not None:
+                job.returncode = job.process.returncode
+                job.duration = time.time() - job.start_time
+                job.log_file.close()
+                free_cpu_sets.append(job.cpus)
+                running.remove(job)
+                print("Finished job {} with return code {} in {:.1f}s".format(job.name, job.returncode,
+                                                                             job.duration))
+
+
+def collect_job_results(job):
+    '''
+    Collect the results of a finished job: best cross validation score of the narrow search, precision/recall
+    threshold and the validation scores of step60. Results, which the job did not write, are listed in the column
+    missing_results and the status of the job is failed for a return code other than 0 and incomplete for missing
+    results.
+
+    :args:
+        job: SweepJob
+    :return:
+        result: Dict with the job settings and results
+    '''
+
+    result = {'job': job.name, 'ticker': job.ticker, 'class_name': job.class_name,
+              'binarization': json.dumps(job.binarization), 'returncode': job.returncode, 'duration': job.duration}
+
+    config = sup.load_config(job.config_path)
+    refit_scorer_name = config['Training'].get('refit_scorer_name')
+    paths = Paths(config).path
+    missing_results = []
+
+    run2_results_path = paths['svm_run2_result_filename'] + "_results.csv"
+    if os.path.isfile(run2_results_path):
+        run2_results = pd.read_csv(run2_results_path, sep=';')
+        result['cv_' + refit_scorer_name] = run2_results['mean_test_' + refit_scorer_name].iloc[0]
+    else:
+        result['cv_' + refit_scorer_name] = None
+        missing_results.append('cv_' + refit_scorer_name)
+
+    ext_param_path = os.path.join(config['Paths'].get('model_directory'), config['Training'].get('ext_param_out'))
+    if os.path.isfile(ext_param_path):
+        with open(ext_param_path, 'r') as fp:
+            result['pr_threshold'] = json.load(fp)['pr_threshold']
+    else:
+        result['pr_threshold'] = None
+        missing_results.append('pr_threshold')
+
+    for section in ['EvaluationTraining', 'Evaluation']:
+        report_path = os.path.join(config['Paths'].get('result_directory'), 'model_images',
+                                   config[section].get('title') + "__classification_report.csv")
+        if os.path.isfile(report_path):
+            report = pd.read_csv(report_path, index_col=0)
+            result[section + '_accuracy'] = report.loc['accuracy'].iloc[0]
+            result[section + '_f1_macro'] = report.loc['macro avg', 'f1-score']
+        else:
+            result[section + '_accuracy'] = None
+            result[section + '_f1_macro'] = None
+            missing_results.extend([section + '_accuracy', section + '_f1_macro'])
+
+    if job.returncode != 0:
+        result['status'] = 'failed'
+    elif missing_results:
+        result['status'] = 'incomplete'
+    else:
+        result['status'] = 'ok'
+    result['missing_results'] = ", ".join(missing_results)
+
+    return result
+
+
+def run_sweep(manifest_path):
+    '''
+    Expand a sweep manifest to jobs, run them on the local job queue and collect the results into one summary table
+
+    :args:
+        manifest_path: Path of the sweep manifest
+    :return:
+        summary: Data frame with one row per job
+    '''
+
+    manifest, jobs = expand_manifest(manifest_path)
+    run_jobs(jobs, manifest)
+
+    summary = pd.DataFrame([collect_job_results(job) for job in jobs])
+    summary_path = os.path.join(manifest['Sweep'].get('sweep_directory'),
+                                manifest['Sweep'].get('summary_out', 'sweep_summary.csv'))
+    summary.to_csv(summary_path, sep=';', index=False)
+    print(summary)
+    print("Stored sweep summary to ", summary_path)
+
+    for job, status, missing_results in zip(jobs, summary['status'], summary['missing_results']):
+        if status != 'ok':
+            print("Job {} is {} with return code {}. Missing results: {}. See the log {}".format(
+                job.name, status, job.returncode, missing_results if missing_results else "none",
+                os.path.join(os.path.dirname(job.config_path), job.name + ".log")))
+
+    return summary
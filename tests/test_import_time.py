@@ -0,0 +1,24 @@
+import pytest
+
+import pipeline_utils
+
+# Libraries of the entry points, which are not in every environment, e.g. pandas_ta is only needed for the features of
+# step21. Entry points are skipped, if one of their libraries is missing, instead of counting as budget violation.
+OPTIONAL_DEPENDENCIES = {
+    'step21_generate_features': ['pandas_ta'],
+}
+
+
+@pytest.mark.parametrize('module_name', sorted(pipeline_utils.IMPORT_TIME_BUDGETS))
+def test_import_time_within_budget(module_name):
+    '''
+    The entry points must be importable within their import time budget of pipeline_utils.IMPORT_TIME_BUDGETS
+
+    '''
+
+    for dependency in OPTIONAL_DEPENDENCIES.get(module_name, []):
+        pytest.importorskip(dependency)
+
+    violations = pipeline_utils.check_import_times({module_name: pipeline_utils.IMPORT_TIME_BUDGETS[module_name]})
+
+    assert violations == [], "{} exceeds its import time budget or cannot be imported".format(module_name)
@@ -0,0 +1,266 @@
+import numpy as np
+import pytest
+from sklearn.datasets import make_classification
+from sklearn.metrics import accuracy_score, f1_score, make_scorer
+from sklearn.model_selection import GridSearchCV, StratifiedKFold
+from sklearn.pipeline import Pipeline
+from sklearn.preprocessing import MinMaxScaler, StandardScaler
+from sklearn.svm import SVC
+
+import search_utils as search
+import sklearn_utils as modelutil
+
+SCORERS = {'f1': make_scorer(f1_score), 'accuracy': make_scorer(accuracy_score)}
+
+
+def get_data(n_samples=240, random_state=0):
+    return make_classification(n_samples=n_samples, n_features=6, n_informative=4, n_redundant=0, class_sep=1.0,
+                               random_state=random_state)
+
+
+def get_pipe():
+    return Pipeline([('scaler', StandardScaler()), ('sampling', 'passthrough'),
+                     ('feat', modelutil.ColumnExtractor(cols=[0, 1, 2, 3, 4, 5])), ('svm', SVC())])
+
+
+def get_candidates():
+    '''
+    Candidates with several prefixes, i.e. scalers and feature sets, and linear candidates with different gamma values,
+    which are the same model after canonicalization
+
+    '''
+
+    candidates = []
+    for scaler in [StandardScaler(), MinMaxScaler()]:
+        for cols in [[0, 1, 2, 3], [0, 1, 2, 3, 4, 5]]:
+            for C in [0.1, 1.0, 10.0]:
+                candidates.append({'scaler': scaler, 'feat__cols': cols, 'svm__kernel': 'rbf', 'svm__C': C,
+                                   'svm__gamma': 0.1})
+                for gamma in [0.01, 1.0]:
+                    candidates.append({'scaler': scaler, 'feat__cols': cols, 'svm__kernel': 'linear', 'svm__C': C,
+                                       'svm__gamma': gamma})
+
+    return candidates
+
+
+def get_cv():
+    return StratifiedKFold(n_splits=3, shuffle=True, random_state=3)
+
+
+@pytest.mark.parametrize('precompute_kernel', [False, True])
+def test_journaled_search_matches_grid_search(precompute_kernel):
+    '''
+    Canonicalization and the prefix cache must give the same fold scores, ranks and best candidate as GridSearchCV
+
+    '''
+
+    X, y = get_data()
+    candidates = get_candidates()
+
+    search_run = search.JournaledSearchCV(get_pipe(), candidates, SCORERS, 'f1', get_cv(), n_jobs=1,
+                                          precompute_kernel=precompute_kernel).fit(X, y)
+    grid_run = GridSearchCV(get_pipe(), [{name: [value] for name, value in params.items()} for params in candidates],
+                            scoring=SCORERS, refit='f1', cv=get_cv(), n_jobs=1, return_train_score=True).fit(X, y)
+
+    assert search_run.n_removed_fits_ == 12 * 3
+    for score_set in ['test', 'train']:
+        for name in SCORERS.keys():
+            for fold in range(3):
+                column = 'split{}_{}_{}'.format(fold, score_set, name)
+                np.testing.assert_allclose(search_run.cv_results_[column], grid_run.cv_results_[column], atol=1e-12)
+    np.testing.assert_array_equal(search_run.cv_results_['rank_test_f1'], grid_run.cv_results_['rank_test_f1'])
+    assert search_run.best_index_ == grid_run.best_index_
+    assert search_run.best_score_ == pytest.approx(grid_run.best_score_)
+
+
+def test_pruning_keeps_the_true_top_k():
+    '''
+    Pruning must never drop a candidate of the true top k of the full search on a case with hopeless candidates
+
+    '''
+
+    X, y = get_data(n_samples=300, random_state=1)
+    top_k = 3
+    candidates = [{'svm__C': C, 'svm__gamma': gamma} for C in [1e-4, 1e-3, 0.1, 1.0, 10.0, 100.0]
+                  for gamma in [1e-4, 0.01, 0.1, 1.0, 100.0]]
+    pipe = Pipeline([('scaler', StandardScaler()), ('svm', SVC(kernel='rbf'))])
+
+    full_run = search.JournaledSearchCV(pipe, candidates, SCORERS, 'f1', StratifiedKFold(n_splits=5, shuffle=True,
+                                                                                        random_state=3),
+                                        n_jobs=1, prefix_end='svm').fit(X, y)
+    pruned_run = search.JournaledSearchCV(pipe, candidates, SCORERS, 'f1', StratifiedKFold(n_splits=5, shuffle=True,
+                                                                                          random_state=3),
+                                          n_jobs=1, prefix_end='svm', prune_top_k=top_k).fit(X, y)
+
+    full_means = full_run.cv_results_['mean_test_f1']
+    true_top_k = np.argsort(-full_means, kind='stable')[:top_k]
+    pruned = pruned_run.cv_results_['pruned']
+
+    assert pruned.sum() > 0
+    assert not pruned[true_top_k].any()
+    np.testing.assert_allclose(pruned_run.cv_results_['mean_test_f1'][~pruned], full_means[~pruned])
+    assert pruned_run.best_index_ == full_run.best_index_
+
+
+def test_trial_store_round_trip(tmp_path, monkeypatch):
+    '''
+    The trials of a search are saved in the trial store, a repeated search fits nothing and the stored results are the
+    results of the search
+
+    '''
+
+    X, y = get_data()
+    candidates = get_candidates()
+    trial_store_path = str(tmp_path / "trials.sqlite")
+
+    first_run = search.JournaledSearchCV(get_pipe(), candidates, SCORERS, 'f1', get_cv(), n_jobs=1,
+                                         trial_store_path=trial_store_path).fit(X, y)
+
+    store = search.TrialStore(trial_store_path)
+    searches = store.get_searches()
+    assert list(searches['search']) == [first_run.search_key_]
+    assert searches['trials'].iloc[0] == (len(candidates) - 12) * 3
+    records = store.load(first_run.search_key_)
+    assert len(records) == (len(candidates) - 12) * 3
+
+    stored_results = store.get_cv_results(first_run.search_key_)
+    stored_means = dict(zip([search.get_candidate_key(search.get_canonical_params(params, get_pipe()))
+                             for params in stored_results['params']], stored_results['mean_test_f1']))
+    for params, mean in zip(candidates, first_run.cv_results_['mean_test_f1']):
+        assert stored_means[search.get_candidate_key(search.get_canonical_params(params, get_pipe()))] == mean
+
+    # The repeated search takes all fits from the store and does not dispatch any fit
+    def run_no_tasks(function, task_args, *args, **kwargs):
+        assert len(task_args) == 0
+        return []
+
+    monkeypatch.setattr(search, 'run_ordered_parallel', run_no_tasks)
+    second_run = search.JournaledSearchCV(get_pipe(), candidates, SCORERS, 'f1', get_cv(), n_jobs=1,
+                                          trial_store_path=trial_store_path, refit_best=False).fit(X, y)
+    assert second_run.search_key_ == first_run.search_key_
+    for name in ['mean_test_f1', 'mean_train_accuracy', 'rank_test_f1']:
+        np.testing.assert_array_equal(second_run.cv_results_[name], first_run.cv_results_[name])
+
+
+def test_successive_halving_last_rung_is_a_full_search():
+    '''
+    The last rung of the successive halving search evaluates the kept candidates on all samples, i.e. its results are
+    the ones of a search on the whole data with these candidates
+
+    '''
+
+    X, y = get_data(n_samples=270)
+    candidates = [{'svm__C': C, 'svm__gamma': gamma} for C in [0.1, 1.0, 10.0] for gamma in [0.01, 0.1, 1.0]]
+    pipe = Pipeline([('scaler', StandardScaler()), ('svm', SVC(kernel='rbf'))])
+
+    assert search.get_rung_sizes(len(candidates), 30, 270, 3) == [30, 90, 270]
+
+    halving_run = search.SuccessiveHalvingSearchCV(pipe, candidates, SCORERS, 'f1', get_cv(), factor=3, min_samples=30,
+                                                   n_jobs=1, prefix_end='svm').fit(X, y)
+    assert [rung['n_candidates'] for rung in halving_run.rung_results_] == [9, 3, 1]
+
+    kept_candidates = halving_run.cv_results_['params']
+    full_run = search.JournaledSearchCV(pipe, kept_candidates, SCORERS, 'f1', get_cv(), n_jobs=1,
+                                        prefix_end='svm').fit(X, y)
+    np.testing.assert_array_equal(halving_run.cv_results_['mean_test_f1'], full_run.cv_results_['mean_test_f1'])
+    assert halving_run.best_params_ == full_run.best_params_
+
+
+def test_shared_resampling_matches_grid_search():
+    '''
+    Fitting the samplers of a fold together with a shared neighbour cache must give the scores of GridSearchCV
+
+    '''
+
+    from imblearn.combine import SMOTEENN
+    from imblearn.over_sampling import SMOTE
+    from imblearn.pipeline import Pipeline as ImbalancedPipeline
+
+    X, y = make_classification(n_samples=300, n_features=6, weights=[0.75], random_state=0)
+    pipe = ImbalancedPipeline([('scaler', StandardScaler()), ('sampling', 'passthrough'),
+                               ('feat', modelutil.ColumnExtractor(cols=[0, 1, 2, 3, 4, 5])), ('svm', SVC())])
+    candidates = [{'scaler': scaler, 'sampling': sampler, 'svm__C': C}
+                  for scaler in [StandardScaler(), MinMaxScaler()]
+                  for sampler in ['passthrough', SMOTE(random_state=1), SMOTEENN(random_state=1)] for C in [1.0, 10.0]]
+
+    search_run = search.JournaledSearchCV(pipe, candidates, SCORERS, 'f1', get_cv(), n_jobs=1).fit(X, y)
+    grid_run = GridSearchCV(pipe, [{name: [value] for name, value in params.items()} for params in candidates],
+                            scoring=SCORERS, refit='f1', cv=get_cv(), n_jobs=1).fit(X, y)
+
+    np.testing.assert_allclose(search_run.cv_results_['mean_test_f1'], grid_run.cv_results_['mean_test_f1'])
+    np.testing.assert_array_equal(search_run.cv_results_['rank_test_f1'], grid_run.cv_results_['rank_test_f1'])
+
+
+def test_liblinear_is_close_to_libsvm_and_skips_multiclass():
+    '''
+    liblinear must give about the scores of libsvm for binary targets and multiclass targets must be fitted with
+    libsvm, i.e. with the scores and the search key of the search without liblinear
+
+    '''
+
+    candidates = [{'svm__kernel': 'linear', 'svm__C': C} for C in [0.01, 0.1, 1.0]]
+    pipe = Pipeline([('scaler', StandardScaler()), ('svm', SVC())])
+
+    X, y = get_data()
+    libsvm_run = search.JournaledSearchCV(pipe, candidates, SCORERS, 'f1', get_cv(), n_jobs=1,
+                                          prefix_end='svm').fit(X, y)
+    liblinear_run = search.JournaledSearchCV(pipe, candidates, SCORERS, 'f1', get_cv(), n_jobs=1, prefix_end='svm',
+                                             liblinear=True).fit(X, y)
+    assert liblinear_run.search_key_ != libsvm_run.search_key_
+    assert len(liblinear_run.liblinear_checks_) == 1
+    np.testing.assert_allclose(liblinear_run.cv_results_['mean_test_accuracy'],
+                               libsvm_run.cv_results_['mean_test_accuracy'], atol=0.03)
+
+    X, y = make_classification(n_samples=240, n_features=6, n_informative=4, n_classes=3, random_state=0)
+    scorers = {'accuracy': make_scorer(accuracy_score)}
+    libsvm_run = search.JournaledSearchCV(pipe, candidates, scorers, 'accuracy', get_cv(), n_jobs=1,
+                                          prefix_end='svm').fit(X, y)
+    liblinear_run = search.JournaledSearchCV(pipe, candidates, scorers, 'accuracy', get_cv(), n_jobs=1,
+                                             prefix_end='svm', liblinear=True).fit(X, y)
+    assert liblinear_run.search_key_ == libsvm_run.search_key_
+    assert len(liblinear_run.liblinear_checks_) == 0
+    np.testing.assert_array_equal(liblinear_run.cv_results_['mean_test_accuracy'],
+                                  libsvm_run.cv_results_['mean_test_accuracy'])
+
+
+def test_nested_folds_reuse_the_folds_of_carried_candidates():
+    '''
+    The folds of an earlier stage of NestedFolds must have the same samples in the later stages, so that a carried
+    candidate keeps its scores on them and is only fitted on the folds of the new stage
+
+    '''
+
+    X, y = get_data(n_samples=300)
+    pipe = Pipeline([('scaler', StandardScaler()), ('svm', SVC(kernel='rbf'))])
+    order = search.get_stratified_order(y)
+
+    first_folds = search.NestedFolds([120], [3])
+    second_folds = search.NestedFolds([120, 300], [3, 2])
+    assert second_folds.get_n_splits() == 5
+    first_splits = list(first_folds.split())
+    second_splits = list(second_folds.split())
+    for (train, test), (train_2, test_2) in zip(first_splits, second_splits[:3]):
+        np.testing.assert_array_equal(order[:300][train], order[:120][train_2])
+        np.testing.assert_array_equal(order[:300][test], order[:120][test_2])
+
+    carried = [{'svm__C': 1.0, 'svm__gamma': 0.1}]
+    first_run = search.JournaledSearchCV(pipe, carried, SCORERS, 'f1', first_folds, n_jobs=1,
+                                         prefix_end='svm').fit(X[order[:120]], y[order[:120]])
+    carried_records = dict(first_run.records_)
+
+    new = [{'svm__C': 10.0, 'svm__gamma': 0.01}]
+    second_run = search.JournaledSearchCV(pipe, carried + new, SCORERS, 'f1', second_folds, n_jobs=1,
+                                          prefix_end='svm', carried_records=carried_records).fit(X[order[:300]],
+                                                                                                 y[order[:300]])
+    full_run = search.JournaledSearchCV(pipe, carried + new, SCORERS, 'f1', second_folds, n_jobs=1,
+                                        prefix_end='svm').fit(X[order[:300]], y[order[:300]])
+
+    for fold in range(5):
+        column = 'split{}_test_f1'.format(fold)
+        np.testing.assert_allclose(second_run.cv_results_[column], full_run.cv_results_[column])
+    np.testing.assert_array_equal(second_run.cv_results_['split0_test_f1'][:1], first_run.cv_results_['split0_test_f1'])
+    # The carried candidate is only fitted on the folds of the new stage
+    carried_key = search.get_candidate_key(carried[0])
+    for fold in range(3):
+        assert second_run.records_[(carried_key, fold)] is carried_records[(carried_key, fold)]
+    assert (carried_key, 3) not in carried_records and (carried_key, 3) in second_run.records_
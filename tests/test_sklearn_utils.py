@@ -0,0 +1,37 @@
+import copy
+import pickle
+
+import numpy as np
+import pytest
+from sklearn.datasets import make_classification
+from sklearn.linear_model import LogisticRegression
+from sklearn.svm import SVC
+
+import sklearn_utils as modelutil
+
+
+def test_lazy_calibration_uses_the_held_out_scores_of_the_model():
+    '''
+    The calibrator must be fitted on the decision function of the calibrated model on the held out split, only when
+    calibrate is called, and copies or pickles must not fit it
+
+    '''
+
+    X, y = make_classification(n_samples=400, n_features=6, n_informative=4, random_state=0)
+    clf = modelutil.LazyCalibratedClassifier(SVC(kernel='rbf'), calibration_share=0.25).fit(X, y)
+    X_calibration, y_calibration = clf._X_calibration, clf._y_calibration
+    assert X_calibration.shape[0] == 100
+    # The held out samples are not in the training data of the classifier
+    assert clf.estimator_.shape_fit_[0] == 300
+
+    copied = pickle.loads(pickle.dumps(copy.deepcopy(clf)))
+    assert copied.calibrators_ is None and clf.calibrators_ is None
+    with pytest.raises(Exception):
+        clf.predict_proba(X)
+
+    clf.calibrate()
+    expected = LogisticRegression(C=1e6).fit(clf.decision_function(X_calibration)[:, np.newaxis], y_calibration)
+    np.testing.assert_allclose(clf.predict_proba(X)[:, 1],
+                               expected.predict_proba(clf.decision_function(X)[:, np.newaxis])[:, 1])
+    assert clf._X_calibration is None
+    np.testing.assert_allclose(pickle.loads(pickle.dumps(clf)).predict_proba(X), clf.predict_proba(X))
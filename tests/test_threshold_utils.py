@@ -0,0 +1,59 @@
+import numpy as np
+import pytest
+from sklearn.metrics import precision_recall_curve, roc_auc_score, roc_curve
+
+import threshold_utils as thresholds
+
+
+def get_scores(n_samples=500, random_state=0):
+    '''
+    Binary labels and scores with ties, as the decision function of a model has on discrete features
+
+    '''
+
+    rng = np.random.RandomState(random_state)
+    y_true = rng.randint(0, 2, n_samples)
+    y_scores = np.round(y_true + rng.normal(scale=1.0, size=n_samples), 1)
+
+    return y_true, y_scores
+
+
+@pytest.mark.parametrize('random_state', [0, 1, 2])
+def test_threshold_table_matches_precision_recall_curve(random_state):
+    '''
+    The precision recall curve of the threshold table must be the curve of sklearn precision_recall_curve
+
+    '''
+
+    y_true, y_scores = get_scores(random_state=random_state)
+    table = thresholds.get_threshold_table(y_true, y_scores)
+
+    precision, recall, threshold_values = thresholds.get_precision_recall_curve(table)
+    expected_precision, expected_recall, expected_thresholds = precision_recall_curve(y_true, y_scores)
+
+    np.testing.assert_array_equal(threshold_values, expected_thresholds)
+    np.testing.assert_allclose(precision, expected_precision)
+    np.testing.assert_allclose(recall, expected_recall)
+
+
+def test_threshold_table_counts_and_roc():
+    '''
+    The confusion matrix of each threshold must be the one of apply_threshold and the roc curve must be the curve of
+    sklearn roc_curve
+
+    '''
+
+    y_true, y_scores = get_scores(random_state=3)
+    table = thresholds.get_threshold_table(y_true, y_scores, cost_fp=1.0, cost_fn=5.0)
+
+    for _, row in table.iloc[::7].iterrows():
+        y_pred = thresholds.apply_threshold(y_scores, row['threshold'])
+        assert row['tp'] == np.sum((y_pred == 1) & (y_true == 1))
+        assert row['fp'] == np.sum((y_pred == 1) & (y_true == 0))
+        assert row['cost'] == row['fp'] + 5.0 * row['fn']
+
+    fpr, tpr = thresholds.get_roc_curve(table)
+    expected_fpr, expected_tpr, _ = roc_curve(y_true, y_scores, drop_intermediate=False)
+    np.testing.assert_allclose(fpr, expected_fpr)
+    np.testing.assert_allclose(tpr, expected_tpr)
+    assert thresholds.get_auc(fpr, tpr) == pytest.approx(roc_auc_score(y_true, y_scores))
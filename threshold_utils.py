@@ -0,0 +1,164 @@
+import numpy as np
+import pandas as pd
+
+
+def get_threshold_table(y_true, y_scores, pos_label=1, beta=1.0, cost_fp=1.0, cost_fn=1.0):
+    '''
+    Compute the confusion matrix, precision, recall, false positive rate, F-beta score and cost of every threshold of
+    binary scores. The scores are sorted once and the counts of all thresholds are cumulative sums, i.e. the table is
+    computed in O(n log n). A sample is predicted positive, if its score is >= the threshold. Each distinct score is a
+    threshold.
+
+    :args:
+        y_true: Binary labels
+        y_scores: Scores of the samples, e.g. the decision function or the probability of the positive class
+        pos_label: Label of the positive class
+        beta: Weight of the recall in the F-beta score
+        cost_fp: Cost of a false positive
+        cost_fn: Cost of a false negative
+    :return:
+        table: Data frame with one row per threshold in increasing order and the columns threshold, tp, fp, tn, fn,
+        precision, recall, fpr, f_beta and cost. Without predicted positives, the precision is 1
+    '''
+
+    y_true = np.asarray(y_true) == pos_label
+    y_scores = np.asarray(y_scores, dtype=np.float64)
+
+    order = np.argsort(y_scores, kind='mergesort')[::-1]
+    y_scores = y_scores[order]
+    y_true = y_true[order]
+
+    # Last position of each distinct score in the decreasing order
+    distinct_indices = np.where(np.diff(y_scores))[0]
+    threshold_indices = np.r_[distinct_indices, y_true.size - 1]
+    tp = np.cumsum(y_true)[threshold_indices]
+    fp = 1 + threshold_indices - tp
+    n_positives = int(y_true.sum())
+    n_negatives = y_true.size - n_positives
+    fn = n_positives - tp
+    tn = n_negatives - fp
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        precision = np.where(tp + fp > 0, tp / (tp + fp), 1.0)
+        recall = tp / n_positives if n_positives > 0 else np.zeros(tp.size)
+        fpr = fp / n_negatives if n_negatives > 0 else np.zeros(fp.size)
+        f_beta = np.where(precision + recall > 0,
+                          (1 + beta ** 2) * precision * recall / (beta ** 2 * precision + recall), 0.0)
+
+    table = pd.DataFrame({'threshold': y_scores[threshold_indices], 'tp': tp, 'fp': fp, 'tn': tn, 'fn': fn,
+                          'precision': precision, 'recall': recall, 'fpr': fpr, 'f_beta': f_beta,
+                          'cost': cost_fp * fp + cost_fn * fn})
+
+    return table.iloc[::-1].reset_index(drop=True)
+
+
+def get_precision_recall_curve(table):
+    '''
+    Get the precision recall curve from a threshold table in the format of sklearn precision_recall_curve, i.e. with
+    the additional point precision=1 and recall=0 without threshold
+
+    :args:
+        table: Threshold table of get_threshold_table
+    :return:
+        precision: Array of the precision of each threshold and 1
+        recall: Array of the recall of each threshold and 0
+        thresholds: Array of the increasing thresholds
+    '''
+
+    return np.r_[table['precision'].values, 1.0], np.r_[table['recall'].values, 0.0], table['threshold'].values
+
+
+def get_roc_curve(table):
+    '''
+    Get the roc curve from a threshold table in the format of sklearn roc_curve, i.e. starting at fpr=0 and tpr=0
+
+    :args:
+        table: Threshold table of get_threshold_table
+    :return:
+        fpr: Array of the increasing false positive rates
+        tpr: Array of the increasing true positive rates
+    '''
+
+    return np.r_[0.0, table['fpr'].values[::-1]], np.r_[0.0, table['recall'].values[::-1]]
+
+
+def get_auc(x, y):
+    '''
+    Area under a curve with the trapezoidal rule, e.g. for the roc curve of get_roc_curve
+
+    '''
+
+    return float(np.sum(np.diff(x) * (y[1:] + y[:-1]) / 2))
+
+
+def select_pr_break_even(table):
+    '''
+    Select the threshold, where precision and recall are closest
+
+    '''
+
+    return int(np.argmin(np.abs(table['precision'].values - table['recall'].values)))
+
+
+def select_max_f_beta(table):
+    '''
+    Select the threshold with the highest F-beta score
+
+    '''
+
+    return int(np.argmax(table['f_beta'].values))
+
+
+def select_min_cost(table):
+    '''
+    Select the threshold with the lowest cost of false positives and false negatives
+
+    '''
+
+    return int(np.argmin(table['cost'].values))
+
+
+# Objectives to select a threshold from a threshold table. Each function gets the table and returns the row index
+THRESHOLD_OBJECTIVES = {'pr_break_even': select_pr_break_even, 'max_f_beta': select_max_f_beta,
+                        'min_cost': select_min_cost}
+
+
+def select_threshold(table, objective='pr_break_even'):
+    '''
+    Select a threshold from a threshold table with an objective
+
+    :args:
+        table: Threshold table of get_threshold_table
+        objective: Name of an objective in THRESHOLD_OBJECTIVES or a function, which gets the table and returns the
+        row index
+    :return:
+        threshold: Selected threshold
+        row: Row of the threshold in the table as series
+    '''
+
+    if callable(objective):
+        select_function = objective
+    elif objective in THRESHOLD_OBJECTIVES:
+        select_function = THRESHOLD_OBJECTIVES[objective]
+    else:
+        raise Exception("Unknown threshold objective {}. Use one of {}".format(objective,
+                                                                               list(THRESHOLD_OBJECTIVES.keys())))
+
+    row = table.iloc[select_function(table)]
+
+    return float(row['threshold']), row
+
+
+def apply_threshold(y_scores, threshold):
+    '''
+    Get the binary class predictions of scores for a threshold. A sample is predicted positive, if its score is >=
+    the threshold.
+
+    :args:
+        y_scores: Scores of the samples
+        threshold: Threshold
+    :return:
+        y_pred: Array of 0 and 1
+    '''
+
+    return (np.asarray(y_scores) >= threshold).astype(int)
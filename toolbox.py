@@ -0,0 +1,117 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Toolbox command line: Run the pipeline steps in one interpreter
+License_info: ISC
+ISC License
+
+Copyright (c) 2020, Alexander Wendt
+
+Permission to use, copy, modify, and/or distribute this software for any
+purpose with or without fee is hereby granted, provided that the above
+copyright notice and this permission notice appear in all copies.
+
+THE SOFTWARE IS PROVIDED "AS IS" AND THE AUTHOR DISCLAIMS ALL WARRANTIES
+WITH REGARD TO THIS SOFTWARE INCLUDING ALL IMPLIED WARRANTIES OF
+MERCHANTABILITY AND FITNESS. IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR
+ANY SPECIAL, DIRECT, INDIRECT, OR CONSEQUENTIAL DAMAGES OR ANY DAMAGES
+WHATSOEVER RESULTING FROM LOSS OF USE, DATA OR PROFITS, WHETHER IN AN
+ACTION OF CONTRACT, NEGLIGENCE OR OTHER TORTIOUS ACTION, ARISING OUT OF
+OR IN CONNECTION WITH THE USE OR PERFORMANCE OF THIS SOFTWARE.
+"""
+
+# Futures
+#from __future__ import print_function
+
+# Built-in/Generic Imports
+
+# Libs
+import argparse
+import sys
+
+# Own modules
+import pipeline_utils as pipe
+import search_utils as search
+import sweep_utils as sweep
+
+__author__ = 'Alexander Wendt'
+__copyright__ = 'Copyright 2020, Christian Doppler Laboratory for ' \
+                'Embedded Machine Learning'
+__credits__ = ['']
+__license__ = 'ISC'
+__version__ = '0.2.0'
+__maintainer__ = 'Alexander Wendt'
+__email__ = 'alexander.wendt@tuwien.ac.at'
+__status__ = 'Experiental'
+
+parser = argparse.ArgumentParser(description='Machine Learning Toolbox - Run pipeline steps in one interpreter')
+subparsers = parser.add_subparsers(dest='command')
+
+parser_run = subparsers.add_parser('run', help='Run the steps of a pipeline')
+parser_run.add_argument("-conf", '--config_path', '--config', default="config/debug_timedata_omxs30.ini",
+                        help='Configuration file path', required=False)
+parser_run.add_argument("-p", '--pipeline', default="training", choices=list(pipe.PIPELINES.keys()),
+                        help='Pipeline to run. Default: training', required=False)
+parser_run.add_argument("-s", '--steps', default=None,
+                        help='Steps to run as ranges or comma separated list, e.g. 20-61 or 43,44. Default: all',
+                        required=False)
+parser_run.add_argument("-debug", '--debug_param', default=False, action='store_true',
+                        help='Use debug parameters in the steps 21 and 43')
+parser_run.add_argument("-j", '--cpus', default=None, type=int,
+                        help='Run independent steps in parallel with this number of cpu cores as budget. '
+                             'Default: sequential run', required=False)
+
+parser_importtime = subparsers.add_parser('importtime', help='Check the import time budget of the inference entry '
+                                                             'points with python -X importtime')
+
+parser_sweep = subparsers.add_parser('sweep', help='Expand a sweep manifest over tickers and targets and run all '
+                                                   'pipelines on a local job queue')
+parser_sweep.add_argument("-m", '--manifest', default="config/debug_sweep_omxs30.ini",
+                          help='Sweep manifest path', required=False)
+
+parser_benchmark = subparsers.add_parser('benchmark', help='Compare the SVM search with and without precomputed '
+                                                           'kernel matrices for each kernel on synthetic data')
+parser_benchmark.add_argument("-n", '--samples', default=2000, type=int,
+                              help='Number of samples of the synthetic data. Default: 2000', required=False)
+parser_benchmark.add_argument("-f", '--features', default=20, type=int,
+                              help='Number of features of the synthetic data. Default: 20', required=False)
+
+parser_benchmark_approximation = subparsers.add_parser('benchmark_approximation',
+                                                       help='Compare the accuracy and the training time of the exact '
+                                                            'rbf SVC and the approximated kernels at several sample '
+                                                            'sizes on synthetic data')
+parser_benchmark_approximation.add_argument("-n", '--samples', default="1000,4000,16000",
+                                            help='Comma separated numbers of training samples. '
+                                                 'Default: 1000,4000,16000', required=False)
+parser_benchmark_approximation.add_argument("-c", '--components', default=500, type=int,
+                                            help='Number of components of the approximated kernels. Default: 500',
+                                            required=False)
+
+
+if __name__ == "__main__":
+    args = parser.parse_args()
+
+    if args.command == 'run':
+        if args.cpus is None:
+            pipe.run_pipeline(args.config_path, pipeline_name=args.pipeline, selection=args.steps,
+                              debug=args.debug_param)
+        else:
+            pipe.run_pipeline_parallel(args.config_path, pipeline_name=args.pipeline, selection=args.steps,
+                                       debug=args.debug_param, cpu_budget=args.cpus)
+    elif args.command == 'importtime':
+        violations = pipe.check_import_times()
+        if len(violations) > 0:
+            print("Import time budget exceeded or import failed: ", violations)
+            sys.exit(1)
+    elif args.command == 'sweep':
+        sweep.run_sweep(args.manifest)
+    elif args.command == 'benchmark':
+        search.benchmark_precomputed_kernel(n_samples=args.samples, n_features=args.features)
+    elif args.command == 'benchmark_approximation':
+        search.benchmark_kernel_approximation(sample_sizes=[int(n) for n in args.samples.split(',')],
+                                              n_components=args.components)
+    else:
+        parser.print_help()
+
+    print("=== Program end ===")